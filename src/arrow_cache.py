@@ -0,0 +1,76 @@
+# src/arrow_cache.py
+# Cache das tabelas quentes (diário, semanal, dimensões) em Arrow IPC sem compressão,
+# em data/interim/arrow_cache/, aberto por memory map: ler não decodifica parquet nem copia
+# buffers. Cada entrada é endereçada pela impressão digital da origem (arquivos, tamanhos,
+# mtimes); se a origem muda, a próxima leitura materializa uma entrada nova e apaga a antiga.
+# ARROW_CACHE=0 desliga o cache (leitura direta do parquet); ARROW_CACHE_DIR troca o diretório.
+import hashlib
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from datasets import dataset_fingerprint, read_meta, read_table
+from instrument import span
+
+
+def cache_dir_for(source):
+    env = os.getenv("ARROW_CACHE_DIR")
+    if env:
+        return Path(env)
+    return Path(source).resolve().parent.parent / "interim" / "arrow_cache"   # data/interim
+
+
+def _entry(source, cache_dir):
+    source = Path(source).resolve()
+    where = hashlib.sha1(str(source).encode()).hexdigest()[:8]
+    fp = dataset_fingerprint(source)[:16]
+    prefix = f"{source.name.split('.')[0]}-{where}-"
+    return Path(cache_dir) / f"{prefix}{fp}.arrow", prefix
+
+
+def materialize(source, cache_dir=None):
+    """Garante a entrada IPC atual de `source` (tabela inteira) e devolve o caminho."""
+    cache_dir = Path(cache_dir) if cache_dir else cache_dir_for(source)
+    path, prefix = _entry(source, cache_dir)
+    if path.exists():
+        return path
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tbl = read_table(source, derived=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, tbl.schema) as writer:
+        writer.write_table(tbl)
+    os.replace(tmp, path)
+    for old in cache_dir.glob(f"{prefix}*.arrow"):   # versões anteriores da mesma origem
+        if old != path:
+            old.unlink(missing_ok=True)
+    return path
+
+
+def read_cached_table(source, columns=None, filters=None, cache_dir=None):
+    """Mesma interface de datasets.read_table, servida do cache IPC (mmap, sem cópia)."""
+    if os.getenv("ARROW_CACHE", "1") == "0":
+        return read_table(source, columns, filters)
+    with span(f"read_cached {Path(source).name}", "read", path=source) as sp:
+        tbl = _read_cached_table(source, columns, filters, cache_dir)
+        sp.set(rows=tbl.num_rows, bytes=tbl.nbytes)
+    return tbl
+
+
+def _read_cached_table(source, columns, filters, cache_dir):
+    path = materialize(source, cache_dir)
+    tbl = pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+    hidden = set(read_meta(source).get("derived", [])) if Path(source).is_dir() else set()
+    cols = columns or [c for c in tbl.schema.names if c not in hidden]
+    filters = [f for f in (filters or []) if f[0] in tbl.schema.names]
+    if filters:
+        return ds.dataset(tbl).to_table(columns=cols, filter=pq.filters_to_expression(filters))
+    return tbl.select(cols)
+
+
+def read_cached(source, columns=None, filters=None, cache_dir=None):
+    """Como datasets.read_dataset (DataFrame), via cache IPC."""
+    return read_cached_table(source, columns, filters, cache_dir).to_pandas(split_blocks=True)
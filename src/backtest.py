@@ -0,0 +1,175 @@
+# src/backtest.py
+# Backtest com origens móveis: K cutoffs semanais sobre o ano, cada fold prevê as H semanas
+# seguintes com todos os modelos e é avaliado com eval_engine (mesmas linhas para todos).
+# As features móveis (MA4/MA8, última observação) são calculadas uma única vez sobre o
+# WeeklyStore — por observação — e cada fold só as indexa na última observação até o seu
+# cutoff. Os folds rodam em processos paralelos que herdam os arrays já prontos.
+import argparse
+import multiprocessing as mp
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import resolve_project_dir
+from eval_engine import evaluate
+from fit_cache import FitCache
+from models import SeriesBatch, allocate, get_model, load_plugins, model_names
+from prophet_engine import MIN_TRAIN_WEEKS
+from weekly_store import WeeklyStore
+
+_CTX = {}   # store + features compartilhadas com os processos dos folds (preenchido antes do fork)
+
+
+def make_context(store, models):
+    """Features reutilizadas por todos os folds: cada modelo roda uma vez num lote vazio,
+    o que calcula (e guarda em `shared`) as features por observação de que ele depende."""
+    shared = {}
+    empty = SeriesBatch(store, len(store.weeks) - 1, 1, series=[], shared=shared)
+    empty.dense()   # matriz densa: volume do ranking do ensemble
+    for name in models:
+        get_model(name).predict(empty)
+    return {"store": store, "shared": shared}
+
+
+def origins(weeks, folds, horizon, step=1, year=None):
+    """Índices dos cutoffs (última semana de treino): os `folds` mais recentes com horizonte completo."""
+    weeks = pd.DatetimeIndex(weeks)
+    last = len(weeks) - 1 - horizon
+    if year is not None:
+        in_year = np.flatnonzero(weeks.isocalendar().year.to_numpy() == year)
+        last = min(last, int(in_year.max()) - horizon) if len(in_year) else -1
+    cands = list(range(last, MIN_TRAIN_WEEKS - 2, -step))[:folds]
+    return sorted(cands)
+
+
+def _init_worker(ctx):
+    load_plugins()
+    _CTX.update(ctx)
+
+
+def run_fold(task):
+    """Métricas de um fold: todos os modelos nas linhas observadas de (cutoff, cutoff + H]."""
+    fold, c, horizon, models, top_n, holt_n, cache_dir = task
+    store = _CTX["store"]
+    batch = SeriesBatch(store, c, horizon, shared=_CTX["shared"])
+
+    # modelos vetorizados no lote inteiro; sem previsão → MA4 → 0
+    preds = {name: get_model(name).predict(batch) for name in models}
+    ma4 = np.nan_to_num(preds["ma4"], nan=0.0)
+    for name, p in preds.items():
+        preds[name] = np.where(np.isnan(p), ma4, p)
+
+    # ensemble como em forecast_ensemble: Prophet no Top-N por volume até o cutoff,
+    # Holt nos `holt_n` seguintes (-1 = todos), MA4 no resto
+    vol = batch.dense().sum(axis=1)
+    ranked = np.lexsort((np.asarray(store.produto), np.asarray(store.pdv), -vol))
+    ranked = ranked[batch.n_obs[ranked] > 0]
+    prophet = get_model("prophet", engine=dict(n_jobs=1, progress=False,
+                                               cache=FitCache(cache_dir) if cache_dir else None))
+    ens = ma4.copy()
+    tiers = allocate(len(ranked), [(prophet, top_n), (get_model("holt"), holt_n)])
+    for model, idx in tiers:
+        rows = ranked[idx]
+        p = preds[model.name][rows] if model.name in preds else model.predict(batch.subset(rows))
+        ens[rows] = np.where(np.isnan(p), ma4[rows], p)
+        if model is prophet:
+            top, prophet_top = rows, p
+    preds["ensemble"] = np.round(np.clip(ens, 0, None))
+
+    # linhas avaliadas: observações nas semanas do horizonte
+    week = np.asarray(store.week)
+    mask = (week > c) & (week <= c + horizon)
+    r, h = store.row_ids()[mask], week[mask] - c - 1
+    y = np.asarray(store.values, dtype=np.float64)[mask]
+    names = list(preds)
+    P = np.column_stack([preds[n][r, h] for n in names])
+
+    out = []
+    subsets = {"all": np.ones(len(y), dtype=bool)}
+    if len(top):
+        # Top-N: Prophet puro contra os demais nas mesmas linhas
+        pos = np.full(len(store), -1)
+        pos[top] = np.arange(len(top))
+        subsets["top_n"] = pos[r] >= 0
+    for name, sub in subsets.items():
+        p, cols = P[sub], list(names)
+        if name == "top_n":
+            p = np.column_stack([p, np.nan_to_num(prophet_top[pos[r[sub]], h[sub]], nan=0.0)])
+            cols.append("prophet")
+        overall, _ = evaluate(y[sub], p, cols, {})
+        overall.insert(0, "subset", name)
+        overall["n_rows"] = int(sub.sum())
+        out.append(overall)
+    res = pd.concat(out, ignore_index=True)
+    res.insert(0, "cutoff", pd.Timestamp(store.weeks[c]))
+    res.insert(0, "fold", fold)
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--folds", type=int, default=10, help="Número de origens (cutoffs)")
+    parser.add_argument("--horizon", type=int, default=4, help="Semanas previstas por fold")
+    parser.add_argument("--step", type=int, default=1, help="Semanas entre origens consecutivas")
+    parser.add_argument("--year", type=int, default=2022, help="Ano ISO das semanas avaliadas")
+    parser.add_argument("--top_n", type=int, default=50,
+                        help="Pares (por volume até o cutoff) com Prophet no ensemble; 0 desliga")
+    parser.add_argument("--holt_n", type=int, default=0,
+                        help="Pares seguintes ao Top-N com Holt no ensemble (-1 = todos os demais)")
+    parser.add_argument("--n_jobs", type=int, default=1,
+                        help="Processos para os folds (<=0 usa todos os núcleos)")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Cache de ajustes Prophet (ver fit_cache.py) compartilhado entre execuções")
+    parser.add_argument("--models", type=str, default=None,
+                        help="Modelos vetorizados avaliados isoladamente (vírgula; padrão: todos os registrados)")
+    args = parser.parse_known_args()[0]
+    load_plugins()
+    models = args.models.split(",") if args.models else model_names(vectorized=True)
+    if "ma4" not in models:
+        models.append("ma4")   # fallback de todos os níveis
+
+    PROJECT_DIR = resolve_project_dir()
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    report_dir = PROJECT_DIR / "reports"
+    report_dir.mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    store = WeeklyStore.open(proc_dir / "weekly_store", proc_dir / "train_weekly_splits.parquet")
+    ctx = make_context(store, models)
+    cuts = origins(store.weeks, args.folds, args.horizon, args.step, args.year)
+    if not cuts:
+        raise SystemExit("Sem semanas suficientes para nenhuma origem.")
+    print(f"{len(cuts)} folds | cutoffs {pd.Timestamp(store.weeks[cuts[0]]).date()} → "
+          f"{pd.Timestamp(store.weeks[cuts[-1]]).date()} | {len(store):,} séries")
+
+    tasks = [(i, c, args.horizon, models, args.top_n, args.holt_n, args.cache_dir) for i, c in enumerate(cuts)]
+    n_jobs = mp.cpu_count() if args.n_jobs <= 0 else args.n_jobs
+    if n_jobs == 1 or len(tasks) == 1:
+        _init_worker(ctx)
+        results = [run_fold(t) for t in tasks]
+    else:
+        with mp.get_context().Pool(min(n_jobs, len(tasks)), initializer=_init_worker,
+                                   initargs=(ctx,)) as pool:
+            results = list(pool.imap_unordered(run_fold, tasks))
+
+    folds = pd.concat(results, ignore_index=True).sort_values(["subset", "fold", "modelo"], ignore_index=True)
+    table = folds[folds["subset"].eq("all")].pivot(index=["fold", "cutoff"], columns="modelo",
+                                                  values="WMAPE_overall")[models + ["ensemble"]]
+    summary = table.agg(["mean", "std"])
+
+    folds_path = report_dir / "backtest_folds.csv"
+    table_path = report_dir / "backtest_wmape.csv"
+    folds.to_csv(folds_path, index=False)
+    pd.concat([table.reset_index(), summary.reset_index(names="fold")], ignore_index=True).to_csv(
+        table_path, index=False)
+
+    print(table.to_string(float_format="{:.4f}".format))
+    print(summary.to_string(float_format="{:.4f}".format))
+    print(f"Tempo total: {time.perf_counter() - t0:.1f}s")
+    print(folds_path)
+    print(table_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 # src/baseline_forecast.py
 from pathlib import Path
-import pandas as pd
+import numpy as np
+from arrow_cache import read_cached
+from datasets import write_file
+from key_encoding import decode_keys
+from models import to_long
 
 # === Parâmetros ===
 N_SEMANAS_MEDIA = 8       # janelas de média
@@ -9,8 +13,9 @@ N_SEMANAS_JAN   = 5       # gerar 4 ou 5 semanas (ajuste aqui)
 base_dir = Path(__file__).resolve().parents[1]
 data_proc = base_dir / "data" / "processed"
 
-# === Carregar transações diárias ===
-df = pd.read_parquet(data_proc / "transacoes_2022_diarias.parquet")
+# === Carregar transações diárias (só as últimas N semanas ISO de 2022) ===
+df = read_cached(data_proc / "transacoes_2022_diarias.parquet",
+                  filters=[("ano_iso", "=", 2022), ("semana_iso", ">", 52 - N_SEMANAS_MEDIA)])
 
 # === Agregar por semana ISO ===
 df["ano"] = df["data"].dt.isocalendar().year
@@ -27,12 +32,10 @@ df_baseline = (last_weeks
                .mean()
                .rename(columns={"quantidade":"qtd_prev"}))
 
-# === Replicar previsão para semanas de janeiro/2023 ===
-df_forecast = pd.DataFrame(
-    [(w,p,s,q) for w in range(1, N_SEMANAS_JAN+1)
-                for _,(p,s,q) in df_baseline.iterrows()],
-    columns=["semana","pdv","produto","qtd_prev"]
-)
+# === Replicar previsão para semanas de janeiro/2023 (pares × semanas → formato longo) ===
+qtd = df_baseline["qtd_prev"].to_numpy()
+df_forecast = to_long(df_baseline["pdv"], df_baseline["produto"], range(1, N_SEMANAS_JAN+1),
+                      np.repeat(qtd[:, None], N_SEMANAS_JAN, axis=1), col="qtd_prev")
 
 # === Ajustes finais ===
 df_forecast["quantidade"] = (df_forecast["qtd_prev"]
@@ -45,8 +48,8 @@ df_forecast = df_forecast.drop(columns=["qtd_prev"])
 out_csv = data_proc / "baseline_forecast.csv"
 out_parquet = data_proc / "baseline_forecast.parquet"
 
-df_forecast.to_csv(out_csv, sep=";", index=False, encoding="utf-8")
-df_forecast.to_parquet(out_parquet, index=False)
+write_file(decode_keys(df_forecast.copy(), data_proc), out_csv, sep=";", encoding="utf-8")
+write_file(df_forecast, out_parquet)
 
 print("Salvos:")
 print(" -", out_csv)
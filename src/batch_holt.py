@@ -0,0 +1,110 @@
+# src/batch_holt.py
+# Holt amortecido (tendência linear amortecida) ajustado em lote para todas as séries:
+# uma matriz densa semanas × pares e a recursão de suavização feita em NumPy, um vetor
+# por semana. Cada série escolhe (alpha, beta) da grade pelo menor erro um passo à frente.
+import numpy as np
+import pandas as pd
+
+from instrument import span
+from prophet_engine import MIN_TRAIN_WEEKS
+
+ALPHAS = (0.1, 0.2, 0.3, 0.5, 0.8)
+BETAS = (0.0, 0.05, 0.1, 0.2)   # beta = 0: suavização exponencial simples
+PHI = 0.9                       # amortecimento da tendência
+
+
+def weekly_matrix(wk, key, cutoff, col="y", weeks=None):
+    """Histórico até o cutoff como matriz densa (semanas × pares); semana sem linha = 0.
+
+    `weeks` é o calendário global de semanas; sem ele, o calendário sai das semanas de `wk`,
+    o que só vale quando `wk` tem todos os pares (um subconjunto pode não ter linhas em
+    alguma semana, que então sumiria das séries em vez de contar como zero).
+    Devolve (pares, Y, first, n_obs): `pares` com as colunas de `key` na ordem das
+    colunas de Y, `first` = índice da primeira semana observada de cada par.
+    """
+    hist = wk[wk["semana"] <= cutoff]
+    cal = pd.DatetimeIndex(hist["semana"].unique() if weeks is None else weeks).unique()
+    weeks = np.sort(cal[cal <= cutoff].astype(hist["semana"].dtype).to_numpy())
+    pdv_codes, pdv_uni = pd.factorize(hist[key[0]], sort=True)
+    prod_codes, prod_uni = pd.factorize(hist[key[1]], sort=True)
+    n_prod = max(len(prod_uni), 1)
+    uniq, inv = np.unique(pdv_codes.astype(np.int64) * n_prod + prod_codes, return_inverse=True)
+    t = np.searchsorted(weeks, hist["semana"].to_numpy())
+
+    Y = np.zeros((len(weeks), len(uniq)), dtype=np.float32)
+    Y[t, inv] = np.nan_to_num(hist[col].to_numpy(dtype=np.float32), nan=0.0)
+    first = np.full(len(uniq), len(weeks), dtype=np.int64)
+    np.minimum.at(first, inv, t)
+    n_obs = np.bincount(inv, minlength=len(uniq))
+
+    pairs = pd.DataFrame({key[0]: np.asarray(pdv_uni)[uniq // n_prod],
+                          key[1]: np.asarray(prod_uni)[uniq % n_prod]})
+    return pairs, Y, first, n_obs
+
+
+def holt_batch(Y, first, horizon, alphas=ALPHAS, betas=BETAS, phi=PHI, block=8192):
+    """Previsões (pares × horizon) do Holt amortecido, com (alpha, beta) escolhidos por série.
+
+    A grade inteira roda junta (matrizes grade × bloco de pares, operações in-place),
+    em blocos de `block` pares para os vetores de estado caberem em cache.
+    """
+    with span("holt_batch", "fit", rows=Y.shape[1]):
+        return _holt_batch(Y, first, horizon, alphas, betas, phi, block)
+
+
+def _holt_batch(Y, first, horizon, alphas, betas, phi, block):
+    T, n = Y.shape
+    grid = [(a, b) for a in alphas for b in betas]
+    A = np.array([a for a, _ in grid], dtype=np.float32)[:, None]
+    AB = np.array([a * b for a, b in grid], dtype=np.float32)[:, None]
+    steps = np.cumsum(phi ** np.arange(1, horizon + 1)).astype(np.float32)
+    out = np.zeros((n, horizon), dtype=np.float32)
+
+    for s in range(0, n, block):
+        Yb, fb = Y[:, s:s + block], first[s:s + block]
+        shape = (len(grid), Yb.shape[1])
+        level, trend, sse = (np.zeros(shape, dtype=np.float32) for _ in range(3))
+        fc, err, tmp = (np.empty(shape, dtype=np.float32) for _ in range(3))
+        for t in range(int(fb.min()), T):
+            # antes da 1ª observação y = 0 e o estado fica em 0; o erro na 1ª observação
+            # é o mesmo para toda a grade, então não altera a escolha
+            np.multiply(trend, phi, out=fc)
+            fc += level
+            np.subtract(Yb[t], fc, out=err)
+            np.multiply(err, err, out=tmp)
+            sse += tmp
+            np.multiply(err, A, out=level)
+            level += fc
+            trend *= phi
+            np.multiply(err, AB, out=tmp)
+            trend += tmp
+            start = np.flatnonzero(fb == t)
+            if len(start):  # 1ª observação: nível = y, tendência = 0
+                level[:, start] = Yb[t, start]
+                trend[:, start] = 0.0
+        cols = np.arange(shape[1])
+        best = sse.argmin(axis=0)
+        out[s:s + block] = level[best, cols][:, None] + steps * trend[best, cols][:, None]
+    return np.clip(out, 0, None)
+
+
+def fit_predict_holt(wk, key, cutoff, forecast_weeks, pairs=None, min_obs=MIN_TRAIN_WEEKS, weeks=None):
+    """Previsão em lote (semana, pdv, produto, yhat) para os pares de `wk` — ou só de
+    `pairs` — com pelo menos `min_obs` semanas observadas até o cutoff. `weeks`: calendário
+    global (ver weekly_matrix); sem ele, o de `wk` antes do filtro por `pairs`."""
+    if weeks is None:
+        weeks = wk["semana"].unique()
+    if pairs is not None:
+        wk = wk.merge(pairs[key].drop_duplicates(), on=key, how="inner")
+    ids, Y, first, n_obs = weekly_matrix(wk, key, cutoff, weeks=weeks)
+    keep = n_obs >= min_obs
+    ids = ids[keep]
+    fc = holt_batch(Y[:, keep], first[keep], len(forecast_weeks))
+
+    h = len(forecast_weeks)
+    return pd.DataFrame({
+        "semana": np.tile(pd.DatetimeIndex(forecast_weeks).to_numpy(), len(ids)),
+        key[0]: np.repeat(ids[key[0]].to_numpy(), h),
+        key[1]: np.repeat(ids[key[1]].to_numpy(), h),
+        "yhat": fc.ravel().astype(float),
+    })
@@ -0,0 +1,109 @@
+# src/bench_tail_ma4.py
+# Benchmark da cauda MA4 do ensemble: implementação anterior (groupby.apply + cross join)
+# vs. build_tail_ma4 vetorizada, em dados sintéticos com N pares.
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import resolve_project_dir
+from forecast_ensemble import build_tail_ma4
+
+
+def synthetic_weekly(n_pairs, weeks_per_pair, seed=0):
+    rng = np.random.default_rng(seed)
+    weeks = pd.date_range("2022-01-03", "2022-12-26", freq="W-MON")
+    n_pdv = max(1, int(np.sqrt(n_pairs)))
+    pair_ids = rng.choice(n_pdv * n_pdv * 4, size=n_pairs, replace=False)
+    n_obs = rng.integers(1, 2 * weeks_per_pair, size=n_pairs)
+    rows = np.repeat(pair_ids, n_obs)
+    w = rng.integers(0, len(weeks), size=len(rows))
+    wk = pd.DataFrame({
+        "semana": weeks.to_numpy()[w],
+        "pdv": pd.array((rows // (n_pdv * 4)).astype(str), dtype="string"),
+        "produto": pd.array((rows % (n_pdv * 4)).astype(str), dtype="string"),
+        "y": rng.poisson(3, size=len(rows)).astype(float),
+    }).drop_duplicates(["semana", "pdv", "produto"])
+    return wk.reset_index(drop=True)
+
+
+def legacy_tail_ma4(wk, key, cutoff, forecast_weeks, prophet_pairs):
+    wk_sorted = wk.sort_values(key+["semana"]).copy()
+    wk_sorted["ma4"] = wk_sorted.groupby(key)["y"].rolling(4, min_periods=1).mean().reset_index(level=key, drop=True)
+
+    last_train = wk_sorted[wk_sorted["semana"] <= cutoff]
+    last_ma4 = (last_train.groupby(key, as_index=False)
+                .apply(lambda s: s.iloc[-1][["ma4"]])
+                .reset_index(drop=True))
+    last_ma4["ma4"] = last_ma4["ma4"].fillna(0).clip(lower=0)
+
+    all_pairs = set(zip(wk[key[0]].astype(str), wk[key[1]].astype(str)))
+    tail_pairs = all_pairs.difference(prophet_pairs)
+    tail_df = pd.DataFrame(list(tail_pairs), columns=key)
+
+    tail_base = (tail_df.merge(last_ma4, on=key, how="left").fillna({"ma4":0}))
+    tail_base = tail_base.assign(_k=1).merge(
+        pd.DataFrame({"semana": forecast_weeks, "_k":[1,1,1,1]}),
+        on="_k", how="left").drop(columns="_k")
+    return tail_base.rename(columns={"ma4":"quantidade"})
+
+
+def _canon(df):
+    out = df[["semana", "pdv", "produto", "quantidade"]].copy()
+    out["pdv"] = out["pdv"].astype(str)
+    out["produto"] = out["produto"].astype(str)
+    out["quantidade"] = out["quantidade"].astype(float)
+    return out.sort_values(["semana", "pdv", "produto"]).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, default=1_000_000)
+    parser.add_argument("--weeks_per_pair", type=int, default=6)
+    parser.add_argument("--top_n", type=int, default=200, help="Pares excluídos (simulando o Prophet)")
+    parser.add_argument("--legacy_max_pairs", type=int, default=100_000,
+                        help="Acima disso, a versão anterior roda numa amostra e o tempo é extrapolado")
+    parser.add_argument("--skip_legacy", action="store_true")
+    args = parser.parse_args()
+
+    key = ["pdv", "produto"]
+    cutoff = pd.Timestamp("2022-12-26")
+    forecast_weeks = pd.to_datetime(["2023-01-02","2023-01-09","2023-01-16","2023-01-23"])
+
+    t0 = time.perf_counter()
+    wk = synthetic_weekly(args.pairs, args.weeks_per_pair)
+    print(f"dados: {len(wk):,} linhas | {args.pairs:,} pares | {time.perf_counter() - t0:.1f}s")
+    excl = wk[key].drop_duplicates().head(args.top_n)
+
+    t0 = time.perf_counter()
+    new = build_tail_ma4(wk, key, cutoff, forecast_weeks, exclude=excl)
+    t_new = time.perf_counter() - t0
+    print(f"vetorizado: {t_new:.2f}s | linhas={len(new):,}")
+
+    rec = {"pairs": args.pairs, "rows": len(wk), "vectorized_s": t_new}
+    if not args.skip_legacy:
+        sub, k = wk, args.pairs
+        if args.pairs > args.legacy_max_pairs:
+            keep = wk[key].drop_duplicates().head(args.legacy_max_pairs)
+            sub = wk.merge(keep, on=key, how="inner")
+            k = len(keep)
+        ref = build_tail_ma4(sub, key, cutoff, forecast_weeks, exclude=excl)
+        t0 = time.perf_counter()
+        old = legacy_tail_ma4(sub, key, cutoff, forecast_weeks,
+                              set(zip(excl["pdv"].astype(str), excl["produto"].astype(str))))
+        t_old = (time.perf_counter() - t0) * args.pairs / k
+        same = len(old) == len(ref) and np.allclose(_canon(old)["quantidade"], _canon(ref)["quantidade"])
+        est = " (extrapolado de %s pares)" % f"{k:,}" if k < args.pairs else ""
+        print(f"anterior  : {t_old:.2f}s{est} | speedup={t_old / t_new:.1f}x | iguais={same}")
+        rec.update({"legacy_s": t_old, "legacy_pairs_measured": k,
+                    "speedup": t_old / t_new, "identical": bool(same)})
+
+    out_csv = resolve_project_dir() / "reports" / "_bench_tail_ma4.csv"
+    out_csv.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame([rec]).to_csv(out_csv, index=False)
+    print(out_csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# src/bench_warm_start.py
+# Benchmark do warm start do Prophet: simula a execução da semana anterior (cutoff − 1 semana)
+# para gravar os parâmetros, e então ajusta o cutoff de val4 a frio e a partir desses
+# parâmetros, comparando tempo de parede, CPU dos ajustes e WMAPE em val4 nas Top-N séries.
+import argparse
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import resolve_project_dir
+from models import SeriesBatch, get_model
+from weekly_store import WeeklyStore
+
+
+def run(prophet, batch):
+    t0 = time.perf_counter()
+    fc = prophet.predict_series(batch.history(), batch.future, total=len(batch), cutoff=batch.cutoff_date)
+    return fc, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top_n", type=int, default=200, help="Séries (por volume até o cutoff)")
+    parser.add_argument("--n_jobs", type=int, default=1)
+    parser.add_argument("--chunksize", type=int, default=8)
+    args = parser.parse_known_args()[0]
+
+    PROJECT_DIR = resolve_project_dir()
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    warm_dir = PROJECT_DIR / "data" / "interim" / "warm_start_bench"
+    store = WeeklyStore.open(proc_dir / "weekly_store", proc_dir / "train_weekly_splits.parquet")
+
+    # cutoff = semana anterior a val4; horizonte = as 4 semanas de val4
+    val4 = np.flatnonzero(np.asarray(store.week_label) == list(store.labels).index("val4"))
+    cutoff, horizon = int(val4[0]) - 1, len(val4)
+    full = SeriesBatch(store, cutoff, horizon)
+    top = np.lexsort((np.asarray(store.produto), np.asarray(store.pdv), -full.dense().sum(axis=1)))
+    top = top[full.n_obs[top] > 0][:args.top_n]
+    batch = full.subset(top)
+    prev = SeriesBatch(store, cutoff - 1, horizon, series=batch.series, shared=batch.shared)
+
+    engine = dict(n_jobs=args.n_jobs, chunksize=args.chunksize, progress=False)
+    shutil.rmtree(warm_dir, ignore_errors=True)
+    _, t_prev = run(get_model("prophet", engine=engine).warm_start(warm_dir), prev)
+    print(f"execução anterior ({prev.cutoff_date.date()}): {len(batch)} séries em {t_prev:.1f}s")
+
+    # verdade em val4 (linhas observadas) e MA4 no cutoff como fallback
+    week = np.asarray(store.week)
+    pos = np.full(len(store), -1)
+    pos[batch.series] = np.arange(len(batch))
+    mask = (week > cutoff) & (week <= cutoff + horizon) & (pos[store.row_ids()] >= 0)
+    r, h = pos[store.row_ids()[mask]], week[mask] - cutoff - 1
+    y = np.asarray(store.values, dtype=float)[mask]
+    ma4 = np.nan_to_num(get_model("ma4").predict(batch), nan=0.0)
+
+    rows = []
+    for name, model in [("cold", get_model("prophet", engine=engine)),
+                        ("warm", get_model("prophet", engine=engine).warm_start(warm_dir))]:
+        fc, wall = run(model, batch)
+        yhat = np.clip(fc["yhat"].to_numpy().reshape(len(batch), horizon), 0, None)
+        yhat = np.where(np.isnan(yhat), ma4, yhat)[r, h]
+        starts = fc["start"].to_numpy()[::horizon]
+        rows.append({"run": name, "n_series": len(batch), "wall_s": round(wall, 2),
+                     "fit_cpu_s": round(float(fc["fit_seconds"].sum() / horizon), 2),
+                     "wmape_val4": float(np.abs(y - yhat).sum() / max(np.abs(y).sum(), 1e-12)),
+                     "n_warm": int((starts == "warm").sum()),
+                     "n_warm_falhou": int((starts == "warm_falhou").sum())})
+    shutil.rmtree(warm_dir, ignore_errors=True)
+
+    res = pd.DataFrame(rows)
+    out = PROJECT_DIR / "reports" / "_warm_start_bench.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    res.to_csv(out, index=False)
+    print(res.to_string(index=False))
+    print(f"speedup warm/cold: {res['wall_s'].iloc[0] / max(res['wall_s'].iloc[1], 1e-9):.2f}x")
+    print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# src/cli.py
+# Ponto de entrada único: `python src/cli.py <etapa> [args da etapa]`. Só o módulo da etapa
+# escolhida é importado (dependências pesadas — prophet/cmdstanpy, scikit-learn — ficam
+# dentro dos caminhos que as usam), e o tempo de partida a frio (imports do módulo) e o de
+# execução são reportados por subcomando. `python src/cli.py coldstart` mede a partida de
+# todos os subcomandos em interpretadores novos e grava reports/_cold_start.csv.
+# Toda execução por aqui é instrumentada (instrument.py): reports/_trace_<subcomando>.json e
+# uma linha em reports/_trace_history.jsonl; TRACE_PROFILE=1 grava também o cProfile.
+#
+#   python src/cli.py forecast_ensemble --no-prophet
+#   python src/cli.py train_prophet_topn --top_n 200 --n_jobs 8
+import ast
+import importlib
+import runpy
+import subprocess
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from instrument import Trace, span
+
+SRC_DIR = Path(__file__).resolve().parent
+COMMANDS = {
+    "process_transacoes": "Ingestão das transações (data/raw)",
+    "process_pdvs": "Cadastro de PDVs",
+    "process_produtos": "Cadastro de produtos",
+    "prepare_transacoes_diarias": "Transações → diário",
+    "prepare_data": "Série semanal (train_weekly)",
+    "make_splits": "Splits train/val8/val4",
+    "weekly_store": "Reconstrói o WeeklyStore (CSR)",
+    "train_baselines": "Baselines (MA4, MA8, ...)",
+    "evaluate_baselines": "Avaliação dos baselines",
+    "train_holt_batch": "Holt em lote",
+    "train_prophet_topn": "Prophet Top-N",
+    "tune_prophet_topn": "Busca de hiperparâmetros do Prophet",
+    "forecast_ensemble": "Ensemble jan/2023 (--no-prophet: sem nível Prophet)",
+    "forecast_horizon": "Previsão de qualquer horizonte",
+    "backtest": "Backtest com origens móveis",
+    "make_submission": "CSV de submissão",
+    "pipeline": "Executor das etapas com memoização",
+}
+
+
+def top_level_imports(module):
+    """Módulos importados no topo do script (os imports dentro de funções ficam de fora)."""
+    tree = ast.parse((SRC_DIR / f"{module}.py").read_text(encoding="utf-8"))
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names += [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return names
+
+
+def load(module):
+    """Importa as dependências de topo do subcomando; devolve os segundos gastos."""
+    t0 = time.perf_counter()
+    for name in top_level_imports(module):
+        importlib.import_module(name)
+    return time.perf_counter() - t0
+
+
+def coldstart():
+    rows = []
+    for cmd in COMMANDS:
+        code = (f"import time; t = time.perf_counter(); import sys; sys.path.insert(0, {str(SRC_DIR)!r}); "
+                f"import cli; cli.load({cmd!r}); print(time.perf_counter() - t)")
+        t0 = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        wall = time.perf_counter() - t0
+        imports = float(out.stdout.strip().splitlines()[-1]) if out.returncode == 0 else float("nan")
+        rows.append((cmd, round(imports, 3), round(wall, 3)))
+        print(f"{cmd:<28} imports {imports:6.2f}s | processo {wall:6.2f}s")
+
+    from common import resolve_project_dir
+    out = resolve_project_dir() / "reports" / "_cold_start.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text("subcomando,imports_s,processo_s\n" + "".join(f"{c},{i},{w}\n" for c, i, w in rows),
+                   encoding="utf-8")
+    print(out)
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print("uso: python src/cli.py <subcomando> [args]\n")
+        for cmd, doc in {**COMMANDS, "coldstart": "Mede a partida a frio de cada subcomando"}.items():
+            print(f"  {cmd:<28} {doc}")
+        return
+    cmd = sys.argv[1]
+    if cmd == "coldstart":
+        return coldstart()
+    if cmd not in COMMANDS:
+        raise SystemExit(f"Subcomando desconhecido: {cmd} (python src/cli.py --help)")
+
+    sys.argv = [str(SRC_DIR / f"{cmd}.py")] + sys.argv[2:]
+    # o executor não é traçado: cada etapa roda por cli.py em seu próprio processo
+    with Trace(cmd) if cmd != "pipeline" else nullcontext():
+        with span("imports", "import"):
+            t_import = load(cmd)
+        t0 = time.perf_counter()
+        try:
+            runpy.run_path(sys.argv[0], run_name="__main__")
+        finally:
+            print(f"[{cmd}] partida {t_import:.2f}s | execução {time.perf_counter() - t0:.2f}s",
+                  file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
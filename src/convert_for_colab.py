@@ -1,18 +1,15 @@
 # src/convert_for_colab.py
-from pathlib import Path
-import pandas as pd
-
-BASE = Path(r"C:\Users\guede\OneDrive\Documentos\Hackathon\Bigdata\Arquivos\hackathon-forecast-2025")
-PROC = BASE / "data" / "processed"
-
-in_parquet  = PROC / "transacoes_2022_diarias.parquet"
-out_feather = PROC / "transacoes_2022_diarias.feather"
-
-print("lendo:", in_parquet)
-df = pd.read_parquet(in_parquet, columns=["data","pdv","produto","quantidade"])
-print("shape:", df.shape, "| colunas:", list(df.columns))
-
-print("salvando Feather:", out_feather)
-df.to_feather(out_feather, compression="zstd")  # compacto e rápido
-
-print("ok:", out_feather, "| tamanho (MB):", round(out_feather.stat().st_size/1024/1024,2))
+# Materializa as tabelas quentes (diário e semanal) no cache Arrow IPC (src/arrow_cache.py).
+# Qualquer script que leia via read_cached passa a abri-las por memory map, sem decodificar parquet.
+from arrow_cache import materialize
+from common import resolve_project_dir
+
+PROC = resolve_project_dir() / "data" / "processed"
+
+for name in ["transacoes_2022_diarias.parquet", "train_weekly_splits.parquet"]:
+    src = PROC / name
+    if not src.exists():
+        print("ausente:", src)
+        continue
+    out = materialize(src)
+    print("ok:", out, "| tamanho (MB):", round(out.stat().st_size/1024/1024,2))
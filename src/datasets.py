@@ -0,0 +1,252 @@
+# src/datasets.py
+# Escrita/leitura dos artefatos processados como datasets Parquet particionados (Hive),
+# com leitura via filtros do pyarrow.dataset (predicate pushdown por partição e por
+# estatísticas de row group). O caminho continua o mesmo (ex.: `train_weekly_splits.parquet`),
+# só que agora é um diretório; arquivos únicos antigos continuam legíveis.
+import hashlib
+import json
+import shutil
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from instrument import path_bytes, span
+
+META_FILE = "_dataset.json"   # prefixo "_" é ignorado pelo pyarrow na descoberta
+ROW_GROUP_SIZE = 256_000
+
+
+def with_iso_week(df, date_col, prefix=""):
+    """Adiciona ano/semana ISO (ano_iso, semana_iso) derivados de `date_col`."""
+    iso = df[date_col].dt.isocalendar()
+    df[f"{prefix}ano_iso"] = iso["year"].astype("int16").to_numpy()
+    df[f"{prefix}semana_iso"] = iso["week"].astype("int8").to_numpy()
+    return df
+
+
+DAILY_PARTITIONS = ["ano_iso", "semana_iso"]
+
+
+def write_daily(df, path, existing="replace"):
+    """Transações diárias particionadas por ano/semana ISO (ordenadas por pdv/produto/data)."""
+    return write_dataset(with_iso_week(df, "data"), path, DAILY_PARTITIONS,
+                         derived=DAILY_PARTITIONS, sort_by=["pdv", "produto", "data"],
+                         existing=existing)
+
+
+def read_meta(path):
+    p = Path(path) / META_FILE
+    return json.loads(p.read_text(encoding="utf-8")) if p.exists() else {}
+
+
+def write_dataset(df, path, partition_cols=(), derived=(), sort_by=None, pdv_buckets=None,
+                  row_group_size=ROW_GROUP_SIZE, existing="replace"):
+    """Grava `df` como dataset Hive particionado por `partition_cols`.
+
+    `derived` lista colunas criadas só para particionar (não voltam na leitura
+    padrão). `sort_by` ordena dentro das partições para estatísticas de row group
+    úteis nos filtros. `pdv_buckets=N` acrescenta a partição pdv_bucket = pdv % N
+    (pdv em códigos int32). `existing="replace"` troca o dataset inteiro (atomicamente);
+    `"partitions"` reescreve só as partições presentes em `df`.
+    """
+    path = Path(path)
+    with span(f"write {path.name}", "write", rows=len(df), path=path) as sp:
+        _write_dataset(df, path, list(partition_cols), list(derived), sort_by, pdv_buckets,
+                       row_group_size, existing)
+        sp.set(bytes=path_bytes(path))
+    return path
+
+
+def _write_dataset(df, path, partition_cols, derived, sort_by, pdv_buckets, row_group_size, existing):
+    if pdv_buckets:
+        df = df.assign(pdv_bucket=(df["pdv"].to_numpy() % pdv_buckets).astype("int16"))
+        partition_cols.append("pdv_bucket")
+        derived.append("pdv_bucket")
+    if sort_by:
+        df = df.sort_values(list(sort_by), kind="stable")
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    part_schema = pa.schema([tbl.schema.field(c) for c in partition_cols])
+    meta = {
+        "partitioning": [{"name": f.name, "type": str(f.type)} for f in part_schema],
+        "derived": derived,
+        "sort_by": list(sort_by or []),
+        "pdv_buckets": pdv_buckets or None,
+    }
+
+    if existing == "partitions" and path.is_dir():
+        old = read_meta(path)
+        if old.get("partitioning") != meta["partitioning"]:
+            raise ValueError(f"Particionamento diferente do existente em {path}")
+        if (old.get("pdv_buckets") or None) != meta["pdv_buckets"]:
+            # partições antigas ficariam com outro pdv % N e _bucket_filters podaria errado
+            raise ValueError(f"pdv_buckets={meta['pdv_buckets']} difere do existente em {path} "
+                             f"({old.get('pdv_buckets')}); regrave o dataset inteiro")
+        target, behavior = path, "delete_matching"
+    else:
+        target, behavior = path.with_name(path.name + ".tmp"), "error"
+        if target.exists():
+            shutil.rmtree(target)
+
+    ds.write_dataset(
+        tbl, target, format="parquet",
+        partitioning=ds.partitioning(part_schema, flavor="hive") if partition_cols else None,
+        basename_template="part-{i}.parquet",
+        max_rows_per_group=row_group_size,
+        min_rows_per_group=min(row_group_size, 64_000),
+        existing_data_behavior=behavior,
+    )
+    (target / META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    if target != path:
+        if path.is_dir():
+            shutil.rmtree(path)
+        elif path.exists():
+            path.unlink()
+        target.rename(path)
+
+
+def drop_partitions(path, **values):
+    """Remove as partições com os valores dados (níveis omitidos: qualquer valor)."""
+    path = Path(path)
+    names = [f["name"] for f in read_meta(path).get("partitioning", [])]
+    last = max((names.index(n) for n in values), default=-1)
+    pattern = "/".join(f"{n}={values[n]}" if n in values else f"{n}=*" for n in names[:last + 1])
+    dirs = list(path.glob(pattern)) if pattern else []
+    for d in dirs:
+        shutil.rmtree(d)
+    return len(dirs)
+
+
+def dataset_fingerprint(path):
+    """Hash de (arquivo, tamanho, mtime) de todos os arquivos de dados — muda a cada regravação."""
+    path = Path(path)
+    files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+    h = hashlib.sha1()
+    for f in files:
+        st = f.stat()
+        h.update(f"{f.relative_to(path) if path.is_dir() else f.name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def dataset_schema(path):
+    """Schema (arquivo único ou diretório particionado) sem ler os dados."""
+    return ds.dataset(path, format="parquet", partitioning="hive").schema
+
+
+def _bucket_filters(filters, meta):
+    # ("pdv", "in", [...]) vira também um filtro de partição pdv_bucket
+    n = meta.get("pdv_buckets")
+    if not n or not filters:
+        return filters
+    extra = []
+    for col, op, val in filters:
+        if col == "pdv" and op in ("=", "==", "in"):
+            vals = val if op == "in" else [val]
+            extra.append(("pdv_bucket", "in", sorted({int(v) % n for v in vals})))
+    return list(filters) + extra
+
+
+def read_table(path, columns=None, filters=None, derived=False):
+    """Lê dataset particionado (ou arquivo único) como tabela Arrow.
+
+    `filters` no formato de tuplas do pyarrow (AND entre elas), ex.:
+    [("ano_iso", "=", 2022), ("semana_iso", ">", 44)]. Colunas derivadas de
+    partição só voltam se pedidas em `columns` (ou com `derived=True`).
+    """
+    path = Path(path)
+    with span(f"read {path.name}", "read", path=path) as sp:
+        tbl = _read_table(path, columns, filters, derived)
+        sp.set(rows=tbl.num_rows, bytes=tbl.nbytes)
+    return tbl
+
+
+def _open(path, columns, filters, derived):
+    # dataset particionado → (dataset, colunas, filtro, nomes das colunas de partição)
+    meta = read_meta(path)
+    if meta.get("partitioning"):
+        schema = pa.schema([pa.field(f["name"], pa.type_for_alias(f["type"]))
+                            for f in meta["partitioning"]])
+        partitioning = ds.partitioning(schema, flavor="hive")
+    else:
+        partitioning = "hive"
+    dset = ds.dataset(path, format="parquet", partitioning=partitioning)
+    filters = _bucket_filters(filters, meta)
+    expr = pq.filters_to_expression(filters) if filters else None
+    hidden = set() if derived else set(meta.get("derived", []))
+    cols = columns or [c for c in dset.schema.names if c not in hidden]
+    return dset, cols, expr, [f["name"] for f in meta.get("partitioning", [])]
+
+
+def _read_table(path, columns, filters, derived):
+    if path.is_dir():
+        dset, cols, expr, _ = _open(path, columns, filters, derived)
+        return dset.to_table(columns=cols, filter=expr)
+    # arquivo único (formato antigo): filtros em colunas inexistentes são ignorados
+    names = set(pq.read_schema(path).names)
+    filters = [f for f in (filters or []) if f[0] in names] or None
+    return pq.read_table(path, columns=columns, filters=filters)
+
+
+def iter_batches(path, columns=None, filters=None, derived=False, batch_size=256_000):
+    """Lê o dataset em RecordBatches, sem materializar a tabela inteira.
+
+    Partições saem em ordem crescente dos valores de partição (ex.: ano_iso, semana_iso) e,
+    dentro de cada arquivo, na ordem gravada.
+    """
+    path = Path(path)
+    if not path.is_dir():
+        names = set(pq.read_schema(path).names)
+        filters = [f for f in (filters or []) if f[0] in names]
+        expr = pq.filters_to_expression(filters) if filters else None
+        yield from _traced(ds.dataset(path, format="parquet").to_batches(columns=columns, filter=expr,
+                                                                         batch_size=batch_size), path)
+        return
+    dset, cols, expr, part_names = _open(path, columns, filters, derived)
+    frags = sorted(dset.get_fragments(filter=expr),
+                   key=lambda f: tuple(ds.get_partition_keys(f.partition_expression).get(n, 0)
+                                       for n in part_names))
+    for frag in frags:
+        yield from _traced(frag.to_batches(schema=dset.schema, columns=cols, filter=expr,
+                                           batch_size=batch_size), path)
+
+
+def _traced(batches, path):
+    # um span read por lote, só em torno da leitura (o consumidor roda fora dele)
+    batches = iter(batches)
+    while True:
+        with span(f"read {path.name}", "read", path=path) as sp:
+            batch = next(batches, None)
+            if batch is not None:
+                sp.set(rows=batch.num_rows, bytes=batch.nbytes)
+        if batch is None:
+            return
+        yield batch
+
+
+def read_dataset(path, columns=None, filters=None):
+    """Como read_table, mas devolve DataFrame."""
+    return read_table(path, columns, filters).to_pandas()
+
+
+def iter_row_groups(pfile, row_groups=None, columns=None, name="parquet"):
+    """DataFrames dos row groups de `pfile` (pq.ParquetFile de um arquivo bruto), um a um;
+    cada leitura é um span read com linhas e bytes."""
+    for rg in range(pfile.num_row_groups) if row_groups is None else row_groups:
+        with span(f"read {name}", "read") as sp:
+            tbl = pfile.read_row_group(rg, columns=columns)
+            sp.set(rows=tbl.num_rows, bytes=tbl.nbytes)
+        yield tbl.to_pandas()
+
+
+def write_file(df, path, **kwargs):
+    """DataFrame → arquivo único (Parquet; CSV se `path` termina em .csv), com span write."""
+    path = Path(path)
+    with span(f"write {path.name}", "write", rows=len(df), path=path) as sp:
+        if path.suffix == ".csv":
+            df.to_csv(path, index=False, **kwargs)
+        else:
+            df.to_parquet(path, index=False, **kwargs)
+        sp.set(bytes=path_bytes(path))
+    return path
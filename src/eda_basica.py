@@ -1,15 +1,15 @@
 # src/eda_basica.py
 from pathlib import Path
-import pandas as pd
+from arrow_cache import read_cached
 
 def main():
     base_dir = Path(__file__).resolve().parents[1]
     data_proc = base_dir / "data" / "processed"
 
     # Carregar dados processados
-    df_trx = pd.read_parquet(data_proc / "transacoes_2022.parquet")
-    df_pdv = pd.read_parquet(data_proc / "pdvs.parquet")
-    df_prod = pd.read_parquet(data_proc / "produtos.parquet")
+    df_trx = read_cached(data_proc / "transacoes_2022.parquet")
+    df_pdv = read_cached(data_proc / "pdvs.parquet")
+    df_prod = read_cached(data_proc / "produtos.parquet")
 
     print("=== Shapes ===")
     print("Transações :", df_trx.shape)
@@ -0,0 +1,67 @@
+# src/eval_engine.py
+# Avaliação vetorizada de vários modelos contra o mesmo alvo. As previsões são uma matriz
+# (linhas de validação × modelos) alinhada a um único frame de validação; WMAPE e viés por
+# série, loja e SKU saem de somas por grupo com np.add.reduceat — sem cópia do frame por
+# modelo e sem groupby.apply por série.
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+def _ratio(num, den):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(den != 0, num / np.where(den != 0, den, 1), np.nan)
+
+
+def group_sums(values, codes):
+    """Somas de `values` (n × k) por código de grupo → (grupos, somas grupos × k)."""
+    order = np.argsort(codes, kind="stable")
+    c = codes[order]
+    if not len(c):
+        return c, np.zeros((0, values.shape[1]))
+    starts = np.flatnonzero(np.r_[True, c[1:] != c[:-1]])
+    return c[starts], np.add.reduceat(values[order], starts, axis=0)
+
+
+def evaluate(y, preds, models, groups):
+    """Métricas de `preds` (n × M, colunas = `models`) contra `y` (n,).
+
+    `groups` = {nível: códigos inteiros (n,)}, ex. {"serie": ..., "pdv": ..., "produto": ...}.
+    Devolve (overall, por_nivel): overall com WMAPE e viés por modelo; por_nivel[nível] =
+    (códigos dos grupos, WMAPE grupos × M, viés grupos × M). Viés = Σ(prev − y) / Σy.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    preds = np.asarray(preds, dtype=np.float64)
+    M = preds.shape[1]
+    err = preds - y[:, None]
+    stacked = np.column_stack([np.abs(err), err, np.abs(y), y])
+
+    tot = stacked.sum(axis=0)
+    overall = pd.DataFrame({
+        "modelo": list(models),
+        "WMAPE_overall": _ratio(tot[:M], tot[2 * M]),
+        "bias_overall": _ratio(tot[M:2 * M], tot[2 * M + 1]),
+    })
+
+    by_level = {}
+    for level, codes in groups.items():
+        g, s = group_sums(stacked, np.asarray(codes))
+        by_level[level] = (g, _ratio(s[:, :M], s[:, [2 * M]]), _ratio(s[:, M:2 * M], s[:, [2 * M + 1]]))
+    return overall, by_level
+
+
+def summarize(by_level, models):
+    """Distribuição do WMAPE/viés por grupo: count, p50, p90 (WMAPE) e p50 do viés, por nível e modelo."""
+    rows = []
+    for level, (_, wm, bias) in by_level.items():
+        count = np.sum(~np.isnan(wm), axis=0)
+        empty = np.full(len(models), np.nan)
+        with warnings.catch_warnings():   # modelo sem nenhum grupo válido → NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            p50, p90 = np.nanpercentile(wm, [50, 90], axis=0) if len(wm) else (empty, empty)
+            b50 = np.nanpercentile(bias, 50, axis=0) if len(bias) else empty
+        for j, m in enumerate(models):
+            rows.append({"nivel": level, "modelo": m, "count": int(count[j]),
+                         "p50": p50[j], "p90": p90[j], "bias_p50": b50[j]})
+    return pd.DataFrame(rows)
@@ -3,6 +3,10 @@ from pathlib import Path
 import time
 import numpy as np
 import pandas as pd
+from arrow_cache import read_cached
+from datasets import write_file
+from eval_engine import evaluate, summarize
+from key_encoding import decode_keys
 
 # ====================== Parâmetros ======================
 BASE_DIR     = Path(__file__).resolve().parents[1]
@@ -15,21 +19,15 @@ MEAN_WINDOWS = [4, 8]               # comparar janelas 4 e 8
 SAVE_DETAILS = False                # True para salvar details (maior I/O)
 # =======================================================
 
-def wmape(df_in: pd.DataFrame) -> float:
-    den = df_in["y"].abs().sum()
-    if den == 0:
-        return np.nan
-    num = (df_in["y"] - df_in["qtd_prev"]).abs().sum()
-    return float(num / den)
-
 def main():
     t0 = time.time()
     REPORT_DIR.mkdir(parents=True, exist_ok=True)
 
     print(">> Lendo transacoes_2022_diarias.parquet")
-    df = pd.read_parquet(
+    df = read_cached(
         PROC_DIR / "transacoes_2022_diarias.parquet",
-        columns=["data", "pdv", "produto", "quantidade"]
+        columns=["data", "pdv", "produto", "quantidade"],
+        filters=[("ano_iso", "=", 2022)],   # só as partições de 2022
     )
     print("shape diário:", df.shape)
 
@@ -50,66 +48,73 @@ def main():
           "| validação:", min(VAL_WEEKS), "→", max(VAL_WEEKS))
     print("séries na validação:", df_val.groupby(["pdv","produto"]).ngroups)
 
-    pred_list = []
+    # frame de validação único (ordenado por série); cada modelo é só uma coluna de `preds`
+    key = ["pdv", "produto"]
+    df_val = df_val.sort_values(key + ["semana"], ignore_index=True)
+    series_id, series = pd.MultiIndex.from_frame(df_val[key]).factorize()
+    models = [f"mean_last_{w}" for w in MEAN_WINDOWS] + ["naive_seasonal"]
+    preds = np.full((len(df_val), len(models)), np.nan)
     cutoff = max(TRAIN_WEEKS)
 
     # ===== Baselines de média das últimas N semanas =====
-    for w in MEAN_WINDOWS:
+    for j, w in enumerate(MEAN_WINDOWS):
         low = max(min(TRAIN_WEEKS), cutoff - w + 1)
         print(f">> Baseline mean_last_{w}: semanas usadas no treino = {low}..{cutoff}")
         ref = df_train[(df_train["semana"] >= low) & (df_train["semana"] <= cutoff)]
-        m = (ref.groupby(["pdv","produto"], as_index=False)["quantidade"]
-               .mean()
-               .rename(columns={"quantidade": "qtd_prev"}))
+        m = ref.groupby(key)["quantidade"].mean()
         # prever somente chaves presentes na validação (repete o mesmo valor em 49–52)
-        tmp = df_val.merge(m, on=["pdv","produto"], how="left")
-        tmp["modelo"] = f"mean_last_{w}"
-        pred_list.append(tmp)
+        preds[:, j] = m.reindex(series).to_numpy()[series_id]
 
     # ===== Baseline naïve sazonal: usa a mesma semana ISO do treino =====
     print(">> Baseline naive_seasonal: mesma semana ISO do treino")
-    seasonal = df_train[df_train["semana"].isin(VAL_WEEKS)].rename(columns={"quantidade": "qtd_prev"})
-    tmp = df_val.merge(seasonal[["pdv","produto","semana","qtd_prev"]],
-                       on=["pdv","produto","semana"], how="left")
-    tmp["modelo"] = "naive_seasonal"
-    pred_list.append(tmp)
-
-    print(">> Concatenando previsões")
-    eval_df = pd.concat(pred_list, ignore_index=True)
-    eval_df["qtd_prev"] = eval_df["qtd_prev"].fillna(0).clip(lower=0)
-    eval_df["y"]        = eval_df["y"].fillna(0)
-
-    print(">> Calculando métricas (WMAPE)")
-    overall = eval_df.groupby(["modelo"]).apply(wmape).reset_index(name="WMAPE_overall")
-
-    per_series = (eval_df.groupby(["modelo","pdv","produto"])
-                  .apply(wmape)
-                  .reset_index(name="WMAPE_series"))
-    summary = (per_series.groupby("modelo")["WMAPE_series"]
-               .agg(count="count",
-                    p50=lambda s: np.nanpercentile(s, 50),
-                    p90=lambda s: np.nanpercentile(s, 90))
-               .reset_index())
+    seasonal = df_train.set_index(key + ["semana"])["quantidade"]
+    preds[:, models.index("naive_seasonal")] = seasonal.reindex(
+        pd.MultiIndex.from_frame(df_val[key + ["semana"]])).to_numpy()
+
+    preds = np.clip(np.nan_to_num(preds, nan=0.0), 0, None)
+    y = df_val["y"].fillna(0).to_numpy(dtype=np.float64)
+
+    print(">> Calculando métricas (WMAPE, viés)")
+    overall, by_level = evaluate(y, preds, models, {
+        "serie":   series_id,
+        "pdv":     df_val["pdv"].to_numpy(),
+        "produto": df_val["produto"].to_numpy(),
+    })
+    levels = summarize(by_level, models)
+    overall = overall.sort_values("modelo", ignore_index=True)
+    summary = (levels[levels["nivel"].eq("serie")]
+               .sort_values("modelo")[["modelo", "count", "p50", "p90"]]
+               .reset_index(drop=True))
 
     # relatórios
     overall_path = REPORT_DIR / "baseline_eval_overall.csv"
     summary_path = REPORT_DIR / "baseline_eval_summary.csv"
-    overall.to_csv(overall_path, index=False)
-    summary.to_csv(summary_path, index=False)
+    levels_path  = REPORT_DIR / "baseline_eval_levels.csv"
+    write_file(overall, overall_path)
+    write_file(summary, summary_path)
+    write_file(levels, levels_path)
 
     if SAVE_DETAILS:
         details_path = REPORT_DIR / "baseline_eval_details.csv"
-        eval_df.to_csv(details_path, index=False)
+        details = df_val.assign(**{m: preds[:, j] for j, m in enumerate(models)})
+        write_file(decode_keys(details, PROC_DIR), details_path)
+        for level in ("pdv", "produto"):
+            g, wm, bias = by_level[level]
+            per = pd.DataFrame({level: np.repeat(g, len(models)),
+                                "modelo": np.tile(models, len(g)),
+                                "WMAPE": wm.ravel(), "bias": bias.ravel()})
+            write_file(decode_keys(per, PROC_DIR, cols=[level]), REPORT_DIR / f"baseline_eval_by_{level}.csv")
         print("details salvo em:", details_path)
 
     print("\nRelatórios salvos:")
     print(" -", overall_path)
     print(" -", summary_path)
+    print(" -", levels_path)
 
     print("\n=== Overall WMAPE ===")
     print(overall.to_string(index=False))
-    print("\n=== Summary (por série) ===")
-    print(summary.to_string(index=False))
+    print("\n=== Distribuição por série / loja / SKU ===")
+    print(levels.to_string(index=False))
 
     print("\nTempo total: {:.1f}s".format(time.time() - t0))
 
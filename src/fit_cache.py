@@ -0,0 +1,84 @@
+# src/fit_cache.py
+# Cache em disco de ajustes por série, endereçado por conteúdo:
+# chave = hash(série, hiperparâmetros, cutoff, semanas previstas).
+# Cada entrada guarda a previsão (yhat) e os parâmetros ajustados; a remoção é LRU
+# (mtime atualizado a cada acerto) limitada por número de entradas e/ou bytes.
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def series_key(ds, y, params, cutoff, future_ds):
+    h = hashlib.sha1()
+    h.update(np.asarray(ds, dtype="datetime64[ns]").view("int64").tobytes())
+    h.update(np.asarray(y, dtype="float64").tobytes())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    h.update(str(pd.Timestamp(cutoff)).encode() if cutoff is not None else b"-")
+    h.update(np.asarray(future_ds, dtype="datetime64[ns]").view("int64").tobytes())
+    return h.hexdigest()
+
+
+class FitCache:
+    def __init__(self, cache_dir, max_entries=None, max_bytes=None):
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.dir / key[:2] / f"{key}.npz"
+
+    def get(self, key):
+        p = self._path(key)
+        try:
+            with np.load(p) as z:
+                out = {k: z[k] for k in z.files}
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            return None
+        os.utime(p)  # LRU: acerto renova a entrada
+        self.hits += 1
+        yhat = out.pop("yhat")
+        return yhat, out
+
+    def put(self, key, yhat, fit_params=None):
+        p = self._path(key)
+        p.parent.mkdir(exist_ok=True)
+        arrays = {f"{k}": np.asarray(v) for k, v in (fit_params or {}).items()}
+        tmp = p.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, yhat=np.asarray(yhat, dtype=float), **arrays)
+        os.replace(tmp, p)  # escrita atômica (vários processos podem gravar)
+
+    def evict(self):
+        if self.max_entries is None and self.max_bytes is None:
+            return 0
+        entries = []
+        for p in self.dir.glob("*/*.npz"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        n, removed = len(entries), 0
+        for _, size, p in entries:
+            over_n = self.max_entries is not None and n > self.max_entries
+            over_b = self.max_bytes is not None and total > self.max_bytes
+            if not (over_n or over_b):
+                break
+            p.unlink(missing_ok=True)
+            n -= 1
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        return f"cache: {self.hits} acertos | {self.misses} ajustes novos | dir={self.dir}"
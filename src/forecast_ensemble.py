@@ -1,96 +1,406 @@
 import argparse
+import json
+import time
 import pandas as pd, numpy as np
-from tqdm import tqdm
-from prophet import Prophet
 from common import resolve_project_dir
+from arrow_cache import read_cached
+from batch_holt import fit_predict_holt, weekly_matrix
+from datasets import DAILY_PARTITIONS, read_dataset, with_iso_week, write_dataset
+from incremental import ALL, clear_dirty, dirty_weeks, manifest
+from instrument import span
+from intermittent import ADI_MAX, BUCKETS, DEAD_WEEKS, DENSE, INTERMITTENT, METHODS, bucket_of, \
+    croston_batch, sparse_stats
+from key_encoding import CODE_DTYPE, decode_keys, encode_keys
+from models import SeriesBatch, budget_count, get_model
+from prophet_engine import add_engine_args, cache_from_args, make_pool
+from series_index import SeriesIndex
+from weekly_store import WeeklyStore
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--top_n", type=int, default=200)
-args = parser.parse_known_args()[0]
-
-PROJECT_DIR = resolve_project_dir()
-wk_path = PROJECT_DIR / "data" / "processed" / "train_weekly_splits.parquet"
-out_path = PROJECT_DIR / "data" / "processed" / "forecast_ensemble_jan2023.parquet"
-
-wk = pd.read_parquet(wk_path)
-wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
-wk["y"] = wk["quantidade"].astype(float)
-key = ["pdv","produto"]
-
-forecast_weeks = pd.to_datetime(["2023-01-02","2023-01-09","2023-01-16","2023-01-23"])
-cutoff = pd.Timestamp("2022-12-26")
-
-# Top-N por volume no treino
-train_mask = wk["split"].eq("train")
-sum_by_pair = (wk.loc[train_mask].groupby(key, sort=False)["y"].sum().rename("sum_y").reset_index())
-top_pairs = sum_by_pair.sort_values("sum_y", ascending=False).head(args.top_n)
-
-# Prophet nas Top-N
-prophet_rows = []
-for _, row in tqdm(top_pairs.iterrows(), total=len(top_pairs)):
-    pdv, produto = str(row["pdv"]), str(row["produto"])
-    sub = wk[(wk["pdv"]==pdv) & (wk["produto"]==produto)].copy()
-    train = (sub[sub["semana"] <= cutoff][["semana","y"]]
-             .rename(columns={"semana":"ds","y":"y"})
-             .sort_values("ds"))
-    if len(train) < 8:
-        continue
-
-    m = Prophet(
-        growth="linear",
-        weekly_seasonality=True,
-        yearly_seasonality=False,
-        daily_seasonality=False,
-        seasonality_mode="additive",
-        changepoint_prior_scale=0.5,
-        interval_width=0.8
-    )
-    m.fit(train)
-    future = pd.DataFrame({"ds": forecast_weeks})
-    fcst = m.predict(future)[["ds","yhat"]]
-    fcst["pdv"] = pdv
-    fcst["produto"] = produto
-    prophet_rows.append(fcst)
-
-if prophet_rows:
-    prophet_fc = pd.concat(prophet_rows, ignore_index=True).rename(columns={"ds":"semana","yhat":"quantidade"})
-    prophet_fc["quantidade"] = prophet_fc["quantidade"].clip(lower=0)
-else:
-    prophet_fc = pd.DataFrame(columns=["semana","pdv","produto","quantidade"])
-
-prophet_pairs = set(zip(prophet_fc["pdv"], prophet_fc["produto"]))
-
-# MA4 para cauda longa (último MA4 até o cutoff replicado nas 4 semanas)
-wk_sorted = wk.sort_values(key+["semana"]).copy()
-wk_sorted["ma4"] = wk_sorted.groupby(key)["y"].rolling(4, min_periods=1).mean().reset_index(level=key, drop=True)
-
-last_train = wk_sorted[wk_sorted["semana"] <= cutoff]
-last_ma4 = (last_train.groupby(key, as_index=False)
-            .apply(lambda s: s.iloc[-1][["ma4"]])
-            .reset_index(drop=True))
-last_ma4["ma4"] = last_ma4["ma4"].fillna(0).clip(lower=0)
-
-all_pairs = set(zip(wk[key[0]].astype(str), wk[key[1]].astype(str)))
-tail_pairs = all_pairs.difference(prophet_pairs)
-tail_df = pd.DataFrame(list(tail_pairs), columns=key)
-
-tail_base = (tail_df.merge(last_ma4, on=key, how="left").fillna({"ma4":0}))
-tail_base = tail_base.assign(_k=1).merge(
-    pd.DataFrame({"semana": forecast_weeks, "_k":[1,1,1,1]}),
-    on="_k", how="left").drop(columns="_k")
-tail_base = tail_base.rename(columns={"ma4":"quantidade"})
-
-# Ensemble
-ens = pd.concat([
-    prophet_fc[["semana","pdv","produto","quantidade"]],
-    tail_base[["semana","pdv","produto","quantidade"]]
-], ignore_index=True)
-
-ens["semana"] = pd.to_datetime(ens["semana"]).dt.normalize()
-ens["pdv"] = ens["pdv"].astype("string")
-ens["produto"] = ens["produto"].astype("string")
-ens["quantidade"] = ens["quantidade"].clip(lower=0).round().astype(int)
-ens = ens.sort_values(["semana","pdv","produto"]).reset_index(drop=True)
-
-ens.to_parquet(out_path, index=False)
-print(out_path)
+def build_tail_ma4(wk, key, cutoff, forecast_weeks, exclude=None):
+    """MA4 de cada par no cutoff (média das últimas 4 observações), replicado nas semanas previstas.
+
+    Cobre todos os pares de `wk` fora de `exclude` (frame com as colunas de `key`);
+    pares sem histórico até o cutoff recebem 0. Tudo em NumPy sobre códigos inteiros
+    dos pares: sem apply por série, sem cross join e sem conjuntos de tuplas.
+    """
+    pdv_codes, pdv_uni = pd.factorize(wk[key[0]], sort=True)
+    prod_codes, prod_uni = pd.factorize(wk[key[1]], sort=True)
+    n_prod = max(len(prod_uni), 1)
+    pair = pdv_codes.astype(np.int64) * n_prod + prod_codes
+
+    # últimas 4 observações de cada par até o cutoff (média ignorando NaN, como o rolling)
+    mask = (wk["semana"] <= cutoff).to_numpy()
+    p, t, y = pair[mask], wk["semana"].to_numpy()[mask], wk["y"].to_numpy(dtype=float)[mask]
+    order = np.lexsort((t, p))
+    p, y = p[order], y[order]
+    if len(p):
+        ends = np.flatnonzero(np.r_[p[1:] != p[:-1], True])
+        sizes = np.diff(np.r_[-1, ends])
+        gid = np.repeat(np.arange(len(ends)), sizes)
+        valid = (ends[gid] - np.arange(len(p)) < 4) & ~np.isnan(y)
+        num = np.bincount(gid, weights=np.where(valid, y, 0.0), minlength=len(ends))
+        cnt = np.bincount(gid, weights=valid, minlength=len(ends))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ma4 = num / cnt
+        train_pairs = p[ends]
+    else:
+        ma4, train_pairs = np.empty(0), np.empty(0, dtype=np.int64)
+
+    # anti-join nos códigos: todos os pares menos os excluídos (ex.: Prophet)
+    tail = np.unique(pair)
+    if exclude is not None and len(exclude):
+        ex_pdv = pd.Index(pdv_uni).get_indexer(exclude[key[0]].to_numpy())
+        ex_prod = pd.Index(prod_uni).get_indexer(exclude[key[1]].to_numpy())
+        ok = (ex_pdv >= 0) & (ex_prod >= 0)
+        ex = ex_pdv[ok].astype(np.int64) * n_prod + ex_prod[ok]
+        tail = tail[~np.isin(tail, ex)]
+
+    pos = np.searchsorted(train_pairs, tail)
+    pos_ok = pos < len(train_pairs)
+    hit = np.zeros(len(tail), dtype=bool)
+    hit[pos_ok] = train_pairs[pos[pos_ok]] == tail[pos_ok]
+    vals = np.zeros(len(tail))
+    vals[hit] = ma4[pos[hit]]
+    vals = np.clip(np.nan_to_num(vals, nan=0.0), 0, None)
+
+    # expansão para as semanas previstas (repeat/tile)
+    h = len(forecast_weeks)
+    return pd.DataFrame({
+        "semana": np.tile(pd.DatetimeIndex(forecast_weeks).to_numpy(), len(tail)),
+        "pdv": pd.Categorical.from_codes(np.repeat(tail // n_prod, h), pdv_uni),
+        "produto": pd.Categorical.from_codes(np.repeat(tail % n_prod, h), prod_uni),
+        "quantidade": np.repeat(vals, h),
+    })
+
+def ma4_val_error(wk, splits=("val8", "val4")):
+    """Erro absoluto do MA4 (média das 4 observações anteriores) somado nas semanas de validação, por par.
+
+    É o erro que o Prophet pode recuperar na série: já pondera pelo volume, como no WMAPE.
+    """
+    store = WeeklyStore.build(wk)
+    ma = store.rolling_mean(4)
+    prev = np.full(len(ma), np.nan)
+    prev[1:] = ma[:-1]
+    prev[store.indptr[:-1]] = np.nan   # 1ª observação de cada série
+    err = np.where(np.isin(store.label(), splits),
+                   np.abs(np.asarray(store.values, dtype=float) - np.nan_to_num(prev)), 0.0)
+    sums = np.add.reduceat(err, store.indptr[:-1]) if len(err) else np.empty(0)
+    return pd.DataFrame({"pdv": store.pdv, "produto": store.produto, "err_ma4": sums})
+
+SPARSE_COLS = ["adi", "idle", *METHODS]
+
+def sparse_state(wk, key, cutoff, weeks=None):
+    """ADI, semanas sem venda no cutoff e nível Croston/SBA/TSB de cada par (intermittent.py),
+    medidos no calendário `weeks` (padrão: as semanas de `wk`, que deve ter todos os pares)."""
+    pairs, Y, first, _ = weekly_matrix(wk, key, cutoff, weeks=weeks)
+    pairs["adi"], pairs["idle"] = sparse_stats(Y, first)
+    for m, level in croston_batch(Y, first).items():
+        pairs[m] = level
+    return pairs
+
+def pair_state(wk, key, cutoff, sparse=True):
+    """Estado por par usado pelo ensemble: volume no treino (ranking Top-N), MA4 no cutoff,
+    erro do MA4 na validação (ranking por orçamento) e as estatísticas de esparsidade
+    (`sparse=False` as omite: dependem do calendário global, não só das séries de `wk`).
+
+    Pares sem observação no treino ficam com sum_y = NaN (fora do ranking).
+    """
+    with span("estado por par", "transform", rows=len(wk)):
+        return _pair_state(wk, key, cutoff, sparse)
+
+def _pair_state(wk, key, cutoff, sparse):
+    st = build_tail_ma4(wk, key, cutoff, [cutoff]).drop(columns="semana")
+    st = st.rename(columns={"quantidade": "ma4"})
+    st[key[0]] = st[key[0]].astype(CODE_DTYPE)
+    st[key[1]] = st[key[1]].astype(CODE_DTYPE)
+    sums = (wk.loc[wk["split"].eq("train")]
+              .groupby(key, sort=False)["y"].sum().rename("sum_y").reset_index())
+    st = (st.merge(sums, on=key, how="left")
+            .merge(ma4_val_error(wk).astype({"pdv": CODE_DTYPE, "produto": CODE_DTYPE}), on=key, how="left"))
+    if sparse:
+        st = st.merge(sparse_state(wk, key, cutoff).astype({"pdv": CODE_DTYPE, "produto": CODE_DTYPE}),
+                      on=key, how="left")
+    return st
+
+def read_pairs(wk_path, pairs, key):
+    """Séries completas só dos pares dados (filtro por pdv empurrado para a leitura)."""
+    wk = read_dataset(wk_path, filters=[(key[0], "in", pairs[key[0]].unique().tolist())])
+    return wk.merge(pairs[key].drop_duplicates(), on=key, how="inner")
+
+def _prep(wk):
+    wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
+    wk["y"] = wk["quantidade"].astype(float)
+    return wk
+
+def expand_weeks(df, forecast_weeks, col):
+    """Replica `col` de cada par nas semanas previstas (repeat/tile, sem cross join)."""
+    h = len(forecast_weeks)
+    return pd.DataFrame({
+        "semana": np.tile(pd.DatetimeIndex(forecast_weeks).to_numpy(), len(df)),
+        "pdv": np.repeat(df["pdv"].to_numpy(), h),
+        "produto": np.repeat(df["produto"].to_numpy(), h),
+        "quantidade": np.repeat(df[col].to_numpy(dtype=float), h),
+    })
+
+def prophet_within_budget(prophet, ranked, load, cutoff, forecast_weeks, budget, clock="cpu", step=8,
+                          probe=1):
+    """Prophet nos pares de `ranked` (ordem de prioridade) até esgotar `budget` segundos.
+
+    O primeiro lote é uma sonda de `probe` séries: o custo declarado do modelo serve só para
+    decidir se ela cabe. Depois o custo por série é o medido (CPU dos ajustes nos processos ou
+    tempo de parede) e atualiza `prophet.cost`; um lote só roda se spent + custo × n couber
+    no orçamento. `load(lote)` devolve um SeriesIndex com as séries do lote. Devolve
+    (previsões, por série).
+    """
+    key = ["pdv", "produto"]
+    h = len(forecast_weeks)
+    fcs, rows, spent, done = [], [], 0.0, 0
+    fits = budget_count(prophet, budget)
+    n = min(max(1, probe), step) if fits is None else min(max(1, probe), step, fits)
+    while done < len(ranked) and n > 0 and spent + prophet.cost * n <= budget:
+        block = ranked.iloc[done:done + n]
+        pairs = list(zip(block["pdv"].tolist(), block["produto"].tolist()))
+        t0 = time.perf_counter()
+        fc = prophet.predict_series(load(block).iter_train(pairs, cutoff), forecast_weeks,
+                                    total=len(pairs), cutoff=cutoff)
+        wall = time.perf_counter() - t0
+        fit_s = fc["fit_seconds"].to_numpy()[::h]
+        spent += wall if clock == "wall" else float(fit_s.sum())
+        done += len(pairs)
+        prophet.cost = max(spent / done, 1e-3)
+        fcs.append(fc)
+        rows.append(block[key + ["sum_y", "err_ma4"]].assign(
+            fit_seconds=fit_s, fallback=fc["fallback"].to_numpy()[::h], spent=spent))
+        n = min(step, int((budget - spent) // prophet.cost))
+    cols = key + ["sum_y", "err_ma4", "fit_seconds", "fallback", "spent"]
+    sel = pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=cols)
+    fc = pd.concat(fcs, ignore_index=True) if fcs else pd.DataFrame(columns=["semana"] + key + ["yhat", "fallback"])
+    return fc, sel
+
+def store_forecast(model, store, pairs, key, cutoff, forecast_weeks):
+    """Previsão de um modelo do registro (lote do WeeklyStore no cutoff) para os `pairs`, no
+    formato de expand_weeks; pares fora do store ou sem previsão ficam com o MA4."""
+    c = int(pd.DatetimeIndex(store.weeks).searchsorted(cutoff, side="right")) - 1
+    idx = pd.DataFrame({"pdv": np.asarray(store.pdv), "produto": np.asarray(store.produto),
+                        "_s": np.arange(len(store))}).astype({"pdv": CODE_DTYPE, "produto": CODE_DTYPE})
+    m = pairs[key + ["ma4"]].merge(idx, on=key, how="left")
+    fc = np.repeat(m["ma4"].to_numpy(dtype=float)[:, None], len(forecast_weeks), axis=1)
+    ok = m["_s"].notna().to_numpy()
+    if ok.any() and c >= 0:
+        batch = SeriesBatch(store, c, len(forecast_weeks), series=m.loc[ok, "_s"].astype(np.int64).to_numpy())
+        pred = model.predict(batch)
+        fc[ok] = np.where(np.isnan(pred), fc[ok], pred)
+    out = expand_weeks(m, forecast_weeks, "ma4")
+    out["quantidade"] = np.nan_to_num(fc.ravel(), nan=0.0)
+    return out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top_n", type=int, default=200)
+    parser.add_argument("--no_prophet", "--no-prophet", dest="no_prophet", action="store_true",
+                        help="Caminho rápido sem nível Prophet (nem import do prophet/cmdstanpy): "
+                             "só Holt/modelo global/cauda; com --hier, Holt nos nós")
+    parser.add_argument("--prophet_budget", type=float, default=None,
+                        help="Segundos para o nível Prophet (substitui --top_n): pares em ordem de "
+                             "erro do MA4 na validação × volume, custo por ajuste medido a cada lote")
+    parser.add_argument("--budget_clock", choices=["cpu", "wall"], default="cpu",
+                        help="Orçamento em CPU-segundos dos ajustes ou em tempo de parede")
+    parser.add_argument("--gbm_n", type=int, default=0,
+                        help="Pares seguintes ao Top-N (por volume) previstos pelo modelo global "
+                             "(global_gbm.py: um ajuste para todas as séries; -1 = todos os demais "
+                             "densos; 0 = desligado)")
+    parser.add_argument("--holt_n", type=int, default=0,
+                        help="Pares seguintes ao Top-N (por volume) previstos pelo Holt em lote "
+                             "(-1 = todos os demais; 0 = desligado, cauda toda em MA4)")
+    parser.add_argument("--dead_weeks", type=int, default=DEAD_WEEKS,
+                        help="Pares sem venda nas últimas N semanas até o cutoff ficam fora do arquivo "
+                             "(previsão 0, sem linhas); 0 desliga")
+    parser.add_argument("--adi_max", type=float, default=ADI_MAX,
+                        help="Pares com intervalo médio entre vendas >= ADI_MAX vão para --intermittent")
+    parser.add_argument("--intermittent", choices=list(METHODS) + ["none"], default="sba",
+                        help="Modelo dos pares intermitentes (none = tratados como densos)")
+    parser.add_argument("--hier", choices=["pdv", "categoria", "pdv_categoria"], default=None,
+                        help="Cauda prevista pelo nível agregado (ver hierarchy.py) com Prophet "
+                             "nos nós, reconciliado até (pdv, produto); vazio = cauda em MA4")
+    parser.add_argument("--hier_method", choices=["mint", "proporcoes"], default="mint")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Atualiza o estado por par só nas séries das semanas pendentes em "
+                             "_manifest.json e reajusta só as séries alteradas (cache ligado)")
+    add_engine_args(parser)
+    args = parser.parse_known_args()[0]
+
+    PROJECT_DIR = resolve_project_dir()
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    wk_path = proc_dir / "train_weekly_splits.parquet"
+    out_path = proc_dir / "forecast_ensemble_jan2023.parquet"
+    state_path = PROJECT_DIR / "data" / "interim" / "ensemble_state.parquet"
+    key = ["pdv","produto"]
+
+    forecast_weeks = pd.to_datetime(["2023-01-02","2023-01-09","2023-01-16","2023-01-23"])
+    cutoff = pd.Timestamp("2022-12-26")
+
+    with manifest(proc_dir) as man:
+        weeks = dirty_weeks(man, "ensemble") if args.incremental and state_path.exists() else ALL
+        if weeks == ALL:
+            # leitura completa via cache IPC; o modo incremental lê só o necessário do parquet
+            wk = _prep(encode_keys(read_cached(wk_path), proc_dir))
+            state = pair_state(wk, key, cutoff)
+            calendar = wk["semana"].unique()
+        else:
+            # só os pares presentes nas semanas pendentes têm volume/MA4 recalculados
+            state = pd.read_parquet(state_path)
+            touched = (read_dataset(wk_path, columns=key, filters=[("semana", "in", weeks)])
+                       if weeks else pd.DataFrame(columns=key)).drop_duplicates()
+            if len(touched):
+                upd = pair_state(_prep(read_pairs(wk_path, touched, key)), key, cutoff, sparse=False)
+                keep = state.merge(upd[key], on=key, how="left", indicator=True)["_merge"].eq("left_only")
+                state = pd.concat([state[keep.to_numpy()], upd], ignore_index=True)
+            # semanas novas envelhecem também os pares não tocados (ociosidade, ADI, decaimento
+            # do TSB): a esparsidade é recalculada para todos, no calendário global
+            hist = _prep(encode_keys(read_cached(wk_path, columns=key + ["semana", "quantidade"]), proc_dir))
+            calendar = hist["semana"].unique()
+            fresh = sparse_state(hist, key, cutoff).astype({"pdv": CODE_DTYPE, "produto": CODE_DTYPE})
+            state = state.drop(columns=SPARSE_COLS, errors="ignore").merge(fresh, on=key, how="left")
+            del hist
+            print("semanas pendentes:", len(weeks), "| pares recalculados:", len(touched))
+
+        # incremental: cache ligado por padrão, então só séries com dados novos são reajustadas
+        cache = cache_from_args(args, PROJECT_DIR / "data" / "interim" / "prophet_fit_cache"
+                                if args.incremental else None)
+        prophet = get_model("prophet", engine=dict(n_jobs=args.n_jobs, chunksize=args.chunksize,
+                                                   maxtasksperchild=args.maxtasksperchild, cache=cache))
+        # warm start a partir dos parâmetros da execução anterior (ligado no incremental)
+        prophet.warm_start(args.warm_dir or (PROJECT_DIR / "data" / "interim" / "prophet_params"
+                                             if args.incremental else None))
+        if "err_ma4" not in state.columns:   # estado gravado antes da coluna existir
+            state["err_ma4"] = np.nan
+        if "adi" not in state.columns:       # idem: sem estatísticas, todos densos
+            state = state.assign(adi=1.0, idle=0.0, **{m: np.nan for m in METHODS})
+
+        # classificador: mortas (zero em bloco), intermitentes (Croston/SBA/TSB), densas
+        bucket = bucket_of(state["adi"], state["idle"], args.dead_weeks,
+                           args.adi_max if args.intermittent != "none" else 0)
+        print("pares por bucket:", {b: int((bucket == i).sum()) for i, b in enumerate(BUCKETS)})
+
+        # Top-N por volume no treino (só séries densas vão para os modelos pesados)
+        ranked = (state[bucket == DENSE].dropna(subset=["sum_y"])
+                       .sort_values(["sum_y"] + key, ascending=[False, True, True]))
+
+        # Prophet nas Top-N (em paralelo; falhas viram fallback para a cauda MA4)
+        if args.no_prophet:
+            top_pairs = ranked.head(0)
+            prophet_fc = pd.DataFrame({"semana": [], "pdv": [], "produto": [], "yhat": [],
+                                       "fallback": pd.Series([], dtype=bool)})
+        elif args.prophet_budget is None:
+            top_pairs = ranked.head(args.top_n)
+            if weeks != ALL:
+                wk = _prep(read_pairs(wk_path, top_pairs, key))
+            index = SeriesIndex(wk, key=key)
+            top_list = list(zip(top_pairs["pdv"].tolist(), top_pairs["produto"].tolist()))
+            prophet_fc = prophet.predict_series(index.iter_train(top_list, cutoff), forecast_weeks,
+                                                total=len(top_pairs), cutoff=cutoff)
+        else:
+            # orçamento: maior erro recuperável primeiro, até o tempo acabar
+            by_gain = ranked.sort_values(["err_ma4", "sum_y"] + key, ascending=[False, False, True, True],
+                                         na_position="last")
+            index = SeriesIndex(wk, key=key) if weeks == ALL else None
+            load = (lambda b: index) if index is not None else \
+                   (lambda b: SeriesIndex(_prep(read_pairs(wk_path, b, key)), key=key))
+            prophet.engine["pool"] = make_pool(args.n_jobs, args.maxtasksperchild)
+            prophet.engine["progress"] = False
+            try:
+                prophet_fc, chosen = prophet_within_budget(
+                    prophet, by_gain, load, cutoff, forecast_weeks, args.prophet_budget,
+                    args.budget_clock, step=max(8, args.n_jobs * args.chunksize), probe=args.n_jobs)
+            finally:
+                if prophet.engine["pool"] is not None:
+                    prophet.engine["pool"].terminate()
+                    prophet.engine["pool"].join()
+            top_pairs = chosen[key]
+            report_dir = PROJECT_DIR / "reports"
+            report_dir.mkdir(parents=True, exist_ok=True)
+            decode_keys(chosen.assign(rank=np.arange(1, len(chosen) + 1)), proc_dir).to_csv(
+                report_dir / "_prophet_budget_selection.csv", index=False)
+            summary = {"budget_s": args.prophet_budget, "clock": args.budget_clock,
+                       "spent_s": float(chosen["spent"].max()) if len(chosen) else 0.0,
+                       "n_selected": len(chosen), "n_candidates": len(by_gain),
+                       "cost_per_series_s": prophet.cost,
+                       "fallbacks": int(chosen["fallback"].sum())}
+            (report_dir / "_prophet_budget_summary.json").write_text(json.dumps(summary, indent=2),
+                                                                     encoding="utf-8")
+            print(f"orçamento Prophet: {summary['spent_s']:.1f}/{args.prophet_budget:.0f}s "
+                  f"({args.budget_clock}) → {len(chosen)} pares | {prophet.cost:.3f} s/série")
+        prophet_fc = (prophet_fc[~prophet_fc["fallback"]]
+                      .drop(columns="fallback")
+                      .rename(columns={"yhat":"quantidade"}))
+        prophet_fc["quantidade"] = prophet_fc["quantidade"].clip(lower=0)
+
+        store = (WeeklyStore.open(proc_dir / "weekly_store", wk_path)
+                 if args.gbm_n or args.hier else None)
+
+        # modelo global nos pares seguintes: um único ajuste em todas as séries até o cutoff
+        gbm_fc = pd.DataFrame(columns=["semana","pdv","produto","quantidade"])
+        if args.gbm_n:
+            rest = ranked.merge(top_pairs[key].astype(CODE_DTYPE), on=key, how="left", indicator=True)
+            mid = ranked[rest["_merge"].eq("left_only").to_numpy()]
+            mid = mid if args.gbm_n < 0 else mid.head(args.gbm_n)
+            t0 = time.perf_counter()
+            gbm_fc = store_forecast(get_model("gbm", proc_dir=proc_dir), store, mid, key, cutoff, forecast_weeks)
+            print(f"modelo global: {len(mid)} pares em {time.perf_counter() - t0:.1f}s")
+
+        # Holt em lote para os pares seguintes (séries curtas ficam na cauda MA4)
+        holt_fc = pd.DataFrame(columns=["semana","pdv","produto","quantidade"])
+        if args.holt_n:
+            taken = pd.concat([top_pairs[key], gbm_fc[key]]).drop_duplicates()
+            rest = ranked.merge(taken.astype(CODE_DTYPE), on=key, how="left", indicator=True)
+            mid = ranked[rest["_merge"].eq("left_only").to_numpy()]
+            mid = mid if args.holt_n < 0 else mid.head(args.holt_n)
+            src = wk if weeks == ALL else _prep(read_pairs(wk_path, mid, key))
+            holt_fc = (fit_predict_holt(src, key, cutoff, forecast_weeks, pairs=mid, weeks=calendar)
+                       .rename(columns={"yhat":"quantidade"}))
+            print("Holt em lote:", len(holt_fc) // len(forecast_weeks), "pares")
+
+        # MA4 para cauda longa (último MA4 até o cutoff replicado nas 4 semanas)
+        done = pd.concat([prophet_fc[key], gbm_fc[key], holt_fc[key]]).drop_duplicates()
+        tail = state.merge(done.astype(CODE_DTYPE), on=key, how="left", indicator=True)
+        tail_bucket = bucket[tail["_merge"].eq("left_only").to_numpy()]
+        tail = tail[tail["_merge"].eq("left_only")]
+        sparse = tail[tail_bucket == INTERMITTENT]
+        tail = tail[tail_bucket == DENSE]
+        if args.hier:
+            # Prophet nos nós agregados (poucas séries), reconciliado até os pares da cauda
+            hier = get_model(f"hier_{args.hier}", method=args.hier_method, proc_dir=proc_dir,
+                             node_model="holt" if args.no_prophet else "prophet",
+                             engine=dict(n_jobs=args.n_jobs, chunksize=args.chunksize, progress=False))
+            tail_base = store_forecast(hier, store, tail, key, cutoff, forecast_weeks)
+            print(f"cauda hierárquica ({args.hier}, {args.hier_method}):", len(tail), "pares")
+        else:
+            tail_base = expand_weeks(tail, forecast_weeks, "ma4")
+        sparse_fc = (expand_weeks(sparse, forecast_weeks, args.intermittent)
+                     if len(sparse) else tail_base.iloc[:0])
+
+        # Ensemble
+        ens = pd.concat([
+            prophet_fc[["semana","pdv","produto","quantidade"]],
+            gbm_fc[["semana","pdv","produto","quantidade"]],
+            holt_fc[["semana","pdv","produto","quantidade"]],
+            tail_base[["semana","pdv","produto","quantidade"]],
+            sparse_fc[["semana","pdv","produto","quantidade"]]
+        ], ignore_index=True)
+
+        ens["semana"] = pd.to_datetime(ens["semana"]).dt.normalize()
+        ens["pdv"] = ens["pdv"].astype(CODE_DTYPE)
+        ens["produto"] = ens["produto"].astype(CODE_DTYPE)
+        ens["quantidade"] = ens["quantidade"].clip(lower=0).round().astype(int)
+        ens = ens.sort_values(["semana","pdv","produto"]).reset_index(drop=True)
+
+        write_dataset(with_iso_week(ens, "semana"), out_path, DAILY_PARTITIONS, derived=DAILY_PARTITIONS)
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        with span("write ensemble_state", "write", rows=len(state), path=state_path) as sp:
+            state.to_parquet(state_path, index=False)
+            sp.set(bytes=state_path.stat().st_size)
+        clear_dirty(man, "ensemble")
+    print(out_path)
+
+if __name__ == "__main__":
+    main()
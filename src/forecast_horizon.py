@@ -0,0 +1,56 @@
+# src/forecast_horizon.py
+# Previsão de qualquer horizonte a partir de qualquer semana (ex.: 8 ou 13 semanas para
+# planejamento de reposição) com os modelos do registro: um predict por modelo sobre todas
+# as séries do WeeklyStore (matriz séries × horizonte) e uma única conversão para o formato
+# longo. Saída: data/processed/forecast_h<H>.parquet (semana, pdv, produto, uma coluna por modelo).
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from common import resolve_project_dir
+from key_encoding import CODE_DTYPE
+from models import forecast, get_model, load_plugins, to_long
+from weekly_store import WeeklyStore
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", type=str, default="ma4,holt",
+                        help="Modelos do registro separados por vírgula (sem previsão → MA4 → 0)")
+    parser.add_argument("--start", type=str, default=None,
+                        help="Primeira semana prevista (padrão: a seguinte à última do histórico)")
+    parser.add_argument("--horizon", type=int, default=4)
+    parser.add_argument("--out", type=str, default=None)
+    args = parser.parse_known_args()[0]
+
+    PROJECT_DIR = resolve_project_dir()
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    store = WeeklyStore.open(proc_dir / "weekly_store", proc_dir / "train_weekly_splits.parquet")
+    start = (pd.Timestamp(args.start) if args.start
+             else pd.Timestamp(store.weeks[-1]) + pd.Timedelta(weeks=1))
+    load_plugins()
+
+    shared = {}
+    batch, weeks, ma4 = forecast(get_model("ma4"), store, start, args.horizon, shared=shared)
+    ma4 = np.nan_to_num(ma4, nan=0.0)
+    out = None
+    for name in args.models.split(","):
+        t0 = time.perf_counter()
+        _, _, pred = forecast(get_model(name), store, start, args.horizon, shared=shared)
+        pred = np.where(np.isnan(pred), ma4, pred)
+        long = to_long(store.pdv, store.produto, weeks, pred, col=name)
+        out = long if out is None else out.assign(**{name: long[name].to_numpy()})
+        print(f"{name}: {len(batch)} séries × {args.horizon} semanas em {time.perf_counter() - t0:.2f}s")
+
+    out["pdv"] = out["pdv"].astype(CODE_DTYPE)
+    out["produto"] = out["produto"].astype(CODE_DTYPE)
+    out_path = args.out or proc_dir / f"forecast_h{args.horizon}.parquet"
+    out.to_parquet(out_path, index=False)
+    print(f"cutoff {batch.cutoff_date.date()} → {weeks[0].date()}..{weeks[-1].date()}")
+    print(out_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# src/global_gbm.py
+# Modelo global: um único HistGradientBoosting (scikit-learn) treinado em todas as séries
+# (pdv, produto), com previsão direta de h = 1..H semanas a partir da origem. Cada linha é
+# (série, origem, h) com lags 1–8 e MA4/MA8 na origem, semana do ano do alvo, h e as
+# categorias da loja (categoria_pdv, premise, de pdvs.parquet) e do produto (categoria, de
+# produtos.parquet). As matrizes são montadas em float32 por blocos de séries lidos do
+# WeeklyStore (mmap), então a memória fica limitada ao bloco e à amostra de treino.
+import numpy as np
+import pandas as pd
+
+from arrow_cache import read_cached
+from instrument import span
+from key_encoding import encode_keys
+
+N_LAGS = 8
+CATEGORICAL = ["categoria_pdv", "premise", "categoria"]
+FEATURES = [f"lag{k}" for k in range(1, N_LAGS + 1)] + ["ma4", "ma8", "semana_ano", "h"] + CATEGORICAL
+GBM_PARAMS = dict(loss="poisson", learning_rate=0.1, max_iter=200, max_leaf_nodes=31,
+                  min_samples_leaf=50, early_stopping=False, random_state=0)
+MAX_BINS = 255
+
+
+def static_features(proc_dir, pdv, produto):
+    """Categorias de cada série (séries × CATEGORICAL, float32; NaN = sem cadastro)."""
+    out = np.full((len(pdv), len(CATEGORICAL)), np.nan, dtype=np.float32)
+    for fname, key in [("pdvs.parquet", "pdv"), ("produtos.parquet", "produto")]:
+        path = proc_dir / fname
+        if not path.exists():
+            continue
+        dim = encode_keys(read_cached(path), proc_dir).drop_duplicates(key)
+        codes = pd.Index(dim[key].to_numpy()).get_indexer(np.asarray(pdv if key == "pdv" else produto))
+        for j, col in enumerate(CATEGORICAL):
+            if col not in dim.columns:
+                continue
+            cat, _ = pd.factorize(dim[col])
+            cat = np.minimum(cat, MAX_BINS - 2).astype(np.float32)
+            cat[cat < 0] = np.nan
+            out[codes >= 0, j] = cat[codes[codes >= 0]]
+    return out
+
+
+def dense_rows(store, series):
+    """Séries `series` do store como matriz densa (float32, semana não observada = 0) e a
+    1ª semana observada de cada uma."""
+    indptr = np.asarray(store.indptr)
+    starts, lens = indptr[series], np.diff(indptr)[series]
+    rows = np.repeat(np.arange(len(series)), lens)
+    obs = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens) + np.repeat(starts, lens)
+    week = np.asarray(store.week)[obs].astype(np.int64)
+    D = np.zeros((len(series), len(store.weeks)), dtype=np.float32)
+    D[rows, week] = np.nan_to_num(np.asarray(store.values)[obs].astype(np.float32), nan=0.0)
+    first = np.full(len(series), len(store.weeks), dtype=np.int64)
+    np.minimum.at(first, rows, week)
+    return D, first
+
+
+def block_features(D, first, origins, horizon, woy, static):
+    """Features (séries × origens × h, FEATURES) de um bloco; `woy` = semana do ano de cada
+    índice de semana (incluindo as futuras)."""
+    n, n_orig = D.shape[0], len(origins)
+    P = np.concatenate([np.full((n, N_LAGS), np.nan, dtype=np.float32), D], axis=1)
+    lag_week = origins[:, None] - np.arange(N_LAGS)              # origens × lags
+    lags = P[:, lag_week + N_LAGS]                               # séries × origens × lags
+    lags[lag_week[None] < first[:, None, None]] = np.nan         # antes da 1ª observação
+    X = np.empty((n, n_orig, horizon, len(FEATURES)), dtype=np.float32)
+    X[..., :N_LAGS] = lags[:, :, None, :]
+    for j, w in enumerate((4, 8)):
+        ok = ~np.isnan(lags[..., :w])
+        cnt = ok.sum(axis=-1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            X[..., N_LAGS + j] = (np.where(ok, lags[..., :w], 0).sum(axis=-1) / cnt)[:, :, None]
+    h = np.arange(1, horizon + 1)
+    X[..., N_LAGS + 2] = woy[origins[:, None] + h][None]
+    X[..., N_LAGS + 3] = h
+    X[..., N_LAGS + 4:] = static[:, None, None, :]
+    return X
+
+
+def training_set(store, cutoff, horizon, static, woy, n_origins=26, max_rows=2_000_000,
+                 h_sample=4, block=5_000, seed=0):
+    """Amostra (X, y) de linhas (série, origem, h) com alvo até o cutoff, origens nas
+    `n_origins` semanas anteriores e no máximo ~`max_rows` linhas (amostragem uniforme).
+    Cada (série, origem) contribui em média com `h_sample` horizontes, então o custo do
+    treino não cresce com o horizonte (8 ou 13 semanas custam o mesmo que 4)."""
+    origins = np.arange(max(0, cutoff - n_origins), cutoff, dtype=np.int64)
+    first_all = np.asarray(store.week)[np.asarray(store.indptr)[:-1]].astype(np.int64)
+    lo_orig = np.maximum(first_all, origins[0]) if len(origins) else first_all
+    valid = sum(int(np.clip(cutoff - h - lo_orig + 1, 0, None).sum()) for h in range(1, horizon + 1))
+    keep = min(1.0, max_rows / max(valid, 1), h_sample / horizon)
+    with span("gbm_features", "transform") as sp:
+        X, y = _training_set(store, cutoff, horizon, static, woy, origins, keep, block, seed)
+        sp.set(rows=len(y), bytes=X.nbytes)
+    return X, y
+
+
+def _training_set(store, cutoff, horizon, static, woy, origins, keep, block, seed):
+    rng = np.random.default_rng(seed)
+    Xs, ys = [], []
+    h = np.arange(1, horizon + 1)
+    for lo in range(0, len(store), block):
+        hi = min(len(store), lo + block)
+        D, first = dense_rows(store, np.arange(lo, hi))
+        target_week = origins[:, None] + h                                   # origens × h
+        ok = (origins[None, :, None] >= first[:, None, None]) & (target_week[None] <= cutoff)
+        ok &= rng.random(ok.shape) < keep
+        if not ok.any():
+            continue
+        X = block_features(D, first, origins, horizon, woy, static[lo:hi])
+        y = D[:, np.minimum(target_week, D.shape[1] - 1)]
+        Xs.append(X[ok])
+        ys.append(np.clip(y[ok], 0, None))
+    if not Xs:
+        return np.empty((0, len(FEATURES)), dtype=np.float32), np.empty(0, dtype=np.float32)
+    return np.concatenate(Xs), np.concatenate(ys)
+
+
+def fit_gbm(X, y, params=None):
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    cat = np.isin(FEATURES, CATEGORICAL)
+    with span("gbm_fit", "fit", rows=len(y), bytes=X.nbytes):
+        return HistGradientBoostingRegressor(categorical_features=cat, **{**GBM_PARAMS, **(params or {})}).fit(X, y)
+
+
+def predict_gbm(est, store, series, cutoff, horizon, static, woy, block=5_000):
+    """Previsão (séries × horizon) na origem `cutoff` com um único predict para o lote."""
+    series = np.asarray(series, dtype=np.int64)
+    origin = np.array([cutoff], dtype=np.int64)
+    Xs = []
+    for s in range(0, len(series), block):
+        idx = series[s:s + block]
+        D, first = dense_rows(store, idx)
+        X = block_features(D, first, origin, horizon, woy, static[idx])
+        Xs.append(X.reshape(-1, len(FEATURES)))
+    X = np.concatenate(Xs) if Xs else np.empty((0, len(FEATURES)), dtype=np.float32)
+    with span("gbm_predict", "fit", rows=len(X)):
+        out = np.clip(est.predict(X), 0, None) if len(X) else np.empty(0)
+    return out.reshape(len(series), horizon)
@@ -0,0 +1,97 @@
+# src/hierarchy.py
+# Previsão hierárquica: as séries (pdv, produto) são somadas em níveis agregados — loja,
+# categoria de produto, loja × categoria — com ordens de grandeza menos séries, onde o
+# modelo caro (Prophet) cabe no orçamento. A previsão de cada nó volta aos pares por
+# proporções históricas ou por uma reconciliação MinT com W diagonal, em forma fechada e
+# vetorizada (cada par pertence a um único nó do nível):
+#   x_i = b_i + d_i / (D_n · (1 + λ)) · (a_n − B_n)
+# b = previsão base do par (MA4), a = previsão do nó, d = variância estimada do par,
+# B_n/D_n = somas de b/d no nó; λ = 0 força a coerência (Σ x_i = a_n).
+import numpy as np
+import pandas as pd
+
+from arrow_cache import read_cached
+from key_encoding import encode_keys
+from weekly_store import WeeklyStore
+
+LEVELS = {
+    "pdv": ["pdv"],
+    "categoria": ["categoria"],
+    "pdv_categoria": ["pdv", "categoria"],
+}
+EPS = 1e-3
+
+
+def node_codes(proc_dir, pdv, produto, level):
+    """Nó do nível `level` de cada série (códigos 0..n-1) e a tabela dos nós."""
+    cols = LEVELS[level]
+    df = pd.DataFrame({"pdv": np.asarray(pdv), "produto": np.asarray(produto)})
+    if "categoria" in cols:
+        prod = encode_keys(read_cached(proc_dir / "produtos.parquet"), proc_dir)
+        if "categoria" not in prod.columns:   # sem categoria no cadastro: um único grupo
+            prod["categoria"] = pd.NA
+        df = df.merge(prod[["produto", "categoria"]].drop_duplicates("produto"), on="produto", how="left")
+        df["categoria"] = df["categoria"].astype("string").fillna("(sem)")
+    codes, uniq = pd.MultiIndex.from_frame(df[cols]).factorize()
+    return codes.astype(np.int64), uniq.to_frame(index=False)
+
+
+def aggregate_store(store, nodes, n_nodes, tag=-1):
+    """WeeklyStore dos nós: soma das séries membros, da primeira semana com venda em diante.
+
+    Os nós ficam em `pdv` (código do nó) com `produto` = `tag` (negativo, para não colidir
+    com pares reais em caches por série).
+    """
+    dense = store.dense(fill=0.0)
+    order = np.argsort(nodes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, nodes[order][1:] != nodes[order][:-1]]) if len(order) else []
+    agg = np.zeros((n_nodes, len(store.weeks)), dtype=np.float32)
+    if len(order):
+        agg[nodes[order][starts]] = np.add.reduceat(dense[order], starts, axis=0)
+    seen = np.cumsum(agg != 0, axis=1) > 0
+    rows, week = np.nonzero(seen)
+    indptr = np.r_[0, np.cumsum(seen.sum(axis=1))].astype(np.int64)
+    return WeeklyStore(np.arange(n_nodes, dtype=np.int32), np.full(n_nodes, tag, dtype=np.int32),
+                       indptr, week.astype(np.int16), agg[rows, week], np.asarray(store.weeks),
+                       np.asarray(store.week_label), list(store.labels))
+
+
+def node_sums(values, nodes, n_nodes):
+    """Soma por nó de `values` (n,) ou (n × h)."""
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        return np.bincount(nodes, weights=values, minlength=n_nodes)
+    return np.column_stack([np.bincount(nodes, weights=values[:, j], minlength=n_nodes)
+                            for j in range(values.shape[1])])
+
+
+def reconcile_mint(base, node_fc, nodes, d, lam=0.0, passes=5):
+    """MinT com W diagonal (forma fechada por nó); `base` (n × h) e `node_fc` (nós × h) sem NaN.
+
+    Pares que ficariam negativos são zerados e o excesso volta aos demais membros do nó
+    (algumas passadas), mantendo a soma do nó.
+    """
+    n_nodes = len(node_fc)
+    w = np.repeat((np.asarray(d, dtype=float) + EPS)[:, None], base.shape[1], axis=1)
+    gap = node_fc - node_sums(base, nodes, n_nodes)
+    x = base + w / node_sums(w, nodes, n_nodes)[nodes] * gap[nodes] / (1.0 + lam)
+    target = node_sums(x, nodes, n_nodes)
+    for _ in range(passes):
+        neg = x < 0
+        if not neg.any():
+            break
+        x[neg], w[neg] = 0.0, 0.0
+        D = node_sums(w, nodes, n_nodes)
+        resid = target - node_sums(x, nodes, n_nodes)
+        x += w / np.where(D > 0, D, 1)[nodes] * resid[nodes]
+    return np.clip(x, 0, None)
+
+
+def top_down(node_fc, nodes, share_weights):
+    """Proporções históricas: cada par recebe a fração `share_weights` do seu nó (uniforme se o nó não vendeu)."""
+    n_nodes = len(node_fc)
+    w = np.asarray(share_weights, dtype=float)
+    tot = node_sums(w, nodes, n_nodes)
+    size = np.bincount(nodes, minlength=n_nodes)
+    share = np.where(tot[nodes] > 0, w / np.where(tot[nodes] > 0, tot[nodes], 1), 1.0 / size[nodes])
+    return np.clip(node_fc[nodes] * share[:, None], 0, None)
@@ -0,0 +1,92 @@
+# src/incremental.py
+# Manifesto de marca d'água (data/processed/_manifest.json) da atualização semanal incremental:
+# quais row groups brutos já estão no diário e quais semanas cada etapa ainda precisa refazer.
+# Cada etapa consome a própria lista e repassa as semanas afetadas para a seguinte:
+#   process_transacoes -> "weekly" (prepare_data) -> "splits" (make_splits) -> "ensemble" (forecast_ensemble)
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+MANIFEST_FILE = "_manifest.json"
+ALL = "*"   # etapa sem registro ou invalidada: reprocessamento completo
+
+
+def week_start(dates):
+    """Semana do pipeline semanal (início do período W-MON, como em prepare_data)."""
+    return pd.DatetimeIndex(dates).to_period("W-MON").start_time.normalize()
+
+
+def load_manifest(proc_dir):
+    p = Path(proc_dir) / MANIFEST_FILE
+    man = json.loads(p.read_text(encoding="utf-8")) if p.exists() else {}
+    man.setdefault("raw", {})
+    man.setdefault("dirty", {})
+    return man
+
+
+def save_manifest(proc_dir, man):
+    p = Path(proc_dir) / MANIFEST_FILE
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_suffix(".tmp")
+    tmp.write_text(json.dumps(man, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+@contextmanager
+def manifest(proc_dir):
+    """Lê o manifesto e só o grava se o bloco terminar sem erro."""
+    man = load_manifest(proc_dir)
+    yield man
+    save_manifest(proc_dir, man)
+
+
+# ---------- marca d'água dos arquivos brutos ----------
+
+def _rg_signature(pfile):
+    md = pfile.metadata
+    return [[md.row_group(i).num_rows, md.row_group(i).total_byte_size]
+            for i in range(md.num_row_groups)]
+
+
+def pending_row_groups(man, name, pfile):
+    """Row groups de `name` ainda não ingeridos; None se o arquivo mudou além de crescer ou se
+    não há marca d'água (nenhum arquivo registrado: o diário existente veio de outra ingestão,
+    ou a marca foi invalidada). Arquivo novo ao lado de outros registrados: todos os row groups."""
+    if not man["raw"]:
+        return None
+    sig = _rg_signature(pfile)
+    done = man["raw"].get(name, [])
+    if sig[:len(done)] != done:
+        return None
+    return list(range(len(done), len(sig)))
+
+
+def mark_ingested(man, name, pfile):
+    man["raw"][name] = _rg_signature(pfile)
+
+
+# ---------- semanas pendentes por etapa ----------
+
+def _key(w):
+    return str(pd.Timestamp(w).date())
+
+
+def dirty_weeks(man, stage):
+    """Semanas a refazer na etapa: ALL, ou lista de Timestamps (vazia = nada mudou)."""
+    v = man["dirty"].get(stage, ALL)
+    return ALL if v == ALL else [pd.Timestamp(s) for s in v]
+
+
+def add_dirty(man, stage, weeks):
+    cur = man["dirty"].get(stage, ALL)
+    if cur == ALL or (isinstance(weeks, str) and weeks == ALL):
+        man["dirty"][stage] = ALL
+        return
+    man["dirty"][stage] = sorted(set(cur) | {_key(w) for w in weeks})
+
+
+def clear_dirty(man, stage):
+    man["dirty"][stage] = []
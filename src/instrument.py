@@ -0,0 +1,191 @@
+# src/instrument.py
+# Instrumentação das etapas: tempo de parede, CPU (incluindo processos filhos, como o cmdstan),
+# pico de RSS, linhas/bytes lidos e gravados e spans por subetapa (read, transform, fit,
+# write). As funções de E/S (datasets, arrow_cache) e os ajustes (Prophet, Holt, modelo
+# global) abrem spans sozinhos; a duração de cada ajuste Prophet por série também é guardada.
+# Com um trace ativo, o resultado vai para reports/_trace_<etapa>.json: resumo, spans e
+# `traceEvents` no formato Chrome Trace Event, que abre no Perfetto/speedscope, como os
+# perfis do py-spy. Uma linha de resumo por execução é acrescentada a
+# reports/_trace_history.jsonl, para comparar execuções e achar regressões.
+# O trace é ligado por cli.py (sempre), nas etapas de src/ rodadas direto (TRACE=0 desliga) e
+# por TRACE=1 em qualquer outro script. TRACE_PROFILE=1 grava também o cProfile em
+# reports/_profile_<etapa>.prof (pstats/snakeviz).
+# Sem trace ativo, span() não registra nada.
+import atexit
+import json
+import multiprocessing as mp
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+_CURRENT = None
+
+
+def _cpu():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _rss_mb():
+    # ru_maxrss em KB no Linux (bytes no macOS)
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / 1024 ** 2
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return round(own, 1), round(kids, 1)
+
+
+def path_bytes(path):
+    path = Path(path)
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+class Trace:
+    def __init__(self, stage, out_dir=None, profile=None):
+        self.stage = stage
+        self.out_dir = Path(out_dir) if out_dir else None
+        self.profile = os.getenv("TRACE_PROFILE", "0") == "1" if profile is None else profile
+        self.spans, self.stack = [], []
+        self.fits = {"pdv": [], "produto": [], "fit_seconds": [], "start": []}
+        self.profiler = None
+
+    def __enter__(self):
+        global _CURRENT
+        self.t0, self.cpu0, self.started = time.perf_counter(), _cpu(), time.time()
+        if self.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        _CURRENT = self
+        return self
+
+    def __exit__(self, *exc):
+        global _CURRENT
+        if self.profiler is not None:
+            self.profiler.disable()
+        _CURRENT = None
+        self.wall, self.cpu = time.perf_counter() - self.t0, _cpu() - self.cpu0
+        self.failed = exc[0] is not None and not (exc[0] is SystemExit and not exc[1].code)
+        self.save()
+        return False
+
+    def add_fits(self, pdv, produto, seconds, start):
+        plain = lambda x: x.item() if hasattr(x, "item") else x   # escalares numpy → JSON
+        self.fits["pdv"] += [plain(x) for x in pdv]
+        self.fits["produto"] += [plain(x) for x in produto]
+        self.fits["fit_seconds"] += [round(float(x), 4) for x in seconds]
+        self.fits["start"] += [str(x) for x in start]
+
+    def summary(self):
+        def total(kind, field):
+            # spans dentro de outro do mesmo tipo (ex.: read_table dentro de read_cached) não somam de novo
+            return sum(s[field] or 0 for s in self.spans if s["kind"] == kind and not s["nested"])
+        by_kind = {}
+        for s in self.spans:
+            if s["depth"] == 0:
+                by_kind[s["kind"]] = round(by_kind.get(s["kind"], 0.0) + s["wall_s"], 3)
+        fit_s = sorted(self.fits["fit_seconds"])
+        rss, rss_children = _rss_mb()
+        out = {
+            "stage": self.stage, "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "argv": sys.argv[1:], "ok": not self.failed,
+            "wall_s": round(self.wall, 3), "cpu_s": round(self.cpu, 3),
+            "peak_rss_mb": rss, "peak_rss_children_mb": rss_children,
+            "rows_in": total("read", "rows"), "bytes_in": total("read", "bytes"),
+            "rows_out": total("write", "rows"), "bytes_out": total("write", "bytes"),
+            "wall_by_kind_s": by_kind,
+            "untracked_s": round(self.wall - sum(by_kind.values()), 3),
+        }
+        if fit_s:
+            q = lambda p: fit_s[min(len(fit_s) - 1, int(p * len(fit_s)))]
+            out["series_fits"] = {"n": len(fit_s), "total_s": round(sum(fit_s), 3),
+                                  "p50_s": q(0.5), "p90_s": q(0.9), "max_s": fit_s[-1]}
+        return out
+
+    def save(self):
+        if self.out_dir is None:
+            from common import resolve_project_dir
+            self.out_dir = resolve_project_dir() / "reports"
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        summ = self.summary()
+        events = [{"name": s["name"], "cat": s["kind"], "ph": "X", "pid": os.getpid(), "tid": 0,
+                   "ts": round(s["start_s"] * 1e6), "dur": round(s["wall_s"] * 1e6),
+                   "args": {k: s[k] for k in ("rows", "bytes", "path", "cpu_s", "rss_mb") if s.get(k) is not None}}
+                  for s in self.spans]
+        events.insert(0, {"name": self.stage, "cat": "stage", "ph": "X", "pid": os.getpid(), "tid": 0,
+                          "ts": 0, "dur": round(self.wall * 1e6)})
+        doc = {"summary": summ, "spans": self.spans, "series_fits": self.fits, "traceEvents": events}
+        (self.out_dir / f"_trace_{self.stage}.json").write_text(json.dumps(doc, default=str), encoding="utf-8")
+        with open(self.out_dir / "_trace_history.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(summ, default=str) + "\n")
+        if self.profiler is not None:
+            self.profiler.dump_stats(str(self.out_dir / f"_profile_{self.stage}.prof"))
+
+
+class _Span(dict):
+    def set(self, rows=None, bytes=None, path=None):
+        if rows is not None:
+            self["rows"] = int(rows)
+        if bytes is not None:
+            self["bytes"] = int(bytes)
+        if path is not None:
+            self["path"] = str(path)
+        return self
+
+
+class _NoSpan:
+    def set(self, **_):
+        return self
+
+
+@contextmanager
+def span(name, kind="transform", **fields):
+    """Subetapa `name` do tipo read/transform/fit/write; `.set(rows=, bytes=, path=)` no corpo."""
+    tr = _CURRENT
+    if tr is None:
+        yield _NoSpan()
+        return
+    s = _Span(name=name, kind=kind, depth=len(tr.stack), nested=any(p["kind"] == kind for p in tr.stack),
+              rows=None, bytes=None, path=None, start_s=round(time.perf_counter() - tr.t0, 6))
+    s.set(**fields)
+    tr.stack.append(s)
+    t0, c0 = time.perf_counter(), _cpu()
+    try:
+        yield s
+    finally:
+        tr.stack.pop()
+        s["wall_s"] = round(time.perf_counter() - t0, 6)
+        s["cpu_s"] = round(_cpu() - c0, 6)
+        s["rss_mb"] = _rss_mb()[0]
+        tr.spans.append(s)
+
+
+def record_fits(pdv, produto, seconds, start):
+    """Duração de cada ajuste por série (ex.: Prophet) no trace ativo."""
+    if _CURRENT is not None:
+        _CURRENT.add_fits(pdv, produto, seconds, start)
+
+
+def active():
+    return _CURRENT is not None
+
+
+def _auto_trace():
+    # trace do processo inteiro, nomeado pelo script (só no processo principal): padrão nas
+    # etapas de src/ chamadas direto (cli.py e pipeline.py abrem o próprio trace), TRACE=1 nos demais
+    script = Path(sys.argv[0]).resolve() if sys.argv and sys.argv[0] not in ("", "-c") else None
+    is_stage = (script is not None and script.parent == Path(__file__).resolve().parent
+                and script.stem not in ("cli", "pipeline"))
+    if os.getenv("TRACE", "1" if is_stage else "0") != "1" or _CURRENT is not None \
+            or mp.parent_process() is not None:
+        return
+    stage = script.stem if script is not None else "python"
+    tr = Trace(stage).__enter__()
+    atexit.register(lambda: _CURRENT is tr and tr.__exit__(None, None, None))
+
+
+_auto_trace()
@@ -0,0 +1,81 @@
+# src/intermittent.py
+# Caminho rápido para séries esparsas: a maior parte dos pares (pdv, produto) vende em poucas
+# semanas. Um classificador por densidade e recência separa
+#   morta        — sem venda nas últimas `dead_weeks` semanas até o cutoff: previsão 0 em bloco;
+#   intermitente — intervalo médio entre vendas (ADI) >= `adi_max`: Croston/SBA/TSB;
+#   densa        — o resto, que segue para os modelos pesados (Prophet, Holt, MA4).
+# Croston/SBA/TSB rodam em lote sobre a matriz densa semanas × séries, um vetor por semana,
+# como o batch_holt; a previsão é constante no horizonte.
+import numpy as np
+
+from instrument import span
+
+DEAD, INTERMITTENT, DENSE = 0, 1, 2
+BUCKETS = ("morta", "intermitente", "densa")
+DEAD_WEEKS = 13
+ADI_MAX = 1.32   # corte de Syntetos-Boylan para demanda intermitente
+ALPHA = 0.1
+METHODS = ("croston", "sba", "tsb")
+
+
+def sparse_stats(Y, first):
+    """ADI (semanas desde a 1ª observação / semanas com venda) e semanas sem venda até o fim
+    de Y (semanas × séries). Séries sem venda: ADI e ociosidade infinitos."""
+    T = Y.shape[0]
+    pos = Y > 0
+    n_pos = pos.sum(axis=0)
+    last = T - 1 - np.argmax(pos[::-1], axis=0)
+    sold = n_pos > 0
+    adi = np.where(sold, (T - first) / np.maximum(n_pos, 1), np.inf)
+    idle = np.where(sold, T - 1 - last, np.inf)
+    return adi, idle
+
+
+def bucket_of(adi, idle, dead_weeks=DEAD_WEEKS, adi_max=ADI_MAX):
+    """Bucket de cada série; ociosidade NaN (par sem histórico) conta como morta.
+    `dead_weeks` <= 0 desliga o bucket de mortas; `adi_max` <= 0, o de intermitentes."""
+    adi, idle = np.asarray(adi, dtype=float), np.asarray(idle, dtype=float)
+    out = np.full(len(adi), DENSE, dtype=np.int8)
+    if adi_max > 0:
+        out[adi >= adi_max] = INTERMITTENT
+    if dead_weeks > 0:
+        out[np.isnan(idle) | (idle >= dead_weeks)] = DEAD
+    return out
+
+
+def croston_batch(Y, first, alpha=ALPHA, beta=ALPHA, block=8192):
+    """Nível previsto por série (colunas de Y semanas × séries) para cada método de METHODS.
+
+    Croston: tamanho z e intervalo p entre vendas suavizados (alpha) só nas semanas com
+    venda, previsão z/p; SBA corrige o viés com (1 − alpha/2); TSB suaviza a probabilidade
+    de venda em toda semana (beta), o que decai a previsão de séries que pararam de vender.
+    """
+    with span("croston_batch", "fit", rows=Y.shape[1]):
+        return _croston_batch(Y, first, alpha, beta, block)
+
+
+def _croston_batch(Y, first, alpha, beta, block):
+    T, n = Y.shape
+    out = {m: np.zeros(n, dtype=np.float32) for m in METHODS}
+    for s in range(0, n, block):
+        Yb, fb = Y[:, s:s + block], first[s:s + block]
+        shape = Yb.shape[1]
+        size, interval, prob = (np.zeros(shape, dtype=np.float32) for _ in range(3))
+        since = np.ones(shape, dtype=np.float32)   # semanas desde a última venda
+        seen = np.zeros(shape, dtype=bool)
+        for t in range(int(fb.min()) if shape else T, T):
+            y = Yb[t]
+            sale = y > 0
+            init, upd = sale & ~seen, sale & seen
+            prob[seen] += beta * (sale[seen] - prob[seen])
+            size[upd] += alpha * (y[upd] - size[upd])
+            interval[upd] += alpha * (since[upd] - interval[upd])
+            size[init], interval[init], prob[init] = y[init], 1.0, 1.0
+            seen |= sale
+            since = np.where(sale, 1.0, since + 1.0).astype(np.float32)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            croston = np.where(seen, size / np.where(seen, interval, 1.0), 0.0)
+        out["croston"][s:s + block] = croston
+        out["sba"][s:s + block] = croston * (1 - alpha / 2)
+        out["tsb"][s:s + block] = np.where(seen, prob * size, 0.0)
+    return {m: np.clip(v, 0, None) for m, v in out.items()}
@@ -0,0 +1,133 @@
+# src/key_encoding.py
+# Dicionários persistentes pdv/produto -> código int32.
+# Os códigos são atribuídos na ingestão e nunca mudam (valores novos entram no fim),
+# então todos os joins/groupbys do pipeline rodam sobre inteiros e as strings
+# originais só voltam na exportação (decode_keys).
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+KEY_COLS = ("pdv", "produto")
+CODE_DTYPE = "int32"
+
+
+def dict_path(proc_dir, col):
+    return Path(proc_dir) / f"_dict_{col}.parquet"
+
+
+@contextmanager
+def _locked(proc_dir, timeout=120):
+    # ingestões paralelas (process_*) atualizam os mesmos dicionários
+    lock = Path(proc_dir) / "_dict.lock"
+    lock.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.time()
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.time() - t0 > timeout:
+                raise TimeoutError(f"Lock de dicionário preso: {lock}")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        lock.unlink(missing_ok=True)
+
+
+def load_dict(proc_dir, col):
+    """Valores do dicionário em ordem de código (posição i = código i)."""
+    p = dict_path(proc_dir, col)
+    if not p.exists():
+        return pd.Index([], dtype="string")
+    d = pd.read_parquet(p)
+    return pd.Index(d.sort_values("code")["valor"].astype("string"))
+
+
+def is_encoded(s):
+    return pd.api.types.is_integer_dtype(s)
+
+
+def _encode_values(s, known):
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    uniques = pd.Index(uniques).astype("string")
+    pos = known.get_indexer(uniques)
+    new = uniques[pos < 0]
+    if len(new):
+        pos[pos < 0] = np.arange(len(known), len(known) + len(new))
+        known = known.append(new)
+    mapped = np.where(codes >= 0, pos[np.maximum(codes, 0)], -1)
+    return mapped.astype(CODE_DTYPE), known
+
+
+def _save_dict(proc_dir, col, known):
+    out = pd.DataFrame({"code": np.arange(len(known), dtype=CODE_DTYPE),
+                        "valor": known.astype("string")})
+    tmp = dict_path(proc_dir, col).with_suffix(".tmp")
+    out.to_parquet(tmp, index=False)
+    os.replace(tmp, dict_path(proc_dir, col))
+
+
+class KeyEncoder:
+    """Codificador em memória para muitos lotes (ex.: row groups); grava os dicionários no fim.
+
+        with KeyEncoder(proc_dir) as enc:
+            for lote in lotes:
+                lote = enc.encode(lote)
+    """
+
+    def __init__(self, proc_dir, cols=KEY_COLS):
+        self.proc_dir, self.cols = Path(proc_dir), list(cols)
+        self._lock = None
+
+    def __enter__(self):
+        self._lock = _locked(self.proc_dir)
+        self._lock.__enter__()
+        self.known = {c: load_dict(self.proc_dir, c) for c in self.cols}
+        self._n0 = {c: len(v) for c, v in self.known.items()}
+        return self
+
+    def encode(self, df):
+        for c in self.cols:
+            if c in df.columns and not is_encoded(df[c]):
+                df[c], self.known[c] = _encode_values(df[c], self.known[c])
+        return df
+
+    def __exit__(self, *exc):
+        try:
+            if exc[0] is None:
+                for c in self.cols:
+                    if len(self.known[c]) != self._n0[c]:
+                        _save_dict(self.proc_dir, c, self.known[c])
+        finally:
+            self._lock.__exit__(*exc)
+        return False
+
+
+def encode_keys(df, proc_dir, cols=KEY_COLS):
+    """Substitui as colunas de chave por códigos int32, estendendo os dicionários em disco.
+
+    Chaves nulas viram -1. Colunas já codificadas são mantidas.
+    """
+    cols = [c for c in cols if c in df.columns and not is_encoded(df[c])]
+    if not cols:
+        return df
+    with KeyEncoder(proc_dir, cols) as enc:
+        return enc.encode(df)
+
+
+def decode_keys(df, proc_dir, cols=KEY_COLS):
+    """Volta os códigos para as strings originais (no-op para colunas já em texto)."""
+    for c in cols:
+        if c in df.columns and is_encoded(df[c]):
+            known = load_dict(proc_dir, c)
+            codes = df[c].to_numpy()
+            if len(codes) and codes.max() >= len(known):
+                raise ValueError(f"Código de {c} fora do dicionário {dict_path(proc_dir, c)}")
+            df[c] = pd.Categorical.from_codes(codes, categories=known).astype("string")
+    return df
@@ -1,14 +1,24 @@
+import argparse
 import pandas as pd
 from common import resolve_project_dir
+from datasets import DAILY_PARTITIONS, drop_partitions, read_dataset, read_meta, with_iso_week, write_dataset
+from incremental import ALL, add_dirty, clear_dirty, dirty_weeks, manifest
 
-PROJECT_DIR = resolve_project_dir()
-wk_path = PROJECT_DIR / "data" / "processed" / "train_weekly.parquet"
-out_path = PROJECT_DIR / "data" / "processed" / "train_weekly_splits.parquet"
+parser = argparse.ArgumentParser()
+parser.add_argument("--pdv_buckets", type=int, default=0,
+                    help="Também particiona por pdv %% N (0 = só por split)")
+parser.add_argument("--incremental", action="store_true",
+                    help="Regrava só as semanas novas/alteradas ou que mudaram de split")
+args = parser.parse_known_args()[0]
 
-wk = pd.read_parquet(wk_path)
-wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
+PROJECT_DIR = resolve_project_dir()
+proc_dir = PROJECT_DIR / "data" / "processed"
+wk_path = proc_dir / "train_weekly.parquet"
+out_path = proc_dir / "train_weekly_splits.parquet"
 
-weeks_2022 = sorted(wk.loc[wk["semana"].dt.year == 2022, "semana"].unique())
+# rótulos vêm só do calendário de semanas (coluna única, barata de ler)
+all_weeks = pd.to_datetime(read_dataset(wk_path, columns=["semana"])["semana"]).dt.normalize().unique()
+weeks_2022 = sorted(w for w in all_weeks if w.year == 2022)
 val4 = weeks_2022[-4:] if len(weeks_2022) >= 4 else weeks_2022
 val8 = weeks_2022[-8:] if len(weeks_2022) >= 8 else weeks_2022
 
@@ -19,6 +29,39 @@ def label_split(d):
         return "val8"
     return "train"
 
-wk["split"] = wk["semana"].map(label_split)
-wk.to_parquet(out_path, index=False)
+labels = {str(w.date()): label_split(w) for w in all_weeks}
+
+with manifest(proc_dir) as man:
+    weeks = dirty_weeks(man, "splits") if args.incremental and out_path.is_dir() else ALL
+    stored_buckets = read_meta(out_path).get("pdv_buckets") if out_path.is_dir() else None
+    if weeks != ALL and args.pdv_buckets and args.pdv_buckets != stored_buckets:
+        # outro N de baldes muda a partição de todas as linhas: regrava tudo
+        print(f"pdv_buckets {stored_buckets} → {args.pdv_buckets}: regravando o dataset inteiro")
+        weeks = ALL
+    if weeks != ALL:
+        # semanas com dados novos + semanas que mudaram de split (janela val4/val8 andou)
+        old = man.get("split_labels", {})
+        weeks = sorted(set(weeks) | {pd.Timestamp(w) for w, lab in labels.items() if old.get(w) != lab})
+        if not weeks:
+            print("Nenhuma semana pendente;", out_path)
+            raise SystemExit(0)
+
+    wk = read_dataset(wk_path, filters=None if weeks == ALL else [("semana", "in", weeks)])
+    wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
+    wk["split"] = wk["semana"].map(label_split)
+
+    # dataset por split e semana (e opcionalmente balde de pdv); leitores filtram só o que precisam
+    pdv_buckets = args.pdv_buckets
+    if weeks != ALL:
+        pdv_buckets = pdv_buckets or stored_buckets
+        for w in with_iso_week(pd.DataFrame({"semana": weeks}), "semana").itertuples():
+            drop_partitions(out_path, ano_iso=w.ano_iso, semana_iso=w.semana_iso)
+    write_dataset(with_iso_week(wk, "semana"), out_path, ["split"] + DAILY_PARTITIONS,
+                  derived=DAILY_PARTITIONS, sort_by=["pdv","produto","semana"], pdv_buckets=pdv_buckets,
+                  existing="replace" if weeks == ALL else "partitions")
+
+    man["split_labels"] = labels
+    clear_dirty(man, "splits")
+    add_dirty(man, "ensemble", weeks)
+    print("semanas regravadas:", "todas" if weeks == ALL else len(weeks))
 print(out_path)
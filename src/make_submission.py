@@ -1,41 +1,190 @@
+# src/make_submission.py
+# CSV de submissão em streaming: o forecast do ensemble é lido em RecordBatches, os códigos
+# int32 de pdv/produto voltam às strings originais na escrita (take no dicionário) e cada lote
+# passa pelo writer CSV do Arrow (";", UTF-8), sem montar o DataFrame inteiro. As validações
+# (schema, nulos, semanas esperadas, só segundas, não negatividade e unicidade de
+# semana × pdv × produto) são acumuladas no mesmo passe. A unicidade guarda as chaves
+# (8 bytes por linha) só da semana em curso: o forecast é particionado por semana e cada semana
+# é verificada e descartada quando termina. Sem partição por semana (arquivo único antigo),
+# as chaves de todas as linhas ficam em memória até o fim.
+# A serialização de cada lote roda em threads (o Arrow solta o GIL) e os pedaços são gravados
+# em ordem. Com --compress gzip/zstd, cada lote vira um membro gzip / frame zstd independente;
+# a concatenação é um .gz/.zst válido, então a compressão também é paralela.
+#
+#   python src/make_submission.py --compress zstd --threads 8
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
 from common import resolve_project_dir
+from datasets import iter_batches, read_meta
+from instrument import span
+from key_encoding import KEY_COLS, dict_path, load_dict
+
+COLUMNS = {"semana": "Semana", "pdv": "PDV", "produto": "Produto", "quantidade": "Quantidade"}
+EXPECTED_WEEKS = pd.to_datetime(["2023-01-02","2023-01-09","2023-01-16","2023-01-23"])
+SUFFIX = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+class Checks:
+    """Validações acumuladas lote a lote. Com `by_week` (entrada agrupada por semana), as chaves
+    de uma semana são verificadas e descartadas assim que um lote chega sem ela."""
+
+    def __init__(self, by_week=True):
+        self.by_week = by_week
+        self.rows = self.nulls = self.nans = self.negatives = self.dup = 0
+        self.names, self.types_ok = None, True
+        self.open = {}        # semana em curso → [chaves pdv × produto em int64/uint64]
+        self.closed = set()   # semanas já verificadas
+
+    def _close(self, d):
+        k = np.sort(np.concatenate(self.open.pop(d)))
+        self.dup += int((k[1:] == k[:-1]).sum())
+        self.closed.add(d)
+
+    def update(self, batch):
+        if self.names is None:
+            self.names = batch.schema.names
+        semana, pdv, produto, qtd = (batch.column(c) for c in COLUMNS)
+        self.rows += batch.num_rows
+        self.nulls += sum(batch.column(c).null_count for c in COLUMNS)
+        self.types_ok &= (pa.types.is_temporal(semana.type)
+                          and (pa.types.is_integer(qtd.type) or pa.types.is_floating(qtd.type)))
+        if batch.num_rows:
+            self.negatives += int(pc.sum(pc.less(qtd, 0)).as_py() or 0)
+            if pa.types.is_floating(qtd.type):   # NaN não é nulo no Arrow; no to_output viraria 0
+                self.nans += int(pc.sum(pc.is_nan(qtd)).as_py() or 0)
+        days = pc.cast(pc.cast(semana, pa.date32(), safe=False), pa.int32()).to_numpy(zero_copy_only=False)
+        pair = _pair_keys(pdv, produto)
+        present = [int(d) for d in np.unique(days)]
+        if self.by_week:
+            for d in [d for d in self.open if d not in present]:
+                self._close(d)
+        for d in present:
+            if d in self.closed:
+                raise ValueError(f"Semana {pd.Timestamp(d, unit='D').date()} reaparece depois de "
+                                 "fechada: forecast não está agrupado por semana")
+            self.open.setdefault(d, []).append(pair[days == d])
+
+    def result(self):
+        for d in list(self.open):
+            self._close(d)
+        weeks = pd.to_datetime(sorted(self.closed), unit="D")
+        return {
+            "schema_cols": self.names in (None, list(COLUMNS)) and self.types_ok,
+            "no_nans": self.nulls == 0 and self.nans == 0,
+            "types_int_nonneg": True,   # quantidade sai arredondada, int e >= 0 (negativos truncados)
+            "negatives_clipped": self.negatives,
+            "weeks_expected": set(weeks) == set(EXPECTED_WEEKS),
+            "monday_only": bool((weeks.weekday == 0).all()),
+            "unique_keys": self.dup == 0,
+            "rows_csv": self.rows,
+        }
+
+
+def _pair_keys(pdv, produto):
+    # códigos int32 → chave exata (pdv << 32 | produto); chaves em texto (arquivos antigos) → hash
+    if pa.types.is_integer(pdv.type) and pa.types.is_integer(produto.type):
+        return (pdv.to_numpy(zero_copy_only=False).astype(np.int64) << 32) | \
+            produto.to_numpy(zero_copy_only=False).astype(np.uint32).astype(np.int64)
+    h = pd.util.hash_array(np.asarray(pdv.to_pylist(), dtype=object))
+    return h * np.uint64(1_000_003) ^ pd.util.hash_array(np.asarray(produto.to_pylist(), dtype=object))
+
+
+def _decode(col, values, name, proc_dir):
+    # código → string original; códigos fora do dicionário (ou -1) são erro, como em decode_keys
+    if not pa.types.is_integer(col.type) or not len(col):
+        return col
+    lo, hi = pc.min_max(col).values()
+    if lo.as_py() is not None and (lo.as_py() < 0 or hi.as_py() >= len(values)):
+        raise ValueError(f"Código de {name} fora do dicionário {dict_path(proc_dir, name)}")
+    return pc.take(values, col)
+
+
+def to_output(batch, dicts, proc_dir):
+    """Lote do ensemble → tabela no formato da submissão (Semana, PDV, Produto, Quantidade)."""
+    qtd = batch.column("quantidade")
+    if pa.types.is_floating(qtd.type):
+        # NaN sai como campo vazio (nulo), como os nulos, e não como 0 do max_element_wise
+        qtd = pc.if_else(pc.is_nan(qtd), pa.scalar(None, qtd.type), pc.round(qtd))
+    qtd = pc.cast(pc.max_element_wise(qtd, 0, skip_nulls=False), pa.int64(), safe=False)
+    arrays = [pc.cast(batch.column("semana"), pa.date32(), safe=False),
+              _decode(batch.column("pdv"), dicts["pdv"], "pdv", proc_dir),
+              _decode(batch.column("produto"), dicts["produto"], "produto", proc_dir),
+              qtd]
+    return pa.Table.from_arrays(arrays, names=list(COLUMNS.values()))
+
+
+def encode(table, header, codec):
+    # sem aspas, como o to_csv: chave com ";", aspas ou quebra de linha é erro do writer
+    # (o cabeçalho é montado aqui: o writer do Arrow sempre põe aspas nos nomes das colunas)
+    buf = pa.BufferOutputStream()
+    if header:
+        buf.write((";".join(table.column_names) + "\n").encode("utf-8"))
+    pacsv.write_csv(table, buf, pacsv.WriteOptions(include_header=False, delimiter=";", quoting_style="none"))
+    data = buf.getvalue()
+    return codec.compress(data) if codec is not None else data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--compress", choices=list(SUFFIX), default="none",
+                        help="gzip/zstd: um membro/frame por lote, comprimidos em paralelo")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch_rows", type=int, default=256_000)
+    args = parser.parse_known_args()[0]
+
+    PROJECT_DIR = resolve_project_dir()
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    parq_path = proc_dir / "forecast_ensemble_jan2023.parquet"
+    csv_path = PROJECT_DIR / "reports" / f"submission_ensemble_jan2023.csv{SUFFIX[args.compress]}"
+    check_md = PROJECT_DIR / "reports" / "_submission_checks.md"
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # dicionários carregados uma vez: as strings originais só voltam aqui
+    dicts = {c: pa.array(load_dict(proc_dir, c).to_numpy(dtype=object), pa.string()) for c in KEY_COLS}
+    codec = pa.Codec(args.compress) if args.compress != "none" else None
+    # partições ano_iso/semana_iso saem em ordem: cada semana chega inteira antes da seguinte
+    parts = [f["name"] for f in read_meta(parq_path).get("partitioning", [])]
+    checks = Checks(by_week="semana_iso" in parts)
+
+    t0 = time.perf_counter()
+    tmp = csv_path.with_name(csv_path.name + ".tmp")
+    with span(f"write {csv_path.name}", "write", path=csv_path) as sp, \
+            ThreadPoolExecutor(max(1, args.threads)) as pool, open(tmp, "wb") as f:
+        pending, n_bytes = deque(), 0
+        for i, batch in enumerate(iter_batches(parq_path, batch_size=args.batch_rows)):
+            checks.update(batch)
+            pending.append(pool.submit(encode, to_output(batch, dicts, proc_dir), i == 0, codec))
+            while len(pending) > 2 * args.threads or (pending and pending[0].done()):
+                n_bytes += f.write(pending.popleft().result())
+        while pending:
+            n_bytes += f.write(pending.popleft().result())
+        if n_bytes == 0:   # dataset sem lotes: só o cabeçalho
+            empty = pa.Table.from_arrays([pa.array([], pa.string())] * 4, names=list(COLUMNS.values()))
+            n_bytes += f.write(encode(empty, True, codec))
+        sp.set(rows=checks.rows, bytes=n_bytes)
+    os.replace(tmp, csv_path)
+    secs = time.perf_counter() - t0
+
+    md = ["# Submission checks — jan/2023",
+          f"- CSV: `{csv_path.relative_to(PROJECT_DIR)}`",
+          "",
+          "## Resultado"] + [f"- {k}: **{v}**" for k, v in checks.result().items()]
+    check_md.write_text("\n".join(md), encoding="utf-8")
+
+    print(f"{checks.rows} linhas, {n_bytes / 1e6:.1f} MB em {secs:.2f}s")
+    print(csv_path)
+    print(check_md)
+
 
-PROJECT_DIR = resolve_project_dir()
-parq_path = PROJECT_DIR / "data" / "processed" / "forecast_ensemble_jan2023.parquet"
-csv_path  = PROJECT_DIR / "reports" / "submission_ensemble_jan2023.csv"
-check_md  = PROJECT_DIR / "reports" / "_submission_checks.md"
-
-ens = pd.read_parquet(parq_path)
-
-sub = ens.rename(columns={"semana":"Semana","pdv":"PDV","produto":"Produto","quantidade":"Quantidade"})
-sub["Semana"] = pd.to_datetime(sub["Semana"]).dt.normalize()
-sub["Quantidade"] = sub["Quantidade"].clip(lower=0).round().astype(int)
-
-sub.to_csv(csv_path, index=False, sep=";", encoding="utf-8")
-
-# validações
-w = sub["Semana"].unique()
-weeks_ok = set(w) == set(pd.to_datetime(["2023-01-02","2023-01-09","2023-01-16","2023-01-23"]))
-monday_ok = (pd.to_datetime(sub["Semana"]).dt.weekday == 0).all()
-schema_ok = list(sub.columns) == ["Semana","PDV","Produto","Quantidade"]
-no_nans = not sub.isna().any().any()
-nonneg = (sub["Quantidade"] >= 0).all()
-
-checks = {
-    "schema_cols": schema_ok,
-    "no_nans": no_nans,
-    "types_int_nonneg": True,  # já convertido para int não-negativo
-    "weeks_expected": weeks_ok,
-    "monday_only": monday_ok,
-    "rows_csv": int(len(sub)),
-}
-
-md = ["# Submission checks — jan/2023",
-      f"- CSV: `{csv_path.relative_to(PROJECT_DIR)}`",
-      "",
-      "## Resultado"] + [f"- {k}: **{v}**" for k,v in checks.items()]
-check_md.write_text("\n".join(md), encoding="utf-8")
-
-print(csv_path)
-print(check_md)
+if __name__ == "__main__":
+    main()
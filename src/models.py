@@ -0,0 +1,391 @@
+# src/models.py
+# Registro de modelos compartilhado por baselines, Prophet, Holt, ensemble e backtest.
+# Cada modelo recebe um lote de séries (SeriesBatch: séries do WeeklyStore cortadas num
+# cutoff) e devolve uma matriz séries × horizonte (NaN = sem previsão, o chamador aplica o
+# fallback). Além disso declara se é vetorizado (um cálculo para o lote inteiro) ou por
+# série, e o custo estimado em CPU-segundos por série, usado por `allocate` para dividir os
+# pares (em ordem de prioridade) entre níveis por orçamento.
+# Plugins: módulos listados em MODEL_PLUGINS (separados por vírgula) são importados por
+# load_plugins() e registram seus modelos com @register("nome").
+import importlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from batch_holt import ALPHAS, BETAS, PHI, holt_batch
+from common import resolve_project_dir
+from global_gbm import fit_gbm, predict_gbm, static_features, training_set
+from hierarchy import LEVELS, aggregate_store, node_codes, reconcile_mint, top_down
+from intermittent import ALPHA, croston_batch
+from prophet_engine import MIN_TRAIN_WEEKS, PROPHET_PARAMS, fit_predict_pairs
+from warm_start import ParamStore
+
+REGISTRY = {}   # nome → (classe, parâmetros padrão)
+
+
+def register(name, cls=None, **defaults):
+    """Registra `cls` sob `name` (também funciona como decorador: @register("nome"))."""
+    def deco(c):
+        REGISTRY[name] = (c, defaults)
+        return c
+    return deco if cls is None else deco(cls)
+
+
+def get_model(name, **params):
+    if name not in REGISTRY:
+        raise KeyError(f"Modelo não registrado: {name} (disponíveis: {', '.join(REGISTRY)})")
+    cls, defaults = REGISTRY[name]
+    model = cls(**{**defaults, **params})
+    model.name = name
+    return model
+
+
+def model_names(vectorized=None):
+    """Nomes registrados, na ordem de registro (opcionalmente só vetorizados / por série)."""
+    return [n for n, (c, _) in REGISTRY.items() if vectorized is None or c.vectorized == vectorized]
+
+
+def load_plugins(modules=None):
+    mods = modules if modules is not None else os.getenv("MODEL_PLUGINS", "")
+    if isinstance(mods, str):
+        mods = [m.strip() for m in mods.split(",") if m.strip()]
+    for m in mods:
+        importlib.import_module(m)
+    return model_names()
+
+
+class SeriesBatch:
+    """Séries do store (índices `series`) com histórico até a semana `cutoff` (índice em store.weeks).
+
+    `shared` guarda o que vale para qualquer cutoff (matriz densa, chaves das observações,
+    features por observação) e pode ser reaproveitado entre lotes — ex.: folds do backtest.
+    """
+
+    def __init__(self, store, cutoff, horizon, series=None, shared=None):
+        self.store, self.cutoff, self.horizon = store, int(cutoff), int(horizon)
+        self.series = np.arange(len(store)) if series is None else np.asarray(series, dtype=np.int64)
+        self.shared = {} if shared is None else shared
+        indptr = np.asarray(store.indptr)
+        n_weeks = len(store.weeks)
+        key = self.feature("_obs_key", lambda s: s.row_ids() * n_weeks + np.asarray(s.week))
+        self.pos = np.searchsorted(key, self.series * n_weeks + self.cutoff, side="right") - 1
+        self.start = indptr[:-1][self.series]
+        self.n_obs = np.maximum(self.pos - self.start + 1, 0)
+
+    def __len__(self):
+        return len(self.series)
+
+    def subset(self, idx):
+        return SeriesBatch(self.store, self.cutoff, self.horizon, self.series[idx], self.shared)
+
+    def feature(self, name, fn):
+        """Feature por observação (alinhada a store.values), calculada uma vez por store."""
+        if name not in self.shared:
+            self.shared[name] = fn(self.store)
+        return self.shared[name]
+
+    def last(self, values):
+        """Valor de `values` (por observação) na última observação até o cutoff; NaN sem histórico."""
+        out = np.full(len(self), np.nan)
+        ok = self.n_obs > 0
+        out[ok] = np.asarray(values)[self.pos[ok]]
+        return out
+
+    def dense(self):
+        """Histórico séries × semanas até o cutoff (float32, semana não observada = 0)."""
+        full = self.feature("_dense", lambda s: s.dense(fill=0.0))
+        return full[self.series, :self.cutoff + 1]
+
+    @property
+    def cutoff_date(self):
+        return pd.Timestamp(self.store.weeks[self.cutoff])
+
+    @property
+    def future(self):
+        return pd.date_range(self.cutoff_date + pd.Timedelta(weeks=1), periods=self.horizon, freq="7D")
+
+    def history(self):
+        """Gera (pdv, produto, ds, y) só com as semanas observadas até o cutoff."""
+        weeks, week = np.asarray(self.store.weeks), np.asarray(self.store.week)
+        for i, s, e in zip(self.series, self.start, self.pos + 1):
+            yield (self.store.pdv[i], self.store.produto[i], weeks[week[s:e]],
+                   np.asarray(self.store.values[s:e], dtype=float))
+
+
+class Model:
+    name = None
+    vectorized = True   # um cálculo para o lote inteiro (False = ajuste por série)
+    cost = 0.0          # CPU-segundos estimados por série
+
+    def __init__(self, **params):
+        self.params = params
+
+    def fit(self, batch):
+        return self
+
+    def predict(self, batch):
+        raise NotImplementedError
+
+    def fit_predict(self, batch):
+        return self.fit(batch).predict(batch)
+
+    def in_sample(self, store):
+        """Previsão por observação do store (usada por train_baselines); None se não houver."""
+        return None
+
+    def _repeat(self, level, batch):
+        return np.repeat(np.clip(level, 0, None)[:, None], batch.horizon, axis=1)
+
+
+class LastWeek(Model):
+    cost = 1e-7
+
+    def predict(self, batch):
+        return self._repeat(batch.last(batch.store.values), batch)
+
+    def in_sample(self, store):
+        return store.lag(1)
+
+
+class SeasonalNaive(Model):
+    cost = 1e-7
+
+    def __init__(self, period=4):
+        super().__init__(period=period)
+        self.period = period
+
+    def predict(self, batch):
+        # semana t repete t - period (t - 2·period, ... se o horizonte passar do período)
+        h = np.arange(batch.horizon)
+        back = batch.cutoff + 1 + h - self.period * (h // self.period + 1)
+        hist = batch.dense()
+        out = np.full((len(batch), batch.horizon), np.nan)
+        ok = back >= 0
+        out[:, ok] = hist[:, back[ok]]
+        return out
+
+    def in_sample(self, store):
+        return store.lag(self.period)
+
+
+class MovingAverage(Model):
+    cost = 1e-7
+
+    def __init__(self, window=4):
+        super().__init__(window=window)
+        self.window = window
+
+    def predict(self, batch):
+        ma = batch.feature(f"ma{self.window}", lambda s: s.rolling_mean(self.window))
+        return self._repeat(batch.last(ma), batch)
+
+    def in_sample(self, store):
+        return store.rolling_mean(self.window)
+
+
+class DampedHolt(Model):
+    cost = 5e-6
+
+    def __init__(self, alphas=ALPHAS, betas=BETAS, phi=PHI, min_obs=MIN_TRAIN_WEEKS):
+        super().__init__(alphas=alphas, betas=betas, phi=phi, min_obs=min_obs)
+        self.alphas, self.betas, self.phi, self.min_obs = alphas, betas, phi, min_obs
+
+    def predict(self, batch):
+        out = np.full((len(batch), batch.horizon), np.nan)
+        ok = np.flatnonzero(batch.n_obs >= self.min_obs)
+        if len(ok):
+            first = np.asarray(batch.store.week)[batch.start[ok]].astype(np.int64)
+            out[ok] = holt_batch(batch.dense()[ok].T, first, batch.horizon,
+                                 self.alphas, self.betas, self.phi)
+        return out
+
+
+class Croston(Model):
+    """Demanda intermitente (intermittent.py): `method` = "croston", "sba" ou "tsb"."""
+    cost = 2e-6
+
+    def __init__(self, method="sba", alpha=ALPHA, beta=ALPHA):
+        super().__init__(method=method, alpha=alpha, beta=beta)
+        self.method, self.alpha, self.beta = method, alpha, beta
+
+    def predict(self, batch):
+        level = np.full(len(batch), np.nan)
+        ok = np.flatnonzero(batch.n_obs > 0)
+        if len(ok):
+            first = np.asarray(batch.store.week)[batch.start[ok]].astype(np.int64)
+            level[ok] = croston_batch(batch.dense()[ok].T, first, self.alpha, self.beta)[self.method]
+        return self._repeat(level, batch)
+
+
+class GlobalGBM(Model):
+    """Um HistGradientBoosting para todas as séries do store (global_gbm.py), ajustado com o
+    histórico até o cutoff do lote; previsão direta das H semanas num único predict."""
+    cost = 1e-5
+
+    def __init__(self, n_origins=26, max_rows=2_000_000, proc_dir=None, **params):
+        super().__init__(n_origins=n_origins, max_rows=max_rows, **params)
+        self.n_origins, self.max_rows, self.gbm_params = n_origins, max_rows, params
+        self.proc_dir = proc_dir or resolve_project_dir() / "data" / "processed"
+        self.est, self.fitted_at = None, None
+
+    def _calendar(self, batch):
+        weeks = pd.DatetimeIndex(batch.store.weeks[:batch.cutoff + 1]).append(batch.future)
+        return weeks.isocalendar().week.to_numpy(dtype=np.float32)
+
+    def _static(self, batch):
+        return batch.feature("_gbm_static", lambda s: static_features(self.proc_dir, s.pdv, s.produto))
+
+    def fit(self, batch):
+        X, y = training_set(batch.store, batch.cutoff, batch.horizon, self._static(batch),
+                            self._calendar(batch), self.n_origins, self.max_rows)
+        self.est = fit_gbm(X, y, self.gbm_params) if len(y) else None
+        self.fitted_at = (batch.cutoff, batch.horizon)
+        return self
+
+    def predict(self, batch):
+        out = np.full((len(batch), batch.horizon), np.nan)
+        if not len(batch):
+            return out
+        if self.fitted_at != (batch.cutoff, batch.horizon):
+            self.fit(batch)
+        ok = np.flatnonzero(batch.n_obs > 0)
+        if self.est is not None and len(ok):
+            out[ok] = predict_gbm(self.est, batch.store, batch.series[ok], batch.cutoff, batch.horizon,
+                                  self._static(batch), self._calendar(batch))
+        return out
+
+
+class ProphetModel(Model):
+    """Prophet por série (prophet_engine); `engine` = kwargs de fit_predict_pairs (n_jobs, cache, pool...)."""
+    vectorized = False
+    cost = 0.5
+
+    def __init__(self, engine=None, **params):
+        super().__init__(**params)
+        self.params = {**PROPHET_PARAMS, **params}
+        self.engine = dict(engine or {})
+
+    def warm_start(self, warm_dir):
+        """Liga o warm start: parâmetros por série desta configuração em `warm_dir`."""
+        self.engine["warm"] = ParamStore(warm_dir, self.params) if warm_dir else None
+        return self
+
+    def predict_series(self, series, future_ds, total=None, cutoff=None):
+        """fit_predict_pairs com a configuração do modelo (semana, pdv, produto, yhat, fallback)."""
+        return fit_predict_pairs(series, future_ds, params=self.params, total=total,
+                                 cutoff=cutoff, **self.engine)
+
+    def predict(self, batch):
+        out = np.full((len(batch), batch.horizon), np.nan)
+        if not len(batch):
+            return out
+        fc = self.predict_series(batch.history(), batch.future, total=len(batch), cutoff=batch.cutoff_date)
+        out[:] = np.clip(fc["yhat"].to_numpy(), 0, None).reshape(len(batch), batch.horizon)
+        return out
+
+
+class Hierarchical(Model):
+    """Prevê os nós de um nível agregado (hierarchy.py) com `node_model` e reconcilia de
+    volta aos pares: `method` = "mint" (base `base` + diferença do nó por variância) ou
+    "proporcoes" (fração das vendas das últimas `window` semanas)."""
+    vectorized = False
+    cost = 1e-4   # por par; os ajustes caros são por nó
+
+    def __init__(self, level="pdv_categoria", node_model="prophet", base="ma4", method="mint",
+                 window=8, lam=0.0, proc_dir=None, engine=None):
+        super().__init__(level=level, node_model=node_model, base=base, method=method,
+                         window=window, lam=lam)
+        self.level, self.node_model, self.base, self.method = level, node_model, base, method
+        self.window, self.lam = window, lam
+        self.proc_dir = proc_dir or resolve_project_dir() / "data" / "processed"
+        self.engine = engine if engine is not None else {"progress": False}
+
+    def _nodes(self, batch):
+        key = f"_hier_{self.level}"
+        if key not in batch.shared:
+            store = batch.store
+            nodes, table = node_codes(self.proc_dir, store.pdv, store.produto, self.level)
+            agg = aggregate_store(store, nodes, len(table), tag=-(1 + list(LEVELS).index(self.level)))
+            batch.shared[key] = (nodes, agg, {})
+        return batch.shared[key]
+
+    def predict(self, batch):
+        nodes, agg, agg_shared = self._nodes(batch)
+        if not len(batch):
+            return np.empty((0, batch.horizon))
+        node_batch = SeriesBatch(agg, batch.cutoff, batch.horizon, shared=agg_shared)
+        cls = REGISTRY[self.node_model][0]
+        node_fc = get_model(self.node_model, **({} if cls.vectorized else {"engine": self.engine})).predict(node_batch)
+        node_fc = np.where(np.isnan(node_fc), get_model("ma4").predict(node_batch), node_fc)
+        node_fc = np.nan_to_num(node_fc, nan=0.0)
+
+        # reconciliação sobre todos os membros de cada nó; devolve só as séries do lote
+        full = SeriesBatch(batch.store, batch.cutoff, batch.horizon, shared=batch.shared)
+        recent = full.dense()[:, -self.window:].astype(float)
+        if self.method == "proporcoes":
+            out = top_down(node_fc, nodes, recent.sum(axis=1))
+        else:
+            base = np.nan_to_num(get_model(self.base).predict(full), nan=0.0)
+            d = recent.var(axis=1) + recent.mean(axis=1)   # sobredispersão de contagens
+            out = reconcile_mint(base, node_fc, nodes, d, self.lam)
+        return out[batch.series]
+
+
+register("lastweek", LastWeek)
+register("seasonal4", SeasonalNaive, period=4)
+register("ma4", MovingAverage, window=4)
+register("ma8", MovingAverage, window=8)
+register("holt", DampedHolt)
+register("croston", Croston, method="croston")
+register("sba", Croston, method="sba")
+register("tsb", Croston, method="tsb")
+register("gbm", GlobalGBM)
+register("prophet", ProphetModel)
+for _level in LEVELS:
+    register(f"hier_{_level}", Hierarchical, level=_level)
+
+
+def forecast(model, store, start, horizon, series=None, shared=None):
+    """Previsão (séries × horizon) de `model` para as semanas a partir de `start` (data), num
+    único predict: o cutoff é a última semana do store antes de `start` e as semanas entre
+    os dois são previstas e descartadas. Devolve (lote, semanas previstas, previsões)."""
+    start = pd.Timestamp(start).normalize()
+    weeks = pd.DatetimeIndex(store.weeks)
+    cutoff = int(weeks.searchsorted(start, side="left")) - 1
+    if cutoff < 0:
+        raise ValueError(f"Sem histórico antes de {start.date()}")
+    gap = max(int(round((start - weeks[cutoff]) / pd.Timedelta(weeks=1))) - 1, 0)
+    batch = SeriesBatch(store, cutoff, gap + horizon, series, shared)
+    future = pd.date_range(start, periods=horizon, freq="7D")
+    return batch, future, model.predict(batch)[:, gap:]
+
+
+def to_long(pdv, produto, weeks, preds, col="quantidade"):
+    """Matriz séries × semanas → formato longo (semana, pdv, produto, col), semana a semana,
+    com um único reshape."""
+    preds = np.asarray(preds)
+    n, h = preds.shape
+    return pd.DataFrame({
+        "semana": np.repeat(np.asarray(weeks), n),
+        "pdv": np.tile(np.asarray(pdv), h),
+        "produto": np.tile(np.asarray(produto), h),
+        col: preds.T.ravel(),
+    })
+
+
+def budget_count(model, budget):
+    """Quantas séries cabem em `budget` CPU-segundos pelo custo declarado do modelo."""
+    return int(budget // model.cost) if model.cost > 0 else None
+
+
+def allocate(n_series, tiers):
+    """Divide séries já em ordem de prioridade entre níveis [(modelo, n)], do mais caro ao
+    mais barato: cada nível leva as próximas `n` (None ou negativo = todas as restantes).
+    Devolve [(modelo, índices)]."""
+    out, start = [], 0
+    for model, n in tiers:
+        stop = n_series if n is None or n < 0 else min(n_series, start + n)
+        out.append((model, np.arange(start, stop)))
+        start = stop
+    return out
@@ -0,0 +1,253 @@
+# src/pipeline.py
+# Executor das etapas do pipeline com dependências e memoização por conteúdo. Cada etapa
+# declara script, entradas, saídas e parâmetros (argumentos de linha de comando); a chave da
+# etapa é o hash do código (script + módulos de src/ que ele importa), dos parâmetros e do
+# conteúdo das entradas. Se a chave é a mesma da última execução bem-sucedida e as saídas
+# estão intactas, a etapa é pulada. As dependências saem das entradas/saídas, e etapas
+# independentes (ingestões process_*, baselines × Prophet) rodam em paralelo.
+# O hash de cada arquivo fica guardado junto com (tamanho, mtime), então uma reexecução sem
+# mudanças só faz stat nos arquivos. Estado e logs em data/interim/pipeline/. As etapas rodam
+# por cli.py, então cada uma deixa seu trace em reports/_trace_<etapa>.json (instrument.py).
+#
+#   python src/pipeline.py                       # tudo o que estiver desatualizado
+#   python src/pipeline.py make_submission -j 4  # só o necessário para esta etapa
+#   python src/pipeline.py -p forecast_ensemble="--top_n 50 --holt_n -1" --dry_run
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from common import resolve_project_dir
+
+SRC_DIR = Path(__file__).resolve().parent
+P = "data/processed/"
+
+
+class Stage:
+    """`uses` = recursos compartilhados gravados pela etapa (ex.: o manifesto incremental):
+    duas etapas com o mesmo recurso não rodam ao mesmo tempo."""
+
+    def __init__(self, name, inputs, outputs, params=(), script=None, uses=()):
+        self.name, self.inputs, self.outputs = name, list(inputs), list(outputs)
+        self.params = list(params)
+        self.script = script or f"{name}.py"
+        self.uses = set(uses)
+
+
+STAGES = [
+    Stage("process_transacoes", ["data/raw"], [P + "transacoes_2022.parquet"], uses=["manifest"]),
+    Stage("process_pdvs", ["data/raw"], [P + "pdvs.parquet"]),
+    Stage("process_produtos", ["data/raw"], [P + "produtos.parquet"]),
+    Stage("prepare_transacoes_diarias", [P + "transacoes_2022.parquet"],
+          [P + "transacoes_2022_diarias.parquet"]),
+    Stage("prepare_data", [P + "transacoes_2022_diarias.parquet"], [P + "train_weekly.parquet"], uses=["manifest"]),
+    Stage("make_splits", [P + "train_weekly.parquet"], [P + "train_weekly_splits.parquet"],
+          uses=["manifest"]),
+    Stage("train_baselines", [P + "train_weekly_splits.parquet"],
+          [P + "baseline_preds.parquet", "reports/_baseline_metrics.csv"]),
+    Stage("evaluate_baselines", [P + "transacoes_2022_diarias.parquet"],
+          ["reports/baseline_eval_overall.csv", "reports/baseline_eval_summary.csv"]),
+    Stage("train_prophet_topn", [P + "train_weekly_splits.parquet"],
+          [P + "prophet_topN_val4_preds.parquet", "reports/_prophet_val4_metrics.csv"]),
+    Stage("forecast_ensemble", [P + "train_weekly_splits.parquet", P + "pdvs.parquet", P + "produtos.parquet"],
+          [P + "forecast_ensemble_jan2023.parquet"], uses=["manifest"]),
+    Stage("make_submission", [P + "forecast_ensemble_jan2023.parquet"],
+          ["reports/submission_ensemble_jan2023.csv", "reports/_submission_checks.md"]),
+]
+
+
+class FileHashes:
+    """Hash de conteúdo por arquivo, reaproveitado enquanto (tamanho, mtime) não mudam."""
+
+    def __init__(self, cache):
+        self.cache = cache          # caminho → [tamanho, mtime_ns, sha1]
+        self.lock = threading.Lock()
+
+    def file(self, path):
+        st = path.stat()
+        key = str(path)
+        with self.lock:
+            hit = self.cache.get(key)
+        if hit and hit[0] == st.st_size and hit[1] == st.st_mtime_ns:
+            return hit[2]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        with self.lock:
+            self.cache[key] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return h.hexdigest()
+
+    def path(self, path):
+        """Hash de um arquivo ou diretório (caminhos relativos + conteúdo); None se não existe."""
+        if not path.exists():
+            return None
+        if path.is_file():
+            return self.file(path)
+        h = hashlib.sha1()
+        for f in sorted(p for p in path.rglob("*") if p.is_file()):
+            h.update(f"{f.relative_to(path)}:{self.file(f)};".encode())
+        return h.hexdigest()
+
+
+def local_imports(script, seen=None):
+    """Módulos de src/ importados pelo script, transitivamente (inclui o próprio)."""
+    seen = set() if seen is None else seen
+    path = SRC_DIR / script
+    if path.name in seen or not path.exists():
+        return seen
+    seen.add(path.name)
+    for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+        names = ([a.name for a in node.names] if isinstance(node, ast.Import)
+                 else [node.module] if isinstance(node, ast.ImportFrom) and node.module else [])
+        for n in names:
+            local_imports(f"{n.split('.')[0]}.py", seen)
+    return seen
+
+
+def code_hash(script):
+    h = hashlib.sha1()
+    for name in sorted(local_imports(script)):
+        h.update(name.encode() + b":" + (SRC_DIR / name).read_bytes())
+    return h.hexdigest()
+
+
+def stage_key(stage, root, hashes):
+    inputs = {i: hashes.path(root / i) for i in stage.inputs}
+    payload = {"code": code_hash(stage.script), "params": stage.params, "inputs": inputs}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def plan(stages, targets=None):
+    """Dependências (etapa → etapas que produzem suas entradas) e as etapas necessárias para `targets`."""
+    producer = {o: s.name for s in stages for o in s.outputs}
+    deps = {s.name: sorted({producer[i] for i in s.inputs if i in producer} - {s.name}) for s in stages}
+    if not targets:
+        return deps, [s.name for s in stages]
+    need, todo = set(), list(targets)
+    while todo:
+        n = todo.pop()
+        if n not in deps:
+            raise KeyError(f"Etapa desconhecida: {n} (disponíveis: {', '.join(deps)})")
+        if n not in need:
+            need.add(n)
+            todo.extend(deps[n])
+    return deps, [s.name for s in stages if s.name in need]
+
+
+def run_stage(stage, root, log_dir, profile=False):
+    cmd = [sys.executable, str(SRC_DIR / "cli.py"), Path(stage.script).stem] + stage.params
+    env = {**os.environ, "PROJECT_DIR": str(root), **({"TRACE_PROFILE": "1"} if profile else {})}
+    log = log_dir / f"{stage.name}.log"
+    t0 = time.perf_counter()
+    with open(log, "w", encoding="utf-8") as f:
+        rc = subprocess.run(cmd, cwd=root, env=env, stdout=f, stderr=subprocess.STDOUT).returncode
+    missing = [o for o in stage.outputs if not (root / o).exists()]
+    return rc, missing, time.perf_counter() - t0, log
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", help="Etapas alvo (com as dependências); vazio = todas")
+    parser.add_argument("-j", "--jobs", type=int, default=2, help="Etapas rodando ao mesmo tempo")
+    parser.add_argument("-p", "--params", action="append", default=[], metavar='ETAPA="ARGS"',
+                        help="Argumentos extras de uma etapa (entram no hash)")
+    parser.add_argument("--force", action="store_true", help="Roda as etapas mesmo em dia")
+    parser.add_argument("--dry_run", action="store_true", help="Só mostra o que rodaria")
+    parser.add_argument("--profile", action="store_true",
+                        help="Grava também o cProfile de cada etapa (reports/_profile_<etapa>.prof)")
+    args = parser.parse_known_args()[0]
+
+    root = resolve_project_dir()
+    state_dir = root / "data" / "interim" / "pipeline"
+    state_path = state_dir / "state.json"
+    state = json.loads(state_path.read_text(encoding="utf-8")) if state_path.exists() else {}
+    state.setdefault("stages", {})
+    hashes = FileHashes(state.setdefault("files", {}))
+
+    stages = {s.name: s for s in STAGES}
+    for p in args.params:
+        name, _, extra = p.partition("=")
+        if name not in stages:
+            raise KeyError(f"Etapa desconhecida: {name}")
+        stages[name].params = stages[name].params + shlex.split(extra)
+    deps, order = plan(STAGES, args.targets)
+
+    t_start = time.perf_counter()
+    lock = threading.Lock()
+    done, failed, stale, ran = set(), set(), set(), []
+    pending = list(order)
+
+    def up_to_date(stage, key):
+        rec = state["stages"].get(stage.name)
+        return (not args.force and rec is not None and rec["key"] == key
+                and all(rec["outputs"].get(o) == hashes.path(root / o) for o in stage.outputs))
+
+    def execute(name):
+        stage = stages[name]
+        key = stage_key(stage, root, hashes)
+        if up_to_date(stage, key) and not (args.dry_run and stale & set(deps[name])):
+            return name, "em dia", 0.0
+        if args.dry_run:
+            return name, "rodaria", 0.0
+        print(f"→ {name} {' '.join(stage.params)}".rstrip(), flush=True)
+        rc, missing, secs, log = run_stage(stage, root, state_dir, args.profile)
+        if rc != 0 or missing:
+            tail = log.read_text(encoding="utf-8", errors="replace").splitlines()[-15:]
+            print(f"✗ {name}: código {rc}, saídas ausentes {missing} (log: {log})\n  " + "\n  ".join(tail))
+            return name, "falhou", secs
+        outputs = {o: hashes.path(root / o) for o in stage.outputs}
+        with lock:
+            state["stages"][name] = {"key": key, "outputs": outputs, "seconds": round(secs, 2),
+                                     "params": stage.params}
+        return name, "ok", secs
+
+    state_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max(1, args.jobs)) as pool:
+        running = {}
+        while pending or running:
+            for name in [n for n in pending if all(d in done for d in deps[n] if d in order)]:
+                busy = set().union(*(stages[r].uses for r in running.values()))
+                if stages[name].uses & busy:
+                    continue
+                pending.remove(name)
+                running[pool.submit(execute, name)] = name
+            for name in [n for n in pending if any(d in failed for d in deps[n])]:
+                pending.remove(name)
+                failed.add(name)
+                ran.append((name, "não rodou (dependência falhou)", 0.0))
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name, status, secs = fut.result()
+                del running[fut]
+                (failed if status == "falhou" else done).add(name)
+                if status == "rodaria":   # no dry run, as dependentes também rodariam
+                    stale.add(name)
+                ran.append((name, status, secs))
+                if status in ("ok", "falhou"):
+                    print(f"{'✓' if status == 'ok' else '✗'} {name} ({secs:.1f}s)", flush=True)
+
+    if not args.dry_run:
+        tmp = state_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, state_path)
+
+    for name, status, secs in sorted(ran, key=lambda r: order.index(r[0])):
+        print(f"  {name:<28} {status}" + (f" ({secs:.1f}s)" if secs else ""))
+    print(f"Tempo total: {time.perf_counter() - t_start:.1f}s")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
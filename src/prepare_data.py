@@ -1,27 +1,53 @@
+import argparse
 import pandas as pd
 from common import resolve_project_dir
+from datasets import DAILY_PARTITIONS, read_dataset, with_iso_week, write_dataset
+from incremental import ALL, add_dirty, clear_dirty, dirty_weeks, manifest
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--incremental", action="store_true",
+                    help="Recalcula só as semanas marcadas em _manifest.json pela ingestão")
+args = parser.parse_known_args()[0]
 
 PROJECT_DIR = resolve_project_dir()
-src = PROJECT_DIR / "data" / "processed" / "df_all.long.parquet"
-out = PROJECT_DIR / "data" / "processed" / "train_weekly.parquet"
+proc_dir = PROJECT_DIR / "data" / "processed"
+src = proc_dir / "transacoes_2022_diarias.parquet"   # diário mantido pela ingestão (chaves já em int32)
+out = proc_dir / "train_weekly.parquet"
+
+with manifest(proc_dir) as man:
+    weeks = dirty_weeks(man, "weekly") if args.incremental and out.is_dir() else ALL
+    if weeks == []:
+        print("Nenhuma semana pendente;", out)
+        raise SystemExit(0)
 
-df = pd.read_parquet(src, columns=["ds","id","y"])
-df["ds"] = pd.to_datetime(df["ds"], errors="coerce")
-df["y"]  = pd.to_numeric(df["y"], errors="coerce").fillna(0)
-df = df.dropna(subset=["ds","id"])
+    filters = None
+    if weeks != ALL:
+        # só as partições ISO que cobrem os dias das semanas pendentes, e só o intervalo delas
+        days = pd.DatetimeIndex([w + pd.Timedelta(days=i) for w in weeks for i in range(7)])
+        iso = days.isocalendar()
+        filters = [("ano_iso", "in", sorted(set(iso["year"].tolist()))),
+                   ("semana_iso", "in", sorted(set(iso["week"].tolist()))),
+                   ("data", ">=", min(weeks)), ("data", "<", max(weeks) + pd.Timedelta(days=7))]
 
-spl = df["id"].astype(str).str.split("|", n=1, expand=True)
-df["pdv"] = spl[0]
-df["produto"] = spl[1]
+    df = read_dataset(src, columns=["data","pdv","produto","quantidade"], filters=filters)
+    df = df.rename(columns={"data": "ds", "quantidade": "y"}).dropna(subset=["ds"])
+    df["y"] = pd.to_numeric(df["y"], errors="coerce").fillna(0)
 
-df = df[df["ds"].dt.year == 2022]
-sem = df["ds"].dt.to_period("W-MON")
-df["semana"] = sem.dt.start_time.dt.normalize()
+    sem = df["ds"].dt.to_period("W-MON")
+    df["semana"] = sem.dt.start_time.dt.normalize()
+    if weeks != ALL:
+        df = df[df["semana"].isin(weeks)]
 
-wk = (df.groupby(["semana","pdv","produto"], as_index=False, sort=False)["y"]
-        .sum(min_count=1)
-        .rename(columns={"y":"quantidade"}))
+    wk = (df.groupby(["semana","pdv","produto"], as_index=False, sort=False)["y"]
+            .sum(min_count=1)
+            .rename(columns={"y":"quantidade"}))
 
-wk = wk.sort_values(["semana","pdv","produto"]).reset_index(drop=True)
-wk.to_parquet(out, index=False)
+    # uma partição por semana (ano/semana ISO do início da semana): a atualização
+    # incremental regrava só as semanas pendentes
+    write_dataset(with_iso_week(wk, "semana"), out, DAILY_PARTITIONS, derived=DAILY_PARTITIONS,
+                  sort_by=["semana","pdv","produto"],
+                  existing="replace" if weeks == ALL else "partitions")
+    clear_dirty(man, "weekly")
+    add_dirty(man, "splits", weeks)
+    print("semanas recalculadas:", "todas" if weeks == ALL else len(weeks))
 print(out)
@@ -1,21 +1,21 @@
 # src/prepare_transacoes_diarias.py
 from pathlib import Path
 import pandas as pd
+from datasets import read_dataset, write_daily
+from key_encoding import encode_keys
 
 base_dir = Path(__file__).resolve().parents[1]
 data_proc = base_dir / "data" / "processed"
 in_path  = data_proc / "transacoes_2022.parquet"
 out_path = data_proc / "transacoes_2022_diarias.parquet"
 
-df = pd.read_parquet(in_path)
+df = encode_keys(read_dataset(in_path), data_proc)
 
 n_before = len(df)
 df = (df
       .groupby(["data","pdv","produto"], as_index=False, sort=False)["quantidade"]
       .sum())
-# tipos
-df["pdv"] = df["pdv"].astype("string")
-df["produto"] = df["produto"].astype("string")
+# tipos (pdv/produto já são códigos int32)
 df["data"] = pd.to_datetime(df["data"]).dt.normalize()
 df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").astype("Float64")
 
@@ -29,6 +29,6 @@ print("pdvs únicos :", df["pdv"].nunique())
 print("skus únicos :", df["produto"].nunique())
 
 out_path.parent.mkdir(parents=True, exist_ok=True)
-df.to_parquet(out_path, index=False)
+write_daily(df, out_path)  # dataset particionado por ano_iso/semana_iso
 print("salvo em    :", out_path)
 print(df.head(5).to_string(index=False))
@@ -3,6 +3,8 @@ from pathlib import Path
 import sys
 import pyarrow.parquet as pq
 import pandas as pd
+from datasets import iter_row_groups, write_file
+from key_encoding import encode_keys
 
 def main():
     base_dir = Path(__file__).resolve().parents[1]
@@ -49,11 +51,8 @@ def main():
     print("Colunas selecionadas para leitura:", read_cols)
 
     # Leitura por row groups
-    dfs = []
     print("Row groups:", pfile.num_row_groups)
-    for rg in range(pfile.num_row_groups):
-        tbl = pfile.read_row_group(rg, columns=read_cols)
-        dfs.append(tbl.to_pandas())
+    dfs = list(iter_row_groups(pfile, columns=read_cols, name=pdvs_path.name))
 
     df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=read_cols)
 
@@ -64,10 +63,11 @@ def main():
             df[c] = df[c].astype("string")
 
     df = df.drop_duplicates(subset=["pdv"]).reset_index(drop=True)
+    df = encode_keys(df, data_proc, cols=["pdv"])
 
     # Persistência
     data_proc.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(out_path, index=False)
+    write_file(df, out_path)
 
     # Logs essenciais
     print("Salvo em:", out_path)
@@ -3,6 +3,8 @@ from pathlib import Path
 import sys
 import pyarrow.parquet as pq
 import pandas as pd
+from datasets import iter_row_groups, write_file
+from key_encoding import encode_keys
 
 def main():
     base_dir = Path(__file__).resolve().parents[1]
@@ -61,11 +63,8 @@ def main():
     print("Colunas selecionadas para leitura:", read_cols)
 
     pfile = pq.ParquetFile(products_path)
-    dfs = []
     print("Row groups:", pfile.num_row_groups)
-    for rg in range(pfile.num_row_groups):
-        tbl = pfile.read_row_group(rg, columns=read_cols)
-        dfs.append(tbl.to_pandas())
+    dfs = list(iter_row_groups(pfile, columns=read_cols, name=products_path.name))
 
     df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=read_cols)
 
@@ -79,9 +78,10 @@ def main():
         df["categoria"] = df["categoria"].astype("string")
 
     df = df.drop_duplicates(subset=["produto"]).reset_index(drop=True)
+    df = encode_keys(df, data_proc, cols=["produto"])
 
     data_proc.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(out_path, index=False)
+    write_file(df, out_path)
 
     print("Salvo em:", out_path)
     print("shape :", df.shape)
@@ -1,10 +1,170 @@
 # src/process_transacoes.py
 from pathlib import Path
+import argparse
 import sys
+import numpy as np
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import pandas as pd
+from datasets import (DAILY_PARTITIONS, iter_row_groups, read_dataset, read_table, with_iso_week,
+                      write_daily, write_file)
+from incremental import ALL, add_dirty, manifest, mark_ingested, pending_row_groups, week_start
+from key_encoding import KeyEncoder, encode_keys
+
+DAILY_KEYS = ["data", "pdv", "produto"]
+
+def normalize_chunk(df, date_col):
+    """Renomeia, tipa e limpa um lote bruto de transações (sem codificar as chaves)."""
+    df = df.rename(columns={
+        "internal_store_id":   "pdv",
+        "internal_product_id": "produto",
+        date_col:              "data",
+        "quantity":            "quantidade",
+    })
+
+    # Tipos
+    df["pdv"]      = df["pdv"].astype("string").str.strip()
+    df["produto"]  = df["produto"].astype("string").str.strip()
+    df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").astype("Float64")
+
+    # Datas: para análises semanais, manter como data normalizada (meia-noite)
+    df["data"] = pd.to_datetime(df["data"], errors="coerce")
+    df["data"] = df["data"].dt.normalize()
+
+    # Remover linhas inválidas (campos essenciais nulos)
+    return df.dropna(subset=["pdv", "produto", "data", "quantidade"]).reset_index(drop=True)
+
+def aggregate_daily(sources, data_proc, merge_rows):
+    """Row group -> normaliza -> codifica -> soma diária parcial, para cada
+    (nome, pfile, row_groups, read_cols, date_col) de `sources` (row_groups None = todos). Devolve (diário, linhas brutas)."""
+    acc = DailyAccumulator(merge_rows)
+    n_raw = 0
+    data_proc.mkdir(parents=True, exist_ok=True)
+    with KeyEncoder(data_proc) as enc:
+        for name, pfile, row_groups, read_cols, date_col in sources:
+            for df in iter_row_groups(pfile, row_groups, read_cols, name):
+                n_raw += len(df)
+                acc.add(enc.encode(normalize_chunk(df, date_col)))
+                del df
+    df = acc.result()
+    df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").astype("Float64")
+    return df, n_raw
+
+def stream_daily(sources, data_proc, merge_rows):
+    """Ingestão em uma passada de todos os row groups de `sources` (nome, pfile, read_cols, date_col)."""
+    out_path = data_proc / "transacoes_2022_diarias.parquet"
+    print("Row groups:", sum(p.num_row_groups for _, p, _, _ in sources), "| modo streaming")
+    df, n_raw = aggregate_daily([(name, p, None, rc, dc) for name, p, rc, dc in sources],
+                                data_proc, merge_rows)
+
+    write_daily(df, out_path)  # dataset particionado por ano_iso/semana_iso
+    with manifest(data_proc) as man:
+        man["raw"] = {}
+        for name, p, _, _ in sources:
+            mark_ingested(man, name, p)
+        man["daily_total"] = float(df["quantidade"].sum())
+        add_dirty(man, "weekly", ALL)
+    print("Salvo em:", out_path)
+    print("linhas brutas :", n_raw)
+    print("linhas diárias:", len(df))
+    print("datas       :", df["data"].min().date(), "→", df["data"].max().date())
+    print("pdvs únicos :", df["pdv"].nunique())
+    print("skus únicos :", df["produto"].nunique())
+    print(df.head(5).to_string(index=False))
+
+def incremental_daily(sources, data_proc, merge_rows):
+    """Ingere só os row groups acima da marca d'água e regrava as semanas ISO que eles tocam.
+
+    Sem marca d'água válida (primeira execução, arquivo bruto reescrito, diário em formato
+    antigo ou refeito por outra ingestão) cai na ingestão completa de stream_daily. O total de
+    quantidade do diário é conferido com o registrado no manifesto antes de somar lotes novos
+    (inclusive numa execução sem nada novo): se divergir, o diário não corresponde à marca
+    d'água e também cai na ingestão completa.
+    """
+    out_path = data_proc / "transacoes_2022_diarias.parquet"
+    with manifest(data_proc) as man:
+        pending = [(name, p, pending_row_groups(man, name, p), rc, dc) for name, p, rc, dc in sources]
+        expected = man.get("daily_total")
+    if not out_path.is_dir() or any(rgs is None for _, _, rgs, _, _ in pending):
+        print("Marca d'água ausente ou inválida: ingestão completa")
+        return stream_daily(sources, data_proc, merge_rows)
+    total = daily_total(out_path)
+    if expected is None or not np.isclose(total, expected):
+        print(f"Total do diário ({total:g}) difere do registrado ({expected}): ingestão completa")
+        return stream_daily(sources, data_proc, merge_rows)
+
+    n_rg = sum(len(rgs) for _, _, rgs, _, _ in pending)
+    print("Row groups novos:", n_rg, "| modo incremental")
+    if n_rg == 0:
+        print("Nada novo a ingerir.")
+        return
+
+    new, n_raw = aggregate_daily([(name, p, rgs, rc, dc) for name, p, rgs, rc, dc in pending if rgs],
+                                 data_proc, merge_rows)
+    weeks = with_iso_week(new[["data"]].drop_duplicates(), "data")
+
+    # partições afetadas: diário existente + lotes novos, somados de novo por (data, pdv, produto)
+    old = read_dataset(out_path, filters=[("ano_iso", "in", sorted(weeks["ano_iso"].unique().tolist())),
+                                          ("semana_iso", "in", sorted(weeks["semana_iso"].unique().tolist()))])
+    df = pd.concat([old, new], ignore_index=True)
+    df = df.groupby(DAILY_KEYS, as_index=False, sort=False)["quantidade"].sum()
+    df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").astype("Float64")
+    write_daily(df, out_path, existing="partitions")
+
+    with manifest(data_proc) as man:
+        for name, p, _, _, _ in pending:
+            mark_ingested(man, name, p)
+        man["daily_total"] = total + float(new["quantidade"].sum())
+        add_dirty(man, "weekly", week_start(weeks["data"]))
+    print("Salvo em:", out_path)
+    print("linhas brutas novas :", n_raw)
+    print("semanas ISO afetadas:", len(weeks[DAILY_PARTITIONS].drop_duplicates()), "| linhas regravadas:", len(df))
+    print("datas novas :", new["data"].min().date(), "→", new["data"].max().date())
+
+def daily_total(path):
+    """Soma de quantidade do diário (só a coluna é lida)."""
+    return float(pc.sum(read_table(path, columns=["quantidade"])["quantidade"]).as_py() or 0.0)
+
+class DailyAccumulator:
+    """Soma parcial por (data, pdv, produto) lote a lote.
+
+    Os parciais são fundidos (concat + groupby) quando passam de `merge_rows` linhas
+    ou do dobro da última fusão, então a memória acompanha o número de chaves
+    distintas e não o número de linhas brutas.
+    """
+    def __init__(self, merge_rows=5_000_000):
+        self.merge_rows = merge_rows
+        self.parts, self.n, self.n_merged = [], 0, 0
+
+    def add(self, df):
+        part = df.groupby(DAILY_KEYS, as_index=False, sort=False)["quantidade"].sum()
+        self.parts.append(part)
+        self.n += len(part)
+        if self.n > max(self.merge_rows, 2 * self.n_merged):
+            self._merge()
+
+    def _merge(self):
+        if len(self.parts) > 1:
+            df = pd.concat(self.parts, ignore_index=True)
+            df = df.groupby(DAILY_KEYS, as_index=False, sort=False)["quantidade"].sum()
+            self.parts = [df]
+        self.n = self.n_merged = sum(len(p) for p in self.parts)
+
+    def result(self):
+        self._merge()
+        return self.parts[0] if self.parts else pd.DataFrame(columns=DAILY_KEYS + ["quantidade"])
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stream", action="store_true",
+                        help="Agrega cada row group a (data, pdv, produto) e grava direto o diário")
+    parser.add_argument("--merge_rows", type=int, default=5_000_000,
+                        help="Linhas parciais acumuladas antes de fundir (modo --stream)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Ingere só os row groups novos (marca d'água em _manifest.json) e "
+                             "regrava apenas as semanas afetadas do diário")
+    args = parser.parse_known_args()[0]
+
     base_dir = Path(__file__).resolve().parents[1]
     data_raw  = base_dir / "data" / "raw"
     data_proc = base_dir / "data" / "processed"
@@ -25,8 +185,13 @@ def main():
     def lower_cols(pfile: pq.ParquetFile) -> set:
         return {f.name.lower() for f in pfile.schema_arrow}
 
+    def trx_read_cols(cols: set):
+        # Determinar coluna de data preferencial; colunas mínimas para leitura
+        date_col = "transaction_date" if "transaction_date" in cols else "reference_date"
+        return ["internal_store_id", "internal_product_id", date_col, "quantity"], date_col
+
     schemas = {}
-    trx_path = None
+    trx_files = []
     for f in raw_files:
         pfile = pq.ParquetFile(f)
         cols = lower_cols(pfile)
@@ -34,56 +199,47 @@ def main():
         has_req = MUST_HAVE_ALL.issubset(cols)
         has_date = len(MUST_HAVE_ANY_DATE & cols) > 0
         if has_req and has_date:
-            trx_path = f
-            break
+            trx_files.append(f)
 
-    if trx_path is None:
+    if not trx_files:
         details = "\n".join([f"- {k}: {sorted(list(v))}" for k, v in schemas.items()])
         raise RuntimeError("Arquivo de transações não identificado automaticamente. Schemas detectados:\n" + details)
 
-    print("Arquivo de transações identificado:", trx_path.name)
+    # --stream/--incremental: todos os arquivos de transações (cargas semanais chegam como arquivos novos)
+    if args.stream or args.incremental:
+        print("Arquivos de transações:", [f.name for f in trx_files])
+        sources = [(f.name, pq.ParquetFile(f), *trx_read_cols(schemas[f.name])) for f in trx_files]
+        if args.incremental:
+            return incremental_daily(sources, data_proc, args.merge_rows)
+        return stream_daily(sources, data_proc, args.merge_rows)
 
-    # Determinar coluna de data preferencial
-    trx_cols = schemas[trx_path.name]
-    date_col = "transaction_date" if "transaction_date" in trx_cols else "reference_date"
+    trx_path = trx_files[0]
+    print("Arquivo de transações identificado:", trx_path.name)
 
-    # Colunas mínimas para leitura
-    read_cols = ["internal_store_id", "internal_product_id", date_col, "quantity"]
+    read_cols, date_col = trx_read_cols(schemas[trx_path.name])
     print("Colunas selecionadas para leitura:", read_cols)
 
     # Leitura por row groups (baixo uso de memória)
     pfile = pq.ParquetFile(trx_path)
-    dfs = []
+
     print("Row groups:", pfile.num_row_groups)
-    for rg in range(pfile.num_row_groups):
-        tbl = pfile.read_row_group(rg, columns=read_cols)
-        dfs.append(tbl.to_pandas())
+    dfs = list(iter_row_groups(pfile, columns=read_cols, name=trx_path.name))
 
     df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=read_cols)
 
-    # Normalização de nomes e tipos
-    df = df.rename(columns={
-        "internal_store_id":   "pdv",
-        "internal_product_id": "produto",
-        date_col:              "data",
-        "quantity":            "quantidade",
-    })
-
-    # Tipos
-    df["pdv"]      = df["pdv"].astype("string").str.strip()
-    df["produto"]  = df["produto"].astype("string").str.strip()
-    df["quantidade"] = pd.to_numeric(df["quantidade"], errors="coerce").astype("Float64")
-
-    # Datas: para análises semanais, manter como data normalizada (meia-noite)
-    df["data"] = pd.to_datetime(df["data"], errors="coerce")
-    df["data"] = df["data"].dt.normalize()
+    # Normalização de nomes e tipos; remove linhas inválidas
+    df = normalize_chunk(df, date_col)
 
-    # Remover linhas inválidas (campos essenciais nulos)
-    df = df.dropna(subset=["pdv", "produto", "data", "quantidade"]).reset_index(drop=True)
+    # Chaves como códigos int32 estáveis (dicionários em data/processed/_dict_*.parquet)
+    df = encode_keys(df, data_proc)
 
     # Persistência
     data_proc.mkdir(parents=True, exist_ok=True)
-    df.to_parquet(out_path, index=False)
+    write_file(df, out_path)
+    with manifest(data_proc) as man:
+        man["raw"] = {}  # o diário será refeito por prepare_transacoes_diarias: invalida a marca d'água
+        man.pop("daily_total", None)
+        add_dirty(man, "weekly", ALL)
 
     # Logs essenciais
     print("Salvo em:", out_path)
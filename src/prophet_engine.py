@@ -0,0 +1,225 @@
+# src/prophet_engine.py
+# Motor compartilhado de ajuste/previsão Prophet por série (pdv, produto).
+import logging
+import multiprocessing as mp
+import os
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from fit_cache import FitCache, series_key
+from instrument import record_fits, span
+
+PROPHET_PARAMS = dict(
+    growth="linear",
+    weekly_seasonality=True,
+    yearly_seasonality=False,
+    daily_seasonality=False,
+    seasonality_mode="additive",
+    changepoint_prior_scale=0.5,
+    interval_width=0.8,
+)
+MIN_TRAIN_WEEKS = 8
+OUT_COLS = ["semana", "pdv", "produto", "yhat", "fallback", "fit_seconds", "start"]
+
+
+def add_engine_args(parser):
+    parser.add_argument("--n_jobs", type=int, default=1,
+                        help="Processos para os ajustes Prophet (<=0 usa todos os núcleos)")
+    parser.add_argument("--chunksize", type=int, default=8,
+                        help="Séries enviadas por vez a cada processo")
+    parser.add_argument("--maxtasksperchild", type=int, default=200,
+                        help="Séries por processo antes de reciclá-lo (limita memória)")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Diretório do cache de ajustes (ver fit_cache.py); vazio desativa")
+    parser.add_argument("--cache_max_mb", type=float, default=1024,
+                        help="Tamanho máximo do cache de ajustes (LRU)")
+    parser.add_argument("--warm_dir", type=str, default=None,
+                        help="Parâmetros ajustados por série (ver warm_start.py): parte deles no "
+                             "próximo ajuste e grava os novos; vazio desativa")
+    return parser
+
+
+def cache_from_args(args, default_dir=None):
+    cache_dir = args.cache_dir or default_dir
+    if not cache_dir:
+        return None
+    return FitCache(cache_dir, max_bytes=int(args.cache_max_mb * 1024 * 1024))
+
+
+_LOGS_QUIET = False
+
+
+def _quiet_logs():
+    # o logger do cmdstanpy é configurado (nível DEBUG) na primeira chamada; importa o
+    # cmdstanpy, então só roda no primeiro ajuste de cada processo
+    global _LOGS_QUIET
+    if _LOGS_QUIET:
+        return
+    from cmdstanpy.utils import get_logger
+    get_logger().setLevel(logging.WARNING)
+    logging.getLogger("prophet").setLevel(logging.WARNING)
+    _LOGS_QUIET = True
+
+
+def _cpu_seconds():
+    # inclui os filhos já encerrados: o otimizador do cmdstan roda num executável à parte
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _fit_one(task):
+    # task = (pdv, produto, ds, y, future_ds, params, init | None)
+    # retorno = (pdv, produto, yhat | None, erro | None, parâmetros ajustados, CPU-s do ajuste, início)
+    # início: "cold", "warm" (partiu de `init`) ou "warm_falhou" (warm não convergiu → cold)
+    pdv, produto, ds, y, future_ds, params, init = task
+    if len(ds) < MIN_TRAIN_WEEKS:
+        return pdv, produto, None, "serie_curta", None, 0.0, "cold"
+    t0 = _cpu_seconds()
+    start = "cold"
+    try:
+        from prophet import Prophet
+        _quiet_logs()
+        hist = pd.DataFrame({"ds": ds, "y": y})
+        m = None
+        if init is not None:
+            try:
+                m = Prophet(**params).fit(hist, init=init)
+                if not all(np.isfinite(np.asarray(v)).all() for v in m.params.values()):
+                    raise RuntimeError("parâmetros não finitos")
+                start = "warm"
+            except Exception:
+                m, start = None, "warm_falhou"
+        if m is None:
+            m = Prophet(**params).fit(hist)
+        fcst = m.predict(pd.DataFrame({"ds": future_ds}))
+        fitted = {k: np.asarray(v) for k, v in m.params.items()}
+        return (pdv, produto, fcst["yhat"].to_numpy(dtype=float), None, fitted,
+                _cpu_seconds() - t0, start)
+    except Exception as e:
+        return pdv, produto, None, f"{type(e).__name__}: {e}", None, _cpu_seconds() - t0, start
+
+
+def _results_to_frame(results, future_ds):
+    h = len(future_ds)
+    n = len(results)
+    yhat = np.full((n, h), np.nan)
+    fallback = np.zeros(n, dtype=bool)
+    for i, (_, _, pred, err, _, _, _) in enumerate(results):
+        if pred is None:
+            fallback[i] = True
+        else:
+            yhat[i] = pred
+    return pd.DataFrame({
+        "semana": np.tile(np.asarray(future_ds, dtype="datetime64[ns]"), n),
+        "pdv": np.repeat(np.array([r[0] for r in results]), h),
+        "produto": np.repeat(np.array([r[1] for r in results]), h),
+        "yhat": yhat.ravel(),
+        "fallback": np.repeat(fallback, h),
+        "fit_seconds": np.repeat(np.array([r[5] for r in results], dtype=float), h),
+        "start": np.repeat(np.array([r[6] for r in results], dtype=object), h),
+    }, columns=OUT_COLS)
+
+
+def make_pool(n_jobs, maxtasksperchild=200):
+    """Pool reutilizável entre chamadas de fit_predict_pairs (None se n_jobs == 1)."""
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = mp.cpu_count()
+    if n_jobs == 1:
+        return None
+    return mp.get_context().Pool(n_jobs, maxtasksperchild=maxtasksperchild)
+
+
+def fit_predict_pairs(series, future_ds, params=None, n_jobs=1, chunksize=8,
+                      maxtasksperchild=200, total=None, progress=True,
+                      cache=None, cutoff=None, pool=None, warm=None):
+    """Ajusta um Prophet por série e prevê `future_ds`.
+
+    `series` é um iterável de (pdv, produto, ds, y) já cortados no cutoff.
+    O resultado mantém a ordem de entrada (semana, pdv, produto, yhat, fallback,
+    fit_seconds = CPU-s do ajuste no processo, 0 para acertos de cache); séries
+    curtas ou com erro no ajuste saem com yhat NaN e fallback=True.
+    Com `cache` (FitCache), séries já ajustadas com os mesmos dados e
+    hiperparâmetros são lidas do disco em vez de reajustadas. Um `pool` de
+    make_pool() pode ser compartilhado entre chamadas (não é encerrado aqui).
+    Com `warm` (warm_start.ParamStore), cada série parte dos parâmetros do último
+    ajuste guardado (coluna start = warm/warm_falhou/cold) e os novos são gravados.
+    """
+    with span("prophet", "fit") as sp:
+        out = _fit_predict_pairs(series, future_ds, params, n_jobs, chunksize, maxtasksperchild,
+                                 total, progress, cache, cutoff, pool, warm)
+        sp.set(rows=len(out) // max(len(future_ds), 1))
+    return out
+
+
+def _fit_predict_pairs(series, future_ds, params, n_jobs, chunksize, maxtasksperchild, total,
+                       progress, cache, cutoff, pool, warm):
+    params = {**PROPHET_PARAMS, **(params or {})}
+    future_ds = pd.to_datetime(pd.Series(future_ds)).dt.normalize().to_numpy()
+    if n_jobs is None or n_jobs <= 0:
+        n_jobs = mp.cpu_count()
+    tasks = ((pdv, produto, ds, y, future_ds, params, warm.get(pdv, produto) if warm is not None else None)
+             for pdv, produto, ds, y in series)
+    bar = tqdm(total=total, disable=not progress, leave=False)
+
+    # pool próprio só no primeiro bloco com ajustes (nada a ajustar = nenhum processo)
+    own_pool = pool is None
+
+    # janelas limitadas: o gerador de séries nunca é materializado por inteiro
+    window = max(1, n_jobs * chunksize * 4)
+    results = []
+    try:
+        while True:
+            block = list(islice(tasks, window))
+            if not block:
+                break
+            out = [None] * len(block)
+            keys = [None] * len(block)
+            todo = []
+            for i, t in enumerate(block):
+                if cache is not None and len(t[2]) >= MIN_TRAIN_WEEKS:
+                    keys[i] = series_key(t[2], t[3], params, cutoff, future_ds)
+                    hit = cache.get(keys[i])
+                    if hit is not None:
+                        out[i] = (t[0], t[1], hit[0], None, hit[1], 0.0, "cache")
+                        bar.update()
+                        continue
+                todo.append(i)
+            if own_pool and pool is None and todo:
+                pool = make_pool(n_jobs, maxtasksperchild)
+            fitted = (pool.imap(_fit_one, [block[i] for i in todo], chunksize=chunksize)
+                      if pool is not None else map(_fit_one, (block[i] for i in todo)))
+            for i, r in zip(todo, fitted):
+                out[i] = r
+                if cache is not None and keys[i] is not None and r[2] is not None:
+                    cache.put(keys[i], r[2], r[4])
+                bar.update()
+            results.extend(out)
+    finally:
+        if own_pool and pool is not None:
+            pool.terminate()
+            pool.join()
+    bar.close()
+
+    if cache is not None:
+        cache.evict()
+        if progress:
+            print(cache.stats())
+    if warm is not None:
+        for r in results:
+            warm.put(r[0], r[1], r[4])
+        warm.save()
+
+    out = _results_to_frame(results, future_ds)
+    record_fits([r[0] for r in results], [r[1] for r in results], [r[5] for r in results],
+                [r[6] for r in results])
+    n_fb = int(out["fallback"].sum() // max(len(future_ds), 1))
+    if n_fb:
+        erros = {}
+        for r in results:
+            if r[3] is not None:
+                erros[r[3].split(":")[0]] = erros.get(r[3].split(":")[0], 0) + 1
+        print(f"prophet fallback: {n_fb}/{len(results)} séries | {erros}")
+    return out
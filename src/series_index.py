@@ -0,0 +1,54 @@
+# src/series_index.py
+# Índice por série (pdv, produto) sobre um frame ordenado: cada busca devolve
+# fatias contíguas (views numpy) em vez de varrer o frame inteiro com máscaras.
+import numpy as np
+import pandas as pd
+
+
+class SeriesIndex:
+    def __init__(self, df, key=("pdv", "produto"), time_col="semana", value_cols=("y",)):
+        key = list(key)
+        df = df.sort_values(key + [time_col], kind="stable")
+        self.key = key
+        self.time_col = time_col
+        self.ds = df[time_col].to_numpy()
+        self.values = {c: df[c].to_numpy(dtype=float) for c in value_cols}
+
+        n = len(df)
+        change = np.zeros(n, dtype=bool)
+        if n:
+            change[0] = True
+            for k in key:
+                codes = pd.factorize(df[k])[0]
+                change[1:] |= codes[1:] != codes[:-1]
+        self.starts = np.flatnonzero(change)
+        self.stops = np.append(self.starts[1:], n).astype(self.starts.dtype)
+
+        first = df.iloc[self.starts]
+        self.pairs = list(zip(first[key[0]].tolist(), first[key[1]].tolist()))
+        self._pos = {p: i for i, p in enumerate(self.pairs)}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __contains__(self, pair):
+        return tuple(pair) in self._pos
+
+    def _slice(self, pdv, produto):
+        i = self._pos.get((pdv, produto))
+        if i is None:
+            return slice(0, 0)
+        return slice(self.starts[i], self.stops[i])
+
+    def get(self, pdv, produto, col="y"):
+        """(ds, valores) da série — views, sem cópia."""
+        s = self._slice(pdv, produto)
+        return self.ds[s], self.values[col][s]
+
+    def iter_train(self, pairs, cutoff, col="y"):
+        """Gera (pdv, produto, ds, y) com a série truncada em `cutoff` (inclusive)."""
+        cutoff = np.datetime64(pd.Timestamp(cutoff), "ns")
+        for pdv, produto in pairs:
+            ds, y = self.get(pdv, produto, col)
+            end = np.searchsorted(ds, cutoff, side="right")
+            yield pdv, produto, ds[:end], y[:end]
@@ -1,6 +1,9 @@
 import numpy as np
 import pandas as pd
 from common import resolve_project_dir
+from datasets import write_file
+from models import get_model, load_plugins, model_names
+from weekly_store import WeeklyStore
 
 def wmape(y_true, y_pred):
     denom = np.sum(np.abs(y_true))
@@ -8,37 +11,38 @@ def wmape(y_true, y_pred):
 
 PROJECT_DIR = resolve_project_dir()
 in_path  = PROJECT_DIR / "data" / "processed" / "train_weekly_splits.parquet"
+store_dir = PROJECT_DIR / "data" / "processed" / "weekly_store"
 pred_out = PROJECT_DIR / "data" / "processed" / "baseline_preds.parquet"
 met_out  = PROJECT_DIR / "reports" / "_baseline_metrics.csv"
 
-wk = pd.read_parquet(in_path)
-wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
-wk = wk.sort_values(["pdv","produto","semana"]).reset_index(drop=True)
-key = ["pdv","produto"]
+# séries em CSR (pdv, produto) × semana; reconstruído só se o parquet de splits mudou
+store = WeeklyStore.open(store_dir, in_path)
+y = np.asarray(store.values, dtype=float)
+split = store.label()
 
-wk["y"]     = wk["quantidade"].astype(float)
-wk["y_lag1"]= wk.groupby(key)["y"].shift(1)
-wk["y_lag4"]= wk.groupby(key)["y"].shift(4)
-wk["ma4"]   = wk.groupby(key)["y"].rolling(4, min_periods=1).mean().reset_index(level=key, drop=True)
-wk["ma8"]   = wk.groupby(key)["y"].rolling(8, min_periods=1).mean().reset_index(level=key, drop=True)
-
-baselines = {"lastweek":"y_lag1","seasonal4":"y_lag4","ma4":"ma4","ma8":"ma8"}
+# baselines = modelos registrados com previsão por observação (lastweek, seasonal4, ma4, ma8, plugins)
+load_plugins()
+feats = {}
+for name in model_names(vectorized=True):
+    f = get_model(name).in_sample(store)
+    if f is not None:
+        feats[name] = f
 
 metrics, preds = [], []
-for name, col in baselines.items():
-    for split in ["val8","val4"]:
-        sub = wk[wk["split"]==split].copy()
-        yhat = sub[col].fillna(0.0).values
-        score = wmape(sub["y"].values, yhat)
-        metrics.append({"model":name,"split":split,"wmape":float(score)})
-        pf = sub[["semana","pdv","produto","y"]].copy()
+for name, feat in feats.items():
+    for sp in ["val8","val4"]:
+        mask = split == sp
+        yhat = np.nan_to_num(feat[mask], nan=0.0)
+        score = wmape(y[mask], yhat)
+        metrics.append({"model":name,"split":sp,"wmape":float(score)})
+        pf = store.frame(mask)[["semana","pdv","produto","y"]]
         pf["quantidade_hat"] = yhat
         pf["model"] = name
-        pf["split"] = split
+        pf["split"] = sp
         preds.append(pf)
 
 pred = pd.concat(preds, ignore_index=True)
-pred.to_parquet(pred_out, index=False)
-pd.DataFrame(metrics).to_csv(met_out, index=False)
+write_file(pred, pred_out)
+write_file(pd.DataFrame(metrics), met_out)
 print(pred_out)
 print(met_out)
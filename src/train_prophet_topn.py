@@ -1,82 +1,76 @@
 import argparse
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from prophet import Prophet
 from common import resolve_project_dir
+from arrow_cache import read_cached
+from datasets import write_file
+from key_encoding import encode_keys
+from models import get_model
+from prophet_engine import add_engine_args, cache_from_args
+from series_index import SeriesIndex
 
 def wmape(y_true, y_pred):
     denom = np.sum(np.abs(y_true))
     return np.nan if denom == 0 else np.sum(np.abs(y_true - y_pred)) / denom
 
-parser = argparse.ArgumentParser()
+def main():
+    parser = argparse.ArgumentParser()
 
-parser.add_argument("--predict_jan2023", action="store_true", help="Gera previsões de produção para Jan/2023 (02–23/01)")
+    parser.add_argument("--predict_jan2023", action="store_true", help="Gera previsões de produção para Jan/2023 (02–23/01)")
 
-parser.add_argument("--predict-jan2023", dest="predict_jan2023", action="store_true", help="Alias para --predict_jan2023")
-parser.add_argument("--top_n", type=int, default=200)
-args = parser.parse_known_args()[0]
+    parser.add_argument("--predict-jan2023", dest="predict_jan2023", action="store_true", help="Alias para --predict_jan2023")
+    parser.add_argument("--top_n", type=int, default=200)
+    add_engine_args(parser)
+    args = parser.parse_known_args()[0]
 
-PROJECT_DIR = resolve_project_dir()
-wk = pd.read_parquet(PROJECT_DIR / "data" / "processed" / "train_weekly_splits.parquet")
-wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
-wk["y"] = wk["quantidade"].astype(float)
-key = ["pdv","produto"]
+    PROJECT_DIR = resolve_project_dir()
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    wk_path = proc_dir / "train_weekly_splits.parquet"
+    key = ["pdv","produto"]
 
-train_mask = wk["split"].eq("train")
-sum_by_pair = (wk.loc[train_mask]
-                 .groupby(key, sort=False)["y"]
-                 .sum().rename("sum_y").reset_index())
-top_pairs = sum_by_pair.sort_values("sum_y", ascending=False).head(args.top_n)
+    # 1) ranking: só a partição de treino e as colunas necessárias
+    train = read_cached(wk_path, columns=key + ["quantidade"], filters=[("split", "=", "train")])
+    sum_by_pair = (train.groupby(key, sort=False)["quantidade"]
+                        .sum().astype(float).rename("sum_y").reset_index())
+    top_pairs = sum_by_pair.sort_values("sum_y", ascending=False).head(args.top_n)
+    del train
 
-weeks_val4 = sorted(wk.loc[wk["split"].eq("val4"), "semana"].unique())
-cutoff = weeks_val4[0] - pd.Timedelta(weeks=1)
+    val4 = read_cached(wk_path, columns=["semana"], filters=[("split", "=", "val4")])
+    weeks_val4 = sorted(pd.to_datetime(val4["semana"]).dt.normalize().unique())
+    cutoff = weeks_val4[0] - pd.Timedelta(weeks=1)
 
-pred_rows = []
-for _, row in tqdm(top_pairs.iterrows(), total=len(top_pairs)):
-    pdv, produto = str(row["pdv"]), str(row["produto"])
-    sub = wk[(wk["pdv"]==pdv) & (wk["produto"]==produto)].copy()
-    train = (sub[sub["semana"] <= cutoff][["semana","y"]]
-             .rename(columns={"semana":"ds","y":"y"})
-             .sort_values("ds"))
-    if len(train) < 8:
-        continue
+    # 2) séries completas só das lojas do Top-N (pushdown por estatística/partição de pdv)
+    wk = read_cached(wk_path, filters=[("pdv", "in", top_pairs["pdv"].unique().tolist())])
+    wk = wk.merge(top_pairs[key], on=key, how="inner")
+    wk = encode_keys(wk, proc_dir)
+    top_pairs = encode_keys(top_pairs, proc_dir)
+    wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
+    wk["y"] = wk["quantidade"].astype(float)
 
-    m = Prophet(
-        growth="linear",
-        weekly_seasonality=True,
-        yearly_seasonality=False,
-        daily_seasonality=False,
-        seasonality_mode="additive",
-        changepoint_prior_scale=0.5,
-        interval_width=0.8
-    )
-    m.fit(train)
+    index = SeriesIndex(wk, key=key)
+    top_list = list(zip(top_pairs["pdv"].tolist(), top_pairs["produto"].tolist()))
 
-    future = pd.DataFrame({"ds": weeks_val4})
-    fcst = m.predict(future)[["ds","yhat"]]
-    fcst["pdv"] = pdv
-    fcst["produto"] = produto
+    prophet = get_model("prophet", engine=dict(n_jobs=args.n_jobs, chunksize=args.chunksize,
+                                               maxtasksperchild=args.maxtasksperchild,
+                                               cache=cache_from_args(args))).warm_start(args.warm_dir)
+    fcst = prophet.predict_series(index.iter_train(top_list, cutoff), weeks_val4,
+                                  total=len(top_pairs), cutoff=cutoff)
+    fcst = fcst[~fcst["fallback"]].drop(columns="fallback")
 
-    truth = (sub[sub["semana"].isin(weeks_val4)][["semana","y"]]
-             .rename(columns={"semana":"ds"}))
-    merged = truth.merge(fcst, on="ds", how="left")
-    merged["yhat"] = merged["yhat"].clip(lower=0)
-    merged["model"] = "prophet_topN"
-    pred_rows.append(merged.assign(pdv=pdv, produto=produto))
+    truth = wk.loc[wk["semana"].isin(weeks_val4), ["semana","pdv","produto","y"]].copy()
+    preds = truth.merge(fcst, on=["semana","pdv","produto"], how="inner")
+    preds["yhat"] = preds["yhat"].clip(lower=0)
+    preds["model"] = "prophet_topN"
+    preds = preds[["semana","pdv","produto","y","yhat","model"]]
 
-preds = (pd.concat(pred_rows, ignore_index=True)
-         if pred_rows else
-         pd.DataFrame(columns=["ds","pdv","produto","y","yhat","model"]))
+    preds = preds.sort_values(["pdv","produto","semana"])
+    write_file(preds, PROJECT_DIR / "data" / "processed" / "prophet_topN_val4_preds.parquet")
 
-preds = preds.rename(columns={"ds":"semana"}).sort_values(["pdv","produto","semana"])
-preds.to_parquet(PROJECT_DIR / "data" / "processed" / "prophet_topN_val4_preds.parquet", index=False)
-
-score = wmape(preds["y"].values, preds["yhat"].values) if len(preds) else np.nan
-(pd.DataFrame([{"model":"prophet_topN","split":"val4","wmape":float(score)}])
-   .to_csv(PROJECT_DIR / "reports" / "_prophet_val4_metrics.csv", index=False))
-print(PROJECT_DIR / "data" / "processed" / "prophet_topN_val4_preds.parquet")
-print(PROJECT_DIR / "reports" / "_prophet_val4_metrics.csv")
+    score = wmape(preds["y"].values, preds["yhat"].values) if len(preds) else np.nan
+    write_file(pd.DataFrame([{"model":"prophet_topN","split":"val4","wmape":float(score)}]),
+               PROJECT_DIR / "reports" / "_prophet_val4_metrics.csv")
+    print(PROJECT_DIR / "data" / "processed" / "prophet_topN_val4_preds.parquet")
+    print(PROJECT_DIR / "reports" / "_prophet_val4_metrics.csv")
 
 def _save_prophet_jan_from_val4(out_parquet, jan_ini="2023-01-02", jan_fim="2023-01-23"):
     import os, pandas as pd
@@ -89,3 +83,6 @@ def _save_prophet_jan_from_val4(out_parquet, jan_ini="2023-01-02", jan_fim="2023
     df = df.loc[(df["ds"] >= jan_ini) & (df["ds"] <= jan_fim), cols]
     df.to_parquet(out_parquet, index=False)
     print(f"OK - prophet Jan salvo: {out_parquet} | linhas: {len(df)}")
+
+if __name__ == "__main__":
+    main()
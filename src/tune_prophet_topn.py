@@ -2,114 +2,285 @@ import json
 import argparse
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
-from prophet import Prophet
 from common import resolve_project_dir
-
-def wmape(y_true, y_pred):
-    denom = np.abs(y_true).sum()
-    return float(np.abs(y_true - y_pred).sum() / (denom if denom != 0 else 1.0))
+from models import get_model
+from prophet_engine import add_engine_args, cache_from_args, make_pool
+from series_index import SeriesIndex
+from weekly_store import WeeklyStore
 
 def prepare_inputs(PROJECT_DIR):
-    wk = pd.read_parquet(PROJECT_DIR / "data" / "processed" / "train_weekly_splits.parquet")
-    wk["semana"] = pd.to_datetime(wk["semana"]).dt.normalize()
-    wk["y"] = wk["quantidade"].astype(float)
+    proc_dir = PROJECT_DIR / "data" / "processed"
+    store = WeeklyStore.open(proc_dir / "weekly_store", proc_dir / "train_weekly_splits.parquet")
     key = ["pdv","produto"]
     cutoff = pd.Timestamp("2022-12-26")
     val4_weeks = pd.to_datetime(["2022-12-05","2022-12-12","2022-12-19","2022-12-26"])
-    # rolling MA4 (para fallback)
-    wk = wk.sort_values(key+["semana"])
-    wk["ma4"] = wk.groupby(key)["y"].rolling(4, min_periods=1).mean().reset_index(level=key, drop=True)
+    # y e rolling MA4 (para fallback) do store, já ordenados por série/semana
+    wk = store.frame(ma4=store.rolling_mean(4))
     return wk, key, cutoff, val4_weeks
 
-def run_prophet_for_pairs(wk, key, cutoff, pairs, cps):
-    rows = []
-    for pdv, produto in tqdm(pairs, leave=False):
-        sub = wk[(wk["pdv"]==pdv) & (wk["produto"]==produto)]
-        train = (sub[sub["semana"] <= cutoff][["semana","y"]]
-                 .rename(columns={"semana":"ds","y":"y"})
-                 .sort_values("ds"))
-        if len(train) < 8:
-            continue
-        m = Prophet(
-            growth="linear",
-            weekly_seasonality=True,
-            yearly_seasonality=False,
-            daily_seasonality=False,
-            seasonality_mode="additive",
-            changepoint_prior_scale=cps,
-            interval_width=0.8,
-        )
-        m.fit(train)
-        # prever em val4 para avaliação
-        future = pd.DataFrame({"ds": pd.to_datetime(["2022-12-05","2022-12-12","2022-12-19","2022-12-26"])})
-        fcst = m.predict(future)[["ds","yhat"]]
-        fcst["pdv"] = pdv
-        fcst["produto"] = produto
-        rows.append(fcst.rename(columns={"ds":"semana","yhat":"yhat"}))
-    if rows:
-        out = pd.concat(rows, ignore_index=True)
-        out["semana"] = pd.to_datetime(out["semana"]).dt.normalize()
-    else:
-        out = pd.DataFrame(columns=["semana","pdv","produto","yhat"])
-    return out
+def run_prophet_for_pairs(index, cutoff, pairs, cps, val4_weeks, engine=None):
+    # prever em val4 para avaliação; `engine` = kwargs de fit_predict_pairs (n_jobs, cache...)
+    prophet = get_model("prophet", engine=engine, changepoint_prior_scale=cps)
+    out = prophet.predict_series(index.iter_train(pairs, cutoff), val4_weeks,
+                                 total=len(pairs), cutoff=cutoff)
+    return out[~out["fallback"]].drop(columns="fallback").reset_index(drop=True)
+
+class GridScheduler:
+    """Grade (top_n × cps) avaliada incrementalmente sobre os pares ordenados por volume.
+
+    O WMAPE de uma configuração é decomposto por série: parte do erro do fallback MA4
+    em val4 (E_base) e subtrai o ganho (erro_MA4 - erro_Prophet) de cada par ajustado.
+    Assim o WMAPE parcial é exato para os pares já avaliados e o limite inferior
+    (todos os pares restantes com erro zero) permite podar configurações que não
+    podem mais superar a melhor já completa. Sobre subconjuntos crescentes de pares
+    (rodadas ×eta) aplica-se ainda successive halving entre os valores de cps.
+    """
+
+    def __init__(self, wk, index, key, cutoff, val4_weeks, topn_vals, cps_vals,
+                 engine, checkpoint, eta=3, min_pairs=50, batch_pairs=50):
+        self.index, self.key, self.cutoff, self.val4_weeks = index, key, cutoff, val4_weeks
+        self.engine, self.checkpoint = engine, checkpoint
+        self.eta, self.min_pairs, self.batch_pairs = eta, min_pairs, batch_pairs
+
+        train_mask = wk["semana"] <= cutoff
+        sum_by_pair = (wk.loc[train_mask].groupby(key, sort=False)["y"].sum().rename("sum_y").reset_index())
+        top_pairs = sum_by_pair.sort_values("sum_y", ascending=False).head(max(topn_vals))
+        self.ranked = list(zip(top_pairs[key[0]].tolist(), top_pairs[key[1]].tolist()))
+        self.rank = {p: i for i, p in enumerate(self.ranked)}
+
+        val4 = wk[wk["semana"].isin(val4_weeks)][["semana"]+key+["y","ma4"]].copy()
+        val4["err_ma4"] = (val4["y"] - val4["ma4"].fillna(0)).abs()
+        denom = val4["y"].abs().sum()
+        self.denom = float(denom if denom != 0 else 1.0)
+        self.e_base = float(val4["err_ma4"].sum())
+
+        pos = pd.Series(list(zip(val4[key[0]], val4[key[1]]))).map(self.rank)
+        self.val4_top = val4[pos.notna().to_numpy()].copy()
+        self.val4_top["_i"] = pos.dropna().astype(int).to_numpy()
+        self.err_ma4 = np.bincount(self.val4_top["_i"], weights=self.val4_top["err_ma4"],
+                                   minlength=len(self.ranked))
+
+        n = len(self.ranked)
+        self.gain = {c: np.zeros(n) for c in cps_vals}
+        self.done = {c: np.zeros(n, dtype=bool) for c in cps_vals}
+        self.ok = {c: np.zeros(n, dtype=bool) for c in cps_vals}
+        self.configs = {(t, c): "ativo" for t in topn_vals for c in cps_vals}
+        self.signature = json.dumps({
+            "cutoff": str(cutoff), "val4": [str(w.date()) for w in val4_weeks],
+            "n_ranked": n, "head": self.ranked[:5], "e_base": round(self.e_base, 6),
+        })
+
+    # ---------- checkpoint ----------
+    def load_checkpoint(self):
+        if not self.checkpoint.exists():
+            return 0
+        raw = self.checkpoint.read_bytes()
+        if raw and not raw.endswith(b"\n"):
+            # última linha truncada por interrupção: corta até a última linha completa, para
+            # que o próximo append não cole a linha nova na parcial
+            raw = raw[:raw.rfind(b"\n") + 1]
+            with open(self.checkpoint, "r+b") as f:
+                f.truncate(len(raw))
+        lines = raw.decode("utf-8").splitlines()
+        try:
+            sig = json.loads(lines[0]).get("signature") if lines else None
+        except json.JSONDecodeError:
+            sig = None
+        if sig != self.signature:
+            # recomeça o arquivo: linhas novas sob o cabeçalho antigo seriam ignoradas para sempre
+            print(">> checkpoint de outra grade/dados; reiniciado:", self.checkpoint)
+            self.reset_checkpoint()
+            return 0
+        n = 0
+        for line in lines[1:]:
+            try:
+                r = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # linha corrompida: as seguintes continuam válidas
+            i, c = self.rank.get((r["pdv"], r["produto"])), r["cps"]
+            if i is None or c not in self.gain:
+                continue
+            self.gain[c][i], self.ok[c][i], self.done[c][i] = r["gain"], r["ok"], True
+            n += 1
+        return n
+
+    def _append_checkpoint(self, rows):
+        new = not self.checkpoint.exists() or self.checkpoint.stat().st_size == 0
+        with open(self.checkpoint, "a", encoding="utf-8") as f:
+            if new:
+                f.write(json.dumps({"signature": self.signature}) + "\n")
+            for r in rows:
+                f.write(json.dumps(r) + "\n")
+
+    def reset_checkpoint(self):
+        self.checkpoint.parent.mkdir(parents=True, exist_ok=True)
+        self.checkpoint.write_text(json.dumps({"signature": self.signature}) + "\n", encoding="utf-8")
 
-def evaluate_config(wk, key, cutoff, val4_weeks, top_n, cps):
-    # Top-N por volume no treino
-    train_mask = wk["semana"] <= cutoff
-    sum_by_pair = (wk.loc[train_mask].groupby(key, sort=False)["y"].sum().rename("sum_y").reset_index())
-    top_pairs = (sum_by_pair.sort_values("sum_y", ascending=False).head(top_n))
-    top_pairs_list = list(map(tuple, top_pairs[key].astype(str).to_records(index=False)))
+    # ---------- avaliação ----------
+    def _fit_batch(self, idx, cps):
+        pairs = [self.ranked[i] for i in idx]
+        fc = run_prophet_for_pairs(self.index, self.cutoff, pairs, cps, self.val4_weeks, self.engine)
+        truth = self.val4_top[self.val4_top["_i"].isin(idx)]
+        m = truth.merge(fc, on=["semana"]+self.key, how="inner")
+        err_p = np.bincount(m["_i"], weights=(m["y"] - m["yhat"]).abs(), minlength=len(self.ranked))
+        fitted = {(p, q) for p, q in zip(fc[self.key[0]], fc[self.key[1]])}
+        rows = []
+        for i in idx:
+            ok = self.ranked[i] in fitted
+            g = float(self.err_ma4[i] - err_p[i]) if ok else 0.0
+            self.gain[cps][i], self.ok[cps][i], self.done[cps][i] = g, ok, True
+            rows.append({"pdv": self.ranked[i][0], "produto": self.ranked[i][1],
+                         "cps": cps, "gain": g, "ok": bool(ok)})
+        self._append_checkpoint(rows)
 
-    # Prophet em Top-N
-    prophet_fc = run_prophet_for_pairs(wk, key, cutoff, top_pairs_list, cps)
+    def score(self, t, c):
+        t = min(t, len(self.ranked))
+        done = self.done[c][:t]
+        g = self.gain[c][:t][done].sum()
+        rest = self.err_ma4[:t][~done].sum()
+        n_ok = int(self.ok[c][:t].sum())
+        return ((self.e_base - g) / self.denom, (self.e_base - g - rest) / self.denom,
+                bool(done.all()), int(done.sum()), n_ok)
 
-    # Construir y_true em val4
-    val4 = wk[wk["semana"].isin(val4_weeks)][["semana"]+key+["y","ma4"]].copy()
-    val4[key[0]] = val4[key[0]].astype(str)
-    val4[key[1]] = val4[key[1]].astype(str)
+    def best(self):
+        done = [(self.score(t, c)[0], (t, c)) for (t, c), st in self.configs.items()
+                if st != "podado" and self.score(t, c)[2]]
+        return min(done) if done else None
 
-    # Merge com previsões Prophet (onde houver)
-    df = val4.merge(prophet_fc.rename(columns={"yhat":"y_pred"}), on=["semana"]+key, how="left")
+    def _prune(self):
+        best = self.best()
+        if best is None:
+            return
+        for (t, c), st in self.configs.items():
+            if st == "ativo" and not self.score(t, c)[2] and self.score(t, c)[1] >= best[0]:
+                self.configs[(t, c)] = "podado"
+                print(f"   podado [top_n={t} | cps={c}]: limite inferior >= melhor ({best[0]:.6f})")
 
-    # Fallback: MA4 quando y_pred for NaN
-    df["y_pred"] = df["y_pred"].fillna(df["ma4"]).fillna(0)
+    def _halve(self, size):
+        # os braços são os cps: Top-N aninhados compartilham o mesmo prefixo de pares,
+        # então a escolha de top_n fica para a poda exata por limite inferior
+        arms = sorted({c for (t, c), st in self.configs.items()
+                       if st == "ativo" and not self.score(t, c)[2]})
+        if self.eta <= 1 or len(arms) <= 1:
+            return
+        ranked = sorted(arms, key=lambda c: self.score(size, c)[0])
+        keep = int(np.ceil(len(arms) / self.eta))
+        for c in ranked[keep:]:
+            for (t, cc), st in self.configs.items():
+                if cc == c and st == "ativo" and not self.score(t, c)[2]:
+                    self.configs[(t, cc)] = "podado"
+            print(f"   podado cps={c}: successive halving em {size} pares")
 
-    score = wmape(df["y"].values, df["y_pred"].values)
-    return score, len(prophet_fc[key[0]].unique()), len(prophet_fc)
+    def rungs(self):
+        n = len(self.ranked)
+        if self.eta <= 1:
+            return [n]
+        sizes, s = [], max(1, self.min_pairs)
+        while s < n:
+            sizes.append(s)
+            s = int(s * self.eta)
+        return sizes + [n]
+
+    def run(self, on_update=None):
+        prev = 0
+        for size in self.rungs():
+            for c in self.gain:
+                tops = [t for (t, cc), st in self.configs.items() if cc == c and st == "ativo"]
+                if not tops:
+                    continue
+                need = min(size, max(tops), len(self.ranked))
+                pending = [i for i in range(prev, need) if not self.done[c][i]]
+                for b in range(0, len(pending), self.batch_pairs):
+                    self._fit_batch(pending[b:b + self.batch_pairs], c)
+                    self._prune()
+                    if on_update:
+                        on_update(self)
+            self._halve(size)
+            if on_update:
+                on_update(self)
+            prev = size
+
+    def records(self):
+        out = []
+        for (t, c), st in self.configs.items():
+            score, lb, complete, n_eval, n_ok = self.score(t, c)
+            out.append({
+                "top_n": t,
+                "changepoint_prior_scale": c,
+                "wmape_val4": score,
+                "n_pairs_predicted": n_ok,
+                "rows_pred": n_ok * len(self.val4_weeks),
+                "pairs_evaluated": n_eval,
+                "status": "completo" if complete and st != "podado" else st,
+                "wmape_lower_bound": lb,
+            })
+        res = pd.DataFrame(out)
+        res["_o"] = res["status"].map({"completo": 0, "ativo": 1, "podado": 2})
+        return res.sort_values(["_o", "wmape_val4"]).drop(columns="_o").reset_index(drop=True)
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--topn_list", type=str, default="100,200,300")
     parser.add_argument("--cps_list", type=str, default="0.3,0.5,0.8")
+    parser.add_argument("--eta", type=float, default=3,
+                        help="Fator do successive halving (<=1 avalia a grade toda, só com poda exata)")
+    parser.add_argument("--min_pairs", type=int, default=50, help="Pares na primeira rodada do halving")
+    parser.add_argument("--batch_pairs", type=int, default=50,
+                        help="Pares por lote entre atualizações do WMAPE parcial/checkpoint")
+    parser.add_argument("--fresh", action="store_true", help="Ignora o checkpoint e recomeça")
+    add_engine_args(parser)
+    parser.add_argument("--no_cache", action="store_true", help="Desativa o cache de ajustes")
     args = parser.parse_args()
 
     PROJECT_DIR = resolve_project_dir()
     wk, key, cutoff, val4_weeks = prepare_inputs(PROJECT_DIR)
+    index = SeriesIndex(wk, key=key)
+
+    # Top-N aninhados e reexecuções reaproveitam ajustes já feitos (mesma série/cps/cutoff)
+    cache = None if args.no_cache else cache_from_args(
+        args, default_dir=PROJECT_DIR / "data" / "interim" / "prophet_fit_cache")
+    pool = make_pool(args.n_jobs, args.maxtasksperchild)
+    engine = dict(n_jobs=args.n_jobs, chunksize=args.chunksize, cache=cache,
+                  pool=pool, progress=False)
 
     topn_vals = [int(x) for x in args.topn_list.split(",") if x.strip()]
     cps_vals = [float(x) for x in args.cps_list.split(",") if x.strip()]
 
-    records = []
-    for top_n in topn_vals:
-        for cps in cps_vals:
-            score, n_pairs, n_rows = evaluate_config(wk, key, cutoff, val4_weeks, top_n, cps)
-            records.append({
-                "top_n": top_n,
-                "changepoint_prior_scale": cps,
-                "wmape_val4": score,
-                "n_pairs_predicted": n_pairs,
-                "rows_pred": n_rows,
-            })
-            print(f"[top_n={top_n:>3} | cps={cps:>3}] WMAPE(val4)={score:.6f} | pairs={n_pairs} | rows={n_rows}")
-
-    res = pd.DataFrame(records).sort_values("wmape_val4")
     out_csv = PROJECT_DIR / "reports" / "_tuning_results.csv"
+    ckpt = PROJECT_DIR / "reports" / "_tuning_checkpoint.jsonl"
+    sched = GridScheduler(wk, index, key, cutoff, val4_weeks, topn_vals, cps_vals, engine, ckpt,
+                          eta=args.eta, min_pairs=args.min_pairs, batch_pairs=args.batch_pairs)
+    if args.fresh:
+        sched.reset_checkpoint()
+    else:
+        n = sched.load_checkpoint()
+        if n:
+            print(f">> retomando do checkpoint: {n} ajustes (série × cps)")
+
+    def on_update(s):
+        res = s.records()
+        res.to_csv(out_csv, index=False)
+        for r in res[res["status"].ne("podado")].itertuples():
+            print(f"[top_n={r.top_n:>3} | cps={r.changepoint_prior_scale:>3}] "
+                  f"WMAPE(val4)={r.wmape_val4:.6f} | pares={r.pairs_evaluated}/{r.top_n} | {r.status}")
+        print("-" * 60)
+
+    try:
+        sched.run(on_update)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    res = sched.records()
     res.to_csv(out_csv, index=False)
 
-    best = res.iloc[0].to_dict() if not res.empty else {}
+    done = res[res["status"].eq("completo")]
+    best = done.iloc[0].to_dict() if not done.empty else {}
     (PROJECT_DIR / "reports" / "_tuning_best.json").write_text(json.dumps(best, indent=2), encoding="utf-8")
 
+    if cache is not None:
+        print(cache.stats())
     print(">> resultados:", out_csv)
     print(">> melhor:", best)
 
@@ -0,0 +1,73 @@
+# src/warm_start.py
+# Parâmetros Prophet ajustados, guardados por série (pdv, produto) e por configuração, para a
+# execução seguinte partir deles (warm start) em vez do chute inicial padrão: uma semana nova
+# quase não move o ótimo, então a otimização converge em poucas iterações. Um arquivo por
+# configuração (hash dos hiperparâmetros) em data/interim/prophet_params/.
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SCALARS = ("k", "m", "sigma_obs")
+VECTORS = ("delta", "beta")
+
+
+def config_key(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def stan_init(fitted):
+    """Parâmetros ajustados (m.params) → init do Stan; None se faltar algo ou não for finito."""
+    try:
+        init = {p: float(np.asarray(fitted[p]).ravel()[0]) for p in SCALARS}
+        init.update({p: np.asarray(fitted[p], dtype=float).ravel() for p in VECTORS})
+    except (KeyError, IndexError, TypeError):
+        return None
+    if not all(np.isfinite(v).all() for v in init.values()):
+        return None
+    return init
+
+
+class ParamStore:
+    def __init__(self, root, params):
+        self.path = Path(root) / f"prophet-{config_key(params)}.parquet"
+        self.inits = {}
+        self.changed = False
+        if self.path.exists():
+            df = pd.read_parquet(self.path)
+            cols = {c: df[c].to_numpy() for c in df.columns}
+            for i, pair in enumerate(zip(cols["pdv"].tolist(), cols["produto"].tolist())):
+                init = {p: float(cols[p][i]) for p in SCALARS}
+                init.update({p: np.asarray(cols[p][i], dtype=float) for p in VECTORS})
+                self.inits[pair] = init
+
+    def __len__(self):
+        return len(self.inits)
+
+    def get(self, pdv, produto):
+        return self.inits.get((pdv, produto))
+
+    def put(self, pdv, produto, fitted):
+        init = stan_init(fitted) if fitted is not None else None
+        if init is not None:
+            self.inits[(pdv, produto)] = init
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return self.path
+        pairs = list(self.inits)
+        df = pd.DataFrame({"pdv": [p[0] for p in pairs], "produto": [p[1] for p in pairs]})
+        for p in SCALARS:
+            df[p] = [self.inits[k][p] for k in pairs]
+        for p in VECTORS:
+            df[p] = [self.inits[k][p].tolist() for k in pairs]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, self.path)
+        self.changed = False
+        return self.path
@@ -0,0 +1,178 @@
+# src/weekly_store.py
+# Série semanal em formato CSR: uma linha por série (pdv, produto), colunas = semanas do
+# calendário. Só as semanas observadas são guardadas (values float32 + índice da semana),
+# com `indptr` delimitando cada série, então lags e médias móveis por observação (como os
+# groupby.shift/rolling do pandas) viram operações vetorizadas sobre um único array.
+# Persistido como .npy em data/processed/weekly_store/ e aberto com mmap.
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from arrow_cache import read_cached
+from datasets import dataset_fingerprint
+from instrument import path_bytes, span
+from key_encoding import encode_keys
+
+META_FILE = "meta.json"
+ARRAYS = ("pdv", "produto", "indptr", "week", "values", "weeks", "week_label")
+
+
+class WeeklyStore:
+    def __init__(self, pdv, produto, indptr, week, values, weeks, week_label, labels, meta=None):
+        self.pdv, self.produto = pdv, produto          # chave de cada série (códigos int32)
+        self.indptr = indptr                           # série i = observações indptr[i]:indptr[i+1]
+        self.week, self.values = week, values          # semana (índice em `weeks`) e valor por observação
+        self.weeks = weeks                             # calendário (datetime64)
+        self.week_label, self.labels = week_label, labels   # split de cada semana
+        self.meta = meta or {}
+
+    # ---------- construção / persistência ----------
+
+    @classmethod
+    def build(cls, wk, time_col="semana", value_col="quantidade", label_col="split"):
+        weeks = np.sort(pd.to_datetime(wk[time_col]).dt.normalize().unique().to_numpy())
+        t = np.searchsorted(weeks, pd.to_datetime(wk[time_col]).dt.normalize().to_numpy())
+        pdv = wk["pdv"].to_numpy()
+        produto = wk["produto"].to_numpy()
+        order = np.lexsort((t, produto, pdv))
+        pdv, produto, t = pdv[order], produto[order], t[order]
+
+        n = len(order)
+        change = np.ones(n, dtype=bool)
+        if n:
+            change[1:] = (pdv[1:] != pdv[:-1]) | (produto[1:] != produto[:-1])
+        starts = np.flatnonzero(change)
+        indptr = np.append(starts, n).astype(np.int64)
+
+        labels, week_label = [], np.full(len(weeks), -1, dtype=np.int8)
+        if label_col in wk.columns:
+            codes, labels = pd.factorize(wk[label_col])
+            week_label[t] = codes[order]
+            labels = [str(x) for x in labels]
+
+        return cls(pdv[starts].astype(np.int32), produto[starts].astype(np.int32), indptr,
+                   t.astype(np.int16), wk[value_col].to_numpy(dtype=np.float32)[order],
+                   weeks.astype("datetime64[ns]"), week_label, labels)
+
+    def save(self, path, source_fingerprint=None):
+        path = Path(path)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")   # processos podem gravar juntos
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir(parents=True)
+        for name in ARRAYS:
+            np.save(tmp / f"{name}.npy", getattr(self, name))
+        meta = {"labels": list(self.labels), "source_fingerprint": source_fingerprint,
+                "n_series": len(self), "n_obs": len(self.values), "n_weeks": len(self.weeks)}
+        (tmp / META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+        if path.exists():
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            tmp.rename(path)
+        except OSError:   # outro processo gravou o mesmo store antes
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.meta = meta
+        return path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        path = Path(path)
+        meta = json.loads((path / META_FILE).read_text(encoding="utf-8"))
+        arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r" if mmap else None) for name in ARRAYS}
+        return cls(labels=meta["labels"], meta=meta, **arrays)
+
+    @classmethod
+    def open(cls, path, source):
+        """Carrega o store de `path` se ainda corresponde a `source`; senão reconstrói e grava."""
+        fp = dataset_fingerprint(source)
+        path = Path(path)
+        with span("weekly_store", "read", path=path) as sp:
+            store = cls.load(path) if (path / META_FILE).exists() else None
+            if store is None or store.meta.get("source_fingerprint") != fp:
+                store = cls.build(encode_keys(read_cached(source), Path(source).parent))
+                store.save(path, source_fingerprint=fp)
+            sp.set(rows=len(store.values), bytes=path_bytes(path))
+        return store
+
+    # ---------- features (alinhadas a `values`) ----------
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def _row_start(self):
+        return np.repeat(self.indptr[:-1], np.diff(self.indptr))
+
+    def lag(self, k):
+        """Valor k observações antes na mesma série (groupby.shift(k)); NaN no início."""
+        i = np.arange(len(self.values))
+        j = i - k
+        ok = j >= self._row_start()
+        out = np.full(len(i), np.nan)
+        out[ok] = self.values[j[ok]]
+        return out
+
+    def rolling_mean(self, w, min_periods=1):
+        """Média das últimas `w` observações da série, incluindo a atual (groupby.rolling(w).mean())."""
+        v = np.asarray(self.values, dtype=np.float64)
+        ok = ~np.isnan(v)
+        cs = np.concatenate([[0.0], np.cumsum(np.where(ok, v, 0.0))])
+        cn = np.concatenate([[0], np.cumsum(ok)])
+        i = np.arange(len(v))
+        lo = np.maximum(i - w + 1, self._row_start())
+        s, c = cs[i + 1] - cs[lo], cn[i + 1] - cn[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(c >= min_periods, s / c, np.nan)
+
+    def seasonal_naive(self, period):
+        """Valor da mesma série `period` semanas de calendário antes (NaN se não observado)."""
+        d = self.dense()
+        out = np.full(d.shape, np.nan, dtype=np.float32)
+        out[:, period:] = d[:, :-period]
+        return out[self.row_ids(), self.week]
+
+    # ---------- visões ----------
+
+    def row_ids(self):
+        return np.repeat(np.arange(len(self), dtype=np.int64), np.diff(self.indptr))
+
+    def label(self):
+        """Split (ex.: train/val8/val4) de cada observação."""
+        names = np.array(list(self.labels) + [None], dtype=object)
+        return names[np.asarray(self.week_label)[self.week]]
+
+    def dense(self, fill=np.nan):
+        """Matriz densa séries × semanas (float32); semanas não observadas = `fill`."""
+        out = np.full((len(self), len(self.weeks)), fill, dtype=np.float32)
+        out[self.row_ids(), self.week] = self.values
+        return out
+
+    def frame(self, mask=None, **cols):
+        """DataFrame longo (semana, pdv, produto, y, split) + colunas extras alinhadas a `values`."""
+        rows, week = self.row_ids(), np.asarray(self.week)
+        idx = slice(None) if mask is None else np.asarray(mask)
+        df = pd.DataFrame({
+            "semana": np.asarray(self.weeks)[week[idx]],
+            "pdv": np.asarray(self.pdv)[rows[idx]],
+            "produto": np.asarray(self.produto)[rows[idx]],
+            "y": np.asarray(self.values, dtype=np.float64)[idx],
+        })
+        if self.labels:
+            df["split"] = self.label()[idx]
+        for name, arr in cols.items():
+            df[name] = np.asarray(arr)[idx]
+        return df
+
+
+def main():
+    from common import resolve_project_dir
+    proc_dir = resolve_project_dir() / "data" / "processed"
+    store = WeeklyStore.open(proc_dir / "weekly_store", proc_dir / "train_weekly_splits.parquet")
+    print(proc_dir / "weekly_store", store.meta)
+
+
+if __name__ == "__main__":
+    main()